@@ -1,12 +1,47 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from experiment_analysis import ExperimentAnalysis
-import seaborn as sns
+# scipy (experiment_analysis, assignment_index) and plotly are imported where they are first
+# used, so a new session renders the upload step without loading them
+from hashing import DEFAULT_HASH_BACKEND, HASH_BACKENDS
+from data_loading import list_excel_sheets, preview_excel, read_excel_columns
+from partitioned_loading import load_parts
+from dataset_store import DatasetStore, content_key
+from unit_ids import DUPLICATE_FLAG_COLUMN, count_duplicate_ids, handle_duplicate_units, normalize_ids
+from profiling import (describe_from_profile, profile_dataset, suggest_group_columns,
+                       suggest_id_columns, suggest_metric_columns, suggest_stratum_columns,
+                       suggest_sum_columns)
 import io
+import os
 import base64
+import tempfile
+import uuid
+
+# Sessions share uploaded datasets through shallow copies, which is only safe with Copy-on-Write
+# (always on from pandas 3.0)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# 重复实验单元处理方式（unit_ids.DUPLICATE_POLICIES）
+DUPLICATE_POLICY_LABELS = {'flag': '标记', 'drop': '删除重复', 'aggregate': '合并（指标求和）'}
+
+# 指标截尾（winsorization）选项：标签 -> 上分位数
+CAP_QUANTILE_OPTIONS = {'不截尾': None, 'P99': 0.99, 'P99.9': 0.999, 'P99.99': 0.9999}
+# 缺失值处理方式（显示名称 -> run_statistical_tests 的 missing 参数）
+MISSING_OPTIONS = {'仅在该指标中排除': 'exclude', '视为0': 'zero', '删除有缺失值的用户': 'drop_unit'}
+# 多重比较校正方法（显示名称 -> run_statistical_tests 的 correction 参数）
+CORRECTION_OPTIONS = {'不校正': None, 'Bonferroni': 'bonferroni', 'Holm': 'holm',
+                      'Benjamini-Hochberg（FDR）': 'bh'}
+
+# 渐进式分析：抽样预览结果的刷新间隔（秒）；数据行数达到该值时默认开启（1%抽样约5万行）
+PROGRESSIVE_POLL_SECONDS = 0.5
+PROGRESSIVE_DEFAULT_ROWS = 5_000_000
+
+# 事后分层：平均每层用户数低于该值时提示分层过细
+STRATUM_MIN_AVG_UNITS = 100
+
+# Excel工作表的行数上限（含表头）
+EXCEL_MAX_ROWS = 1_048_576
 
 # Set page configuration
 st.set_page_config(
@@ -253,12 +288,14 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'data' not in st.session_state:
-    st.session_state.data = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+if 'dataset_key' not in st.session_state:
+    st.session_state.dataset_key = None
 if 'groups_configured' not in st.session_state:
     st.session_state.groups_configured = False
 if 'analyzer' not in st.session_state:
-    st.session_state.analyzer = ExperimentAnalysis()
+    st.session_state.analyzer = None
 if 'proportions' not in st.session_state:
     st.session_state.proportions = None
 if 'show_group_config' not in st.session_state:
@@ -281,17 +318,27 @@ if 'has_preexisting_groups' not in st.session_state:
     st.session_state.has_preexisting_groups = False
 if 'group_column' not in st.session_state:
     st.session_state.group_column = None
+if 'progressive' not in st.session_state:
+    st.session_state.progressive = None
 
 def reset_analysis():
     """Reset all session state variables to restart analysis"""
+    # Release this session's share of the dataset store
+    if 'session_id' in st.session_state:
+        dataset_store.release(st.session_state.session_id)
+    # Stop refining a progressive analysis nobody will look at
+    if st.session_state.get('progressive') is not None:
+        st.session_state.progressive['job'].cancel()
+    
     # Clear all session state variables completely
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     
     # Force reinitialization of all variables to their default states
-    st.session_state.data = None
+    st.session_state.session_id = str(uuid.uuid4())
+    st.session_state.dataset_key = None
     st.session_state.groups_configured = False
-    st.session_state.analyzer = ExperimentAnalysis()
+    st.session_state.analyzer = None
     st.session_state.proportions = None
     st.session_state.show_group_config = False
     st.session_state.show_metric_analysis = False
@@ -303,6 +350,7 @@ def reset_analysis():
     st.session_state.unit_id_col = None
     st.session_state.has_preexisting_groups = False
     st.session_state.group_column = None
+    st.session_state.progressive = None
     
     # Clear any widget states
     if 'seed_input' in st.session_state:
@@ -315,18 +363,152 @@ def reset_analysis():
     st.session_state.show_metric_analysis = False
     st.session_state.show_results = False
 
-def get_download_link(df, filename, text):
-    """Generate a download link for a DataFrame"""
+def excel_bytes(df):
+    """Content of an xlsx file holding a DataFrame"""
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         df.to_excel(writer, index=False, sheet_name='Sheet1')
-    excel_data = output.getvalue()
+    return output.getvalue()
+
+def get_download_link(df, filename, text):
+    """Generate a download link for a DataFrame"""
+    excel_data = excel_bytes(df)
     b64 = base64.b64encode(excel_data).decode()
     href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{text}</a>'
     return href
 
+def build_assignment_export(ids, buckets, experiment_name, hash_backend, proportions, bucket_range_width):
+    """Partitioned Parquet export of the assignments, zipped for download"""
+    from assignment_export import export_assignments, zip_export
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        export_dir = os.path.join(workdir, 'assignments')
+        export_assignments(ids, experiment_name, proportions, export_dir, hash_backend,
+                           bucket_range_width, buckets=buckets)
+        with open(zip_export(export_dir, os.path.join(workdir, 'assignments.zip')), 'rb') as f:
+            return f.read()
+
+@st.cache_data(show_spinner=False)
+def cached_excel_sheets(file_bytes, filename):
+    """List the sheets of an uploaded workbook once per file"""
+    return list_excel_sheets(file_bytes, filename)
+
+@st.cache_data(show_spinner=False)
+def cached_excel_preview(file_bytes, filename, sheet_name):
+    """Read the first rows of a sheet for the column selection preview"""
+    return preview_excel(file_bytes, filename, sheet_name)
+
+@st.cache_data(show_spinner="正在分析数据列...", max_entries=32)
+def cached_profile(dataset_key, _data):
+    """Profile each uploaded dataset once; keyed by its content hash, shared by all sessions"""
+    return profile_dataset(_data)
+
+@st.cache_data(show_spinner="正在检查重复ID...", max_entries=32)
+def cached_duplicate_count(dataset_key, unit_id_col, _unit_ids):
+    """Exact duplicate count of the chosen unit-ID column; the profile's count is approximate"""
+    return count_duplicate_ids(_unit_ids)
+
+@st.cache_data(show_spinner="正在抽样...", max_entries=8)
+def cached_sample_buckets(dataset_key, unit_id_col, _unit_ids):
+    """Hash each dataset's unit IDs into sampling buckets once, for every progressive analysis on it"""
+    from progressive import sample_buckets
+    return sample_buckets(_unit_ids)
+
+@st.cache_resource
+def get_results_store():
+    """Process-wide handle on the local results warehouse (see pages/1_历史结果.py)"""
+    from results_store import ResultsStore
+    return ResultsStore()
+
+@st.cache_resource
+def get_dataset_store():
+    """Process-wide store holding each uploaded dataset once for all sessions"""
+    return DatasetStore()
+
+def get_analyzer():
+    """The session's analyzer, created on first use so scipy is only loaded once it is needed"""
+    if st.session_state.analyzer is None:
+        from experiment_analysis import ExperimentAnalysis
+        st.session_state.analyzer = ExperimentAnalysis()
+    return st.session_state.analyzer
+
+def save_to_results_store(results, record):
+    """Record an analysis in the results warehouse; ``record`` holds the other record_run arguments"""
+    try:
+        get_results_store().record_run(results, **record)
+    except Exception as e:
+        st.warning(f"保存历史记录失败：{str(e)}")
+
+def show_analysis_results(results):
+    """Show exact results with the SRM warning and the download link"""
+    st.success("✅ 分析完成！")
+    
+    untestable = results[results['Significance'] == "无法检验"]
+    if len(untestable):
+        pairs = "、".join(f"{row.Metric}（{row.Treatment_Group}）" for row in untestable.itertuples())
+        st.warning(f"⚠️ 以下比较无法检验：{pairs}。常见原因是有效用户不足，"
+                   "或事后分层过细（没有任何一层在实验组和对照组中各有至少2个用户）。")
+    
+    if 'SRM_Check' in results.columns and results['SRM_Check'].iloc[0] != "正常":
+        st.warning("⚠️ 检测到样本比例失衡（SRM），以下结果可能存在偏差，请谨慎解读。")
+    
+    st.write("分析结果：")
+    st.dataframe(results)
+    
+    st.markdown("### 📥 下载分析结果")
+    st.markdown(get_download_link(
+        results,
+        "experiment_results.xlsx",
+        "📥 下载分析结果报告"
+    ), unsafe_allow_html=True)
+
+def render_progressive_results():
+    """抽样预览结果，后台计算出完整数据的结果后自动替换"""
+    progressive = st.session_state.progressive
+    
+    @st.fragment(run_every=None if progressive['finished'] else PROGRESSIVE_POLL_SECONDS)
+    def poll_progressive_results():
+        progressive = st.session_state.progressive
+        if progressive is None:
+            return
+        job = progressive['job']
+        if not progressive['finished']:
+            if job.done:
+                # 精算结束：保存完整结果后整页重新运行一次，停止定时刷新
+                percent, results = job.latest()
+                if job.error is None and percent == 100:
+                    st.session_state.results = results
+                    if progressive['record'] is not None:
+                        save_to_results_store(results, progressive['record'])
+                progressive['finished'] = True
+                st.rerun()
+            percent, results = job.latest()
+            st.info(f"⏳ 预览：基于 {percent}% 用户的抽样结果（按哈希分桶抽样），置信区间按样本量相应放宽；"
+                    "正在后台计算完整数据的结果，完成后将自动替换。")
+            st.dataframe(results)
+            return
+        
+        # 完整结果只显示一次，与非渐进式分析一致
+        st.session_state.progressive = None
+        if job.error is not None:
+            st.error(f"完整数据计算出错：{str(job.error)}")
+        elif job.latest()[0] == 100:
+            show_analysis_results(job.latest()[1])
+    
+    poll_progressive_results()
+
+def get_test_direction():
+    """Convert the sidebar selection to parameters for statistical test"""
+    test_direction = st.session_state.get("test_direction", "双边检验 (Two-sided)")
+    is_two_sided = test_direction == "双边检验 (Two-sided)"
+    alternative = "two-sided"
+    if not is_two_sided:
+        alternative = "greater" if "上升" in test_direction else "less"
+    return is_two_sided, alternative
+
 def plot_group_distribution(data, group_column):
     """Create a bar plot for group distribution"""
+    import plotly.express as px
     group_counts = data[group_column].value_counts()
     fig = px.bar(
         x=group_counts.index,
@@ -339,6 +521,7 @@ def plot_group_distribution(data, group_column):
 
 def plot_metric_boxplot(data, metric, group_column):
     """Create a box plot for metric distribution by group"""
+    import plotly.express as px
     fig = px.box(
         data,
         x=group_column,
@@ -348,9 +531,21 @@ def plot_metric_boxplot(data, metric, group_column):
     )
     return fig
 
+# The session's dataset: the shared upload plus this session's derived columns
+dataset_store = get_dataset_store()
+session_data = dataset_store.frame(st.session_state.session_id)
+if session_data is None and st.session_state.dataset_key is not None:
+    # The store evicted the dataset to stay within its memory quota
+    st.session_state.dataset_key = None
+    st.session_state.groups_configured = False
+    st.session_state.show_group_config = False
+    st.session_state.show_metric_analysis = False
+    st.session_state.show_results = False
+    st.warning("由于服务器内存限制，您之前处理的数据集已被释放，请重新上传并处理数据集。")
+
 # Calculate progress
 progress = 0
-if st.session_state.data is not None:
+if session_data is not None:
     progress += 25
 if st.session_state.groups_configured:
     progress += 25
@@ -380,7 +575,7 @@ with st.sidebar:
     
     # Add statistical test direction selection
     st.markdown("### 📊 统计检验设置")
-    test_direction = st.radio(
+    st.radio(
         "选择检验方向",
         options=[
             "双边检验 (Two-sided)",
@@ -391,24 +586,19 @@ with st.sidebar:
         - 双边检验：检验实验组与对照组是否有显著差异（上升或下降）
         - 单边检验-上升：检验实验组是否显著高于对照组
         - 单边检验-下降：检验实验组是否显著低于对照组
-        """
+        """,
+        key="test_direction"
     )
     
-    # Convert selection to parameters for statistical test
-    is_two_sided = test_direction == "双边检验 (Two-sided)"
-    alternative = "two-sided"
-    if not is_two_sided:
-        alternative = "greater" if "上升" in test_direction else "less"
-    
     st.markdown("---")
     
     # Add experiment information section
     st.markdown("### 📊 实验信息")
-    if st.session_state.data is not None:
+    if session_data is not None:
         st.info(f"""
-        - 数据集大小: {st.session_state.data.shape[0]} 行
+        - 数据集大小: {session_data.shape[0]} 行
         - 实验单元: {st.session_state.unit_id_col}
-        - 指标数量: {len(st.session_state.data.select_dtypes(include=[np.number]).columns)}
+        - 指标数量: {len(session_data.select_dtypes(include=[np.number]).columns)}
         """)
     else:
         st.info("请上传数据集开始分析")
@@ -418,7 +608,7 @@ with st.sidebar:
     # Add progress tracking
     st.markdown("### 🎯 分析进度")
     progress_status = []
-    if st.session_state.data is not None:
+    if session_data is not None:
         progress_status.append("✅ 数据上传完成")
     if st.session_state.groups_configured:
         progress_status.append("✅ 分组配置完成")
@@ -459,6 +649,7 @@ with st.sidebar:
         - 数据可视化展示
         """)
 
+
 # Main content area
 st.markdown("---")
 
@@ -474,190 +665,408 @@ def get_section_status(status, text):
     <span class="section-status status-{status}">{text}</span>
     """
 
-# Section 1: Data Upload
-with st.expander("第一步：数据上传", expanded=not st.session_state.show_group_config):
-    status = "completed" if st.session_state.data is not None else "active"
-    st.markdown(f"""
-    <div class='step-title {status}'>
-    📤 第一步：数据上传
-    </div>
-    """, unsafe_allow_html=True)
+# Each step is a fragment: interacting with a widget reruns only that step, not the whole page.
+# Steps that change the page layout (processing the dataset, generating groups) trigger a full
+# rerun, and the results they show are kept in session state until that rerun has rendered them.
+
+def show_group_distribution_charts(distribution_df):
+    """Sample counts and proportions of pre-existing groups"""
+    import plotly.express as px
     
-    uploaded_file = st.file_uploader("上传数据集（支持CSV或Excel格式）", type=['csv', 'xlsx', 'xls'])
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("样本数量分布")
+        fig_counts = px.bar(
+            distribution_df,
+            y='样本数',
+            title='各组样本数量',
+            color=distribution_df.index,
+            text='样本数'
+        )
+        fig_counts.update_traces(textposition='outside')
+        fig_counts.update_layout(
+            showlegend=False,
+            height=400,
+            yaxis_title="样本数量",
+            xaxis_title="实验组"
+        )
+        st.plotly_chart(fig_counts, use_container_width=True)
     
-    if uploaded_file is not None:
-        try:
-            # Read the file
-            if uploaded_file.name.endswith('.csv'):
-                data = pd.read_csv(uploaded_file)
-            else:
-                data = pd.read_excel(uploaded_file)
-            
-            unit_id_col = st.selectbox(
-                "选择包含实验单元ID的列：",
-                options=data.columns.tolist(),
-                help="选择包含实验单元唯一标识符的列"
-            )
+    with col2:
+        st.subheader("分组比例分布")
+        fig_props = px.bar(
+            distribution_df,
+            y='比例(%)',
+            title='各组比例分布',
+            color=distribution_df.index,
+            text='比例(%)'
+        )
+        fig_props.update_traces(textposition='outside')
+        fig_props.update_layout(
+            showlegend=False,
+            height=400,
+            yaxis_title="比例 (%)",
+            xaxis_title="实验组",
+            yaxis=dict(range=[0, 100])
+        )
+        st.plotly_chart(fig_props, use_container_width=True)
 
-            # 检查是否存在预分组
-            potential_group_columns = []
-            
-            # 1. 检查列名中包含'group'的列
-            columns_with_group_name = [col for col in data.columns if 'group' in col.lower()]
-            potential_group_columns.extend(columns_with_group_name)
-            
-            # 2. 检查字符串类型列的内容是否包含'group'
-            string_columns = data.select_dtypes(include=['object']).columns
-            for col in string_columns:
-                if col not in potential_group_columns:  # 避免重复检查
-                    # 检查前100行数据
-                    sample_values = data[col].head(100).astype(str).str.lower()
-                    if any(sample_values.str.contains('group')):
-                        potential_group_columns.append(col)
-            
-            # 去重
-            potential_group_columns = list(set(potential_group_columns))
-            
-            if potential_group_columns:
-                st.info(f"检测到以下可能的分组列：\n" + 
-                       "\n".join([f"- {col}" for col in potential_group_columns]) +
-                       "\n您可以选择使用已有的分组或重新分组。")
+def show_processed_dataset(data):
+    """Summary shown once after the dataset has been processed"""
+    if st.session_state.has_preexisting_groups:
+        # 显示现有分组的分布情况
+        group_counts = data['group_name'].value_counts()
+        total_samples = len(data)
+        actual_proportions = (group_counts / total_samples * 100).round(2)
+        
+        st.success("✅ 使用已有分组进行分析！")
+        st.write("现有分组分布：")
+        
+        # 创建比较DataFrame
+        distribution_df = pd.DataFrame({
+            '样本数': group_counts,
+            '比例(%)': actual_proportions
+        }).round(2)
+        st.dataframe(distribution_df)
+        show_group_distribution_charts(distribution_df)
+    
+    duplicate_summary = st.session_state.get('duplicate_summary')
+    if duplicate_summary and duplicate_summary['duplicate_units']:
+        action = {
+            'flag': f"已在 {DUPLICATE_FLAG_COLUMN} 列中标记",
+            'drop': "每个实验单元只保留了第一行",
+            'aggregate': "已按实验单元合并（数值列求和）",
+        }[duplicate_summary['policy']]
+        st.warning(f"⚠️ {duplicate_summary['duplicate_units']} 个实验单元出现在多行中"
+                   f"（共 {duplicate_summary['duplicate_rows']} 行），{action}。"
+                   f"处理后共 {len(data)} 行，{duplicate_summary['units']} 个实验单元。")
+    elif duplicate_summary:
+        st.info(f"实验单元ID无重复，共 {duplicate_summary['units']} 个实验单元。")
+    
+    # Show complete processed dataframe
+    st.subheader("📋 处理后的数据集")
+    st.dataframe(data)
+    
+    # Show detailed information in tabs
+    st.subheader("📊 数据集详情")
+    summary_tab, stats_tab = st.tabs(["数据概览", "统计信息"])
+    
+    with summary_tab:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write("数据集信息：")
+            st.write(f"- 行数：{data.shape[0]}")
+            st.write(f"- 列数：{data.shape[1]}")
+            st.write("实验单元ID示例：", data['apollo_key'].head().tolist())
+        
+        with col2:
+            st.write("数据类型：")
+            st.write(data.dtypes)
+    
+    with stats_tab:
+        profile = cached_profile(st.session_state.dataset_key, data)
+        numeric_cols = [col for col in suggest_metric_columns(profile) if col != st.session_state.unit_id_col]
+        if numeric_cols:
+            st.write("数值列统计信息（分位数为近似值）：")
+            st.dataframe(describe_from_profile(profile, numeric_cols))
+        st.write("列概况：")
+        st.dataframe(profile[['Dtype', 'Null_Rate', 'Approx_Distinct', 'Duplicates']].rename(columns={
+            'Dtype': '数据类型', 'Null_Rate': '缺失率', 'Approx_Distinct': '不同值数量（近似）', 'Duplicates': '重复值数量（近似）'
+        }))
+
+def show_group_summary(data, comparison_df, srm_result):
+    """Result of the group generation, shown once after the groups have been generated"""
+    import plotly.express as px
+    import plotly.graph_objects as go
+    
+    st.success("✅ 分组生成成功！")
+    
+    if srm_result['SRM']:
+        st.warning(f"⚠️ 样本比例失衡（SRM）：卡方检验 p值 = {srm_result['P_Value']:.2e}，"
+                   "实际分组比例与目标比例存在显著差异，请检查分组配置或实验单元ID。")
+    else:
+        st.info(f"样本比例检验（SRM）通过：卡方检验 p值 = {srm_result['P_Value']:.4f}")
+    
+    # 显示分组分布比较
+    st.write("分组分布比较：")
+    st.dataframe(comparison_df)
+    
+    # 创建两个列来放置图表
+    col1, col2 = st.columns(2)
+    
+    # 样本数量柱状图
+    with col1:
+        st.subheader("样本数量分布")
+        fig_counts = px.bar(
+            comparison_df,
+            y='样本数',
+            title='各组样本数量',
+            labels={'index': '组别', 'value': '样本数'},
+            color=comparison_df.index,
+            text='样本数'  # 显示具体数值
+        )
+        fig_counts.update_traces(textposition='outside')  # 将数值显示在柱子上方
+        fig_counts.update_layout(
+            showlegend=False,
+            height=400,
+            yaxis_title="样本数量",
+            xaxis_title="实验组"
+        )
+        st.plotly_chart(fig_counts, use_container_width=True)
+    
+    # 比例对比柱状图
+    with col2:
+        st.subheader("分组比例对比")
+        fig_props = go.Figure()
+        
+        # 添加目标比例柱状图
+        fig_props.add_trace(go.Bar(
+            name='目标比例',
+            x=comparison_df.index,
+            y=comparison_df['目标比例'],
+            text=comparison_df['目标比例'].apply(lambda x: f'{x:.1f}%'),
+            textposition='outside'
+        ))
+        
+        # 添加实际比例柱状图
+        fig_props.add_trace(go.Bar(
+            name='实际比例',
+            x=comparison_df.index,
+            y=comparison_df['实际比例'],
+            text=comparison_df['实际比例'].apply(lambda x: f'{x:.1f}%'),
+            textposition='outside'
+        ))
+        
+        # 更新布局
+        fig_props.update_layout(
+            title='目标比例 vs 实际比例',
+            height=400,
+            yaxis_title="比例 (%)",
+            xaxis_title="实验组",
+            barmode='group',
+            yaxis=dict(range=[0, 100])  # 固定y轴范围为0-100%
+        )
+        st.plotly_chart(fig_props, use_container_width=True)
+    
+    st.markdown("### 📥 下载处理后的数据集")
+    if len(data) < EXCEL_MAX_ROWS:
+        st.markdown("下载包含分组信息的数据集：")
+        # Writing xlsx takes seconds for large datasets, so it is only done when the button is clicked
+        st.download_button(
+            "📥 下载分组后的数据集",
+            data=lambda: excel_bytes(data),
+            file_name="processed_dataset_with_groups.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
+            key="dataset_excel_download"
+        )
+    else:
+        st.info(f"数据集超过Excel的行数上限（{EXCEL_MAX_ROWS - 1:,} 行），请使用下方的Parquet导出。")
+    
+    assignment_config = st.session_state.get('assignment_config')
+    if assignment_config is not None and 'bucket_number' in data.columns:
+        st.markdown("按实验组分区的Parquet分组结果（含 `_manifest.json`：盐值、分组比例、各组样本数与文件列表），"
+                    "可供Spark/数仓任务直接关联：")
+        ids, buckets = data['apollo_key'], data['bucket_number']
+        experiment_name, hash_backend = assignment_config['experiment'], assignment_config['hash_backend']
+        proportions = st.session_state.proportions
+        col1, col2 = st.columns(2)
+        for column, bucket_range_width, label in ((col1, None, "📦 下载Parquet导出（按实验组分区）"),
+                                                  (col2, 10, "📦 下载Parquet导出（按实验组与分桶区间分区）")):
+            with column:
+                # The export is only built when the button is clicked
+                st.download_button(
+                    label,
+                    data=lambda width=bucket_range_width: build_assignment_export(
+                        ids, buckets, experiment_name, hash_backend, proportions, width),
+                    file_name=f"{experiment_name}_assignments.zip",
+                    mime="application/zip",
+                    on_click="ignore",
+                    key=f"assignment_export_{bucket_range_width}"
+                )
+
+# Section 1: Data Upload
+@st.fragment
+def render_upload_step():
+    session_data = dataset_store.frame(st.session_state.session_id)
+    show_summary = session_data is not None and st.session_state.get("show_processed_summary", False)
+    
+    with st.expander("第一步：数据上传", expanded=show_summary or not st.session_state.show_group_config):
+        status = "completed" if session_data is not None else "active"
+        st.markdown(f"""
+        <div class='step-title {status}'>
+        📤 第一步：数据上传
+        </div>
+        """, unsafe_allow_html=True)
+        
+        uploaded_files = st.file_uploader(
+            "上传数据集（支持CSV、Parquet或Excel格式；CSV/Parquet可同时上传多个分片文件）",
+            type=['csv', 'gz', 'parquet', 'xlsx', 'xls'],
+            accept_multiple_files=True
+        )
+        # Parts are ordered by name so the same set of files always gives the same dataset
+        uploaded_files = sorted(uploaded_files or [], key=lambda f: f.name)
+        uploaded_file = uploaded_files[0] if uploaded_files else None
+        
+        if uploaded_file is not None:
+            try:
+                # Read the file(s); identical uploads are parsed once and shared between sessions
+                is_excel = [f.name.lower().endswith(('.xlsx', '.xls')) for f in uploaded_files]
+                if any(is_excel) and len(uploaded_files) > 1:
+                    raise ValueError("多文件上传仅支持CSV或Parquet分片，Excel文件请单独上传")
+                if not is_excel[0]:
+                    parts = [(f.name, f.getvalue()) for f in uploaded_files]
+                    dataset_key = content_key(*(content for _, content in parts))
+                    with st.spinner(f"正在读取{len(parts)}个文件..."):
+                        data = dataset_store.get_or_load(dataset_key, lambda: load_parts(parts))
+                else:
+                    file_bytes = uploaded_file.getvalue()
+                    sheet_names = cached_excel_sheets(file_bytes, uploaded_file.name)
+                    sheet_name = sheet_names[0]
+                    if len(sheet_names) > 1:
+                        sheet_name = st.selectbox("选择工作表：", options=sheet_names)
+                    
+                    preview = cached_excel_preview(file_bytes, uploaded_file.name, sheet_name)
+                    st.write(f"数据预览（前{len(preview)}行）：")
+                    st.dataframe(preview)
+                    
+                    selected_columns = st.multiselect(
+                        "选择需要加载的列：",
+                        options=preview.columns.tolist(),
+                        default=preview.columns.tolist(),
+                        help="只加载需要的列可以显著加快大文件的读取速度"
+                    )
+                    if not selected_columns:
+                        raise ValueError("请至少选择一列")
+                    dataset_key = content_key(file_bytes, sheet_name.encode(), "\x1f".join(selected_columns).encode())
+                    with st.spinner("正在读取Excel文件..."):
+                        data = dataset_store.get_or_load(
+                            dataset_key,
+                            lambda: read_excel_columns(file_bytes, uploaded_file.name, sheet_name, selected_columns)
+                        )
                 
-                use_existing_groups = st.checkbox("使用已有分组", value=True)
+                # 列概况只在首次上传时计算一次，用于推荐ID列、分组列和指标列
+                profile = cached_profile(dataset_key, data)
                 
-                if use_existing_groups:
-                    # 显示每个潜在分组列的唯一值示例
-                    st.write("各分组列的唯一值示例：")
-                    for col in potential_group_columns:
-                        unique_values = data[col].unique()
-                        st.write(f"**{col}**: {', '.join(map(str, unique_values[:5]))}" + 
-                               ("..." if len(unique_values) > 5 else ""))
-                    
-                    group_column = st.selectbox(
-                        "选择分组列：",
-                        options=potential_group_columns,
-                        help="选择包含实验组信息的列"
+                unit_id_col = st.selectbox(
+                    "选择包含实验单元ID的列：",
+                    options=suggest_id_columns(profile),
+                    help="选择包含实验单元唯一标识符的列（已按取值唯一程度排序）"
+                )
+                # 概况中的重复数是近似值，对近乎唯一的大列会报告为0；所选ID列单独精确计数
+                n_duplicate_ids = cached_duplicate_count(dataset_key, unit_id_col, data[unit_id_col])
+                if n_duplicate_ids > 0:
+                    st.warning(f"⚠️ 实验单元ID列「{unit_id_col}」中有 {n_duplicate_ids} 个重复值，"
+                               "同一实验单元出现多次会使检验结果产生偏差。")
+                duplicate_policy = st.radio(
+                    "重复实验单元处理方式：",
+                    options=list(DUPLICATE_POLICY_LABELS),
+                    format_func=DUPLICATE_POLICY_LABELS.get,
+                    horizontal=True,
+                    help="标记：保留所有行并新增 is_duplicate_unit 列；删除重复：每个实验单元只保留第一行；"
+                         "合并：每个实验单元保留一行，所选列按实验单元求和，其他列取第一行的值"
+                )
+                sum_columns = None
+                if duplicate_policy == 'aggregate':
+                    # 默认不对分组列和0/1指标（如转化标记）求和：求和后不再是分组标签或比例
+                    not_summed = [unit_id_col] + suggest_group_columns(profile)
+                    sum_columns = st.multiselect(
+                        "合并时求和的列：",
+                        options=suggest_metric_columns(profile, exclude=not_summed),
+                        default=suggest_sum_columns(profile, exclude=not_summed),
+                        help="同一实验单元的多行合并为一行时，这些列取各行之和，其他列取第一行的值"
                     )
-                    st.session_state.has_preexisting_groups = True
-                    st.session_state.group_column = group_column
-            else:
-                st.session_state.has_preexisting_groups = False
-                st.session_state.group_column = None
-            
-            if st.button("处理数据集"):
-                try:
-                    # Process unit IDs
-                    data[unit_id_col] = data[unit_id_col].apply(
-                        lambda x: '{:.0f}'.format(float(x)) if pd.notnull(x) else '')
+
+                # 检查是否存在预分组：列名或前100行取值中包含'group'的列
+                potential_group_columns = suggest_group_columns(profile)
+                
+                if potential_group_columns:
+                    st.info(f"检测到以下可能的分组列：\n" + 
+                           "\n".join([f"- {col}" for col in potential_group_columns]) +
+                           "\n您可以选择使用已有的分组或重新分组。")
                     
-                    if unit_id_col != 'apollo_key':
-                        data['apollo_key'] = data[unit_id_col]
+                    use_existing_groups = st.checkbox("使用已有分组", value=True)
                     
-                    # 如果使用预分组，重命名分组列并跳过分组配置
-                    if st.session_state.has_preexisting_groups:
-                        data['group_name'] = data[st.session_state.group_column]
-                        st.session_state.groups_configured = True
-                        st.session_state.show_metric_analysis = True
+                    if use_existing_groups:
+                        # 显示每个潜在分组列的唯一值示例
+                        st.write("各分组列的唯一值示例：")
+                        for col in potential_group_columns:
+                            unique_values = data[col].unique()
+                            st.write(f"**{col}**: {', '.join(map(str, unique_values[:5]))}" + 
+                                   ("..." if len(unique_values) > 5 else ""))
                         
-                        # 显示现有分组的分布情况
-                        group_counts = data['group_name'].value_counts()
-                        total_samples = len(data)
-                        actual_proportions = (group_counts / total_samples * 100).round(2)
+                        group_column = st.selectbox(
+                            "选择分组列：",
+                            options=potential_group_columns,
+                            help="选择包含实验组信息的列"
+                        )
+                        st.session_state.has_preexisting_groups = True
+                        st.session_state.group_column = group_column
+                else:
+                    st.session_state.has_preexisting_groups = False
+                    st.session_state.group_column = None
+                
+                if st.button("处理数据集"):
+                    try:
+                        # Process unit IDs (vectorized; numbers are written without decimals)
+                        data[unit_id_col] = normalize_ids(data[unit_id_col])
                         
-                        st.success("✅ 使用已有分组进行分析！")
-                        st.write("现有分组分布：")
+                        if unit_id_col != 'apollo_key':
+                            data['apollo_key'] = data[unit_id_col]
                         
-                        # 创建比较DataFrame
-                        distribution_df = pd.DataFrame({
-                            '样本数': group_counts,
-                            '比例(%)': actual_proportions
-                        }).round(2)
-                        st.dataframe(distribution_df)
+                        if sum_columns is not None:
+                            # The group column is a label: merged units keep their first row's group
+                            sum_columns = [col for col in sum_columns if col != st.session_state.group_column]
+                        data, duplicate_summary = handle_duplicate_units(data, 'apollo_key', duplicate_policy,
+                                                                         sum_columns=sum_columns)
+                        if len(data) != duplicate_summary['rows']:
+                            # Dropping or merging rows changes the dataset itself, so it is shared under its own key
+                            deduplicated = data
+                            dataset_key = content_key(dataset_key.encode(), unit_id_col.encode(), duplicate_policy.encode(),
+                                                      "\x1f".join(sum_columns or []).encode())
+                            data = dataset_store.get_or_load(dataset_key, lambda: deduplicated)
+                        st.session_state.duplicate_summary = dict(duplicate_summary, policy=duplicate_policy)
                         
-                        # 显示分组分布图表
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.subheader("样本数量分布")
-                            fig_counts = px.bar(
-                                distribution_df,
-                                y='样本数',
-                                title='各组样本数量',
-                                color=distribution_df.index,
-                                text='样本数'
-                            )
-                            fig_counts.update_traces(textposition='outside')
-                            fig_counts.update_layout(
-                                showlegend=False,
-                                height=400,
-                                yaxis_title="样本数量",
-                                xaxis_title="实验组"
-                            )
-                            st.plotly_chart(fig_counts, use_container_width=True)
+                        # 如果使用预分组，重命名分组列并跳过分组配置
+                        if st.session_state.has_preexisting_groups:
+                            data['group_name'] = data[st.session_state.group_column]
+                            st.session_state.groups_configured = True
+                            st.session_state.show_metric_analysis = True
+                        else:
+                            st.session_state.show_group_config = True
                         
-                        with col2:
-                            st.subheader("分组比例分布")
-                            fig_props = px.bar(
-                                distribution_df,
-                                y='比例(%)',
-                                title='各组比例分布',
-                                color=distribution_df.index,
-                                text='比例(%)'
-                            )
-                            fig_props.update_traces(textposition='outside')
-                            fig_props.update_layout(
-                                showlegend=False,
-                                height=400,
-                                yaxis_title="比例 (%)",
-                                xaxis_title="实验组",
-                                yaxis=dict(range=[0, 100])
-                            )
-                            st.plotly_chart(fig_props, use_container_width=True)
+                        # Only the derived columns are stored per session; the upload itself stays shared
+                        derived_columns = {col: data[col] for col in [unit_id_col, 'apollo_key', 'group_name',
+                                                                      DUPLICATE_FLAG_COLUMN]
+                                           if col in data.columns}
+                        dataset_store.attach(st.session_state.session_id, dataset_key, derived_columns)
+                        st.session_state.dataset_key = dataset_key
+                        st.session_state.unit_id_col = unit_id_col
+                        st.session_state.dataset_name = os.path.splitext(uploaded_file.name)[0]
+                        st.session_state.show_processed_summary = True
+                    except Exception as e:
+                        st.error(f"处理实验单元ID时出错：{str(e)}")
+                        st.error("如果遇到问题，请点击右上角的'🔄 重新开始'按钮重置应用。")
                     else:
-                        st.session_state.show_group_config = True
-                    
-                    st.session_state.data = data
-                    st.session_state.unit_id_col = unit_id_col
-                    
-                    # Show complete processed dataframe
-                    st.subheader("📋 处理后的数据集")
-                    st.dataframe(data)
-                    
-                    # Show detailed information in tabs
-                    st.subheader("📊 数据集详情")
-                    summary_tab, stats_tab = st.tabs(["数据概览", "统计信息"])
-                    
-                    with summary_tab:
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.write("数据集信息：")
-                            st.write(f"- 行数：{data.shape[0]}")
-                            st.write(f"- 列数：{data.shape[1]}")
-                            st.write("实验单元ID示例：", data['apollo_key'].head().tolist())
-                        
-                        with col2:
-                            st.write("数据类型：")
-                            st.write(data.dtypes)
-                    
-                    with stats_tab:
-                        numeric_cols = data.select_dtypes(include=[np.number]).columns
-                        if not numeric_cols.empty:
-                            st.write("数值列统计信息：")
-                            st.dataframe(data[numeric_cols].describe())
-                    
-                except Exception as e:
-                    st.error(f"处理实验单元ID时出错：{str(e)}")
-                    st.error("如果遇到问题，请点击右上角的'🔄 重新开始'按钮重置应用。")
-            
-        except Exception as e:
-            st.error(f"读取文件时出错：{str(e)}")
-            st.error("如果遇到问题，请点击右上角的'🔄 重新开始'按钮重置应用。")
-
-# Visual connector
-if st.session_state.show_group_config:
-    st.markdown("<div class='section-connector'></div>", unsafe_allow_html=True)
+                        # The sidebar, progress bar and the next steps depend on the processed dataset
+                        st.rerun()
+                
+            except Exception as e:
+                st.error(f"读取文件时出错：{str(e)}")
+                st.error("如果遇到问题，请点击右上角的'🔄 重新开始'按钮重置应用。")
+        
+        if show_summary:
+            st.session_state.show_processed_summary = False
+            show_processed_dataset(session_data)
 
 # Section 2: Group Configuration
-if st.session_state.show_group_config:
+@st.fragment
+def render_group_config_step():
+    session_data = dataset_store.frame(st.session_state.session_id)
+    if session_data is None:
+        st.warning("由于服务器内存限制，您之前处理的数据集已被释放，请重新上传并处理数据集。")
+        return
+    
     with st.expander("第二步：分组配置", expanded=True):
         status = "completed" if st.session_state.groups_configured else "active"
         st.markdown(f"""
@@ -674,6 +1083,14 @@ if st.session_state.show_group_config:
         """, unsafe_allow_html=True)
         random_seed = st.text_input("", value="experiment_1", key="seed_input")
         
+        hash_backend = st.selectbox(
+            "哈希算法",
+            options=list(HASH_BACKENDS.keys()),
+            index=list(HASH_BACKENDS.keys()).index(DEFAULT_HASH_BACKEND),
+            help="sha1 为原有分桶算法（与线上分组保持一致）；blake2b 与 siphash64 计算更快，但分桶结果与 sha1 不同",
+            key="hash_backend_input"
+        )
+        
         st.markdown("""
         <div class="tooltip" data-tooltip="设置需要测试的不同处理组数量">
         处理组数量
@@ -714,23 +1131,30 @@ if st.session_state.show_group_config:
         else:
             if st.button("生成分组"):
                 try:
+                    from assignment_index import AssignmentIndex
+                    
                     progress_bar = st.progress(0)
                     status_text = st.empty()
                     
                     status_text.text("初始化分组编号...")
-                    st.session_state.data['bucket_number'] = st.session_state.data['apollo_key'].apply(
-                        lambda x: st.session_state.analyzer.apollo_bucket(random_seed, x))
+                    # 已分桶过的ID直接从持久化索引中读取，只对新增ID计算哈希
+                    assignment_index = AssignmentIndex(random_seed, hash_backend=hash_backend)
+                    proportions_with_percent = {k: f"{v}%" for k, v in proportions.items()}
                     progress_bar.progress(25)
                     
                     status_text.text("分配实验组...")
-                    proportions_with_percent = {k: f"{v}%" for k, v in proportions.items()}
-                    st.session_state.data['group_name'] = st.session_state.data['bucket_number'].apply(
-                        lambda x: st.session_state.analyzer.assign_groups(x, proportions_with_percent))
+                    bucket_numbers, group_names = assignment_index.assign(
+                        session_data['apollo_key'], proportions_with_percent)
+                    dataset_store.set_columns(st.session_state.session_id, {
+                        'bucket_number': pd.Series(bucket_numbers, index=session_data.index),
+                        'group_name': pd.Series(group_names, index=session_data.index)
+                    })
+                    session_data = dataset_store.frame(st.session_state.session_id)
                     progress_bar.progress(50)
                     
                     status_text.text("验证分组结果...")
-                    group_counts = st.session_state.data['group_name'].value_counts()
-                    total_samples = len(st.session_state.data)
+                    group_counts = session_data['group_name'].value_counts()
+                    total_samples = len(session_data)
                     
                     # 计算实际比例
                     actual_proportions = (group_counts / total_samples * 100).round(2)
@@ -742,96 +1166,38 @@ if st.session_state.show_group_config:
                         '样本数': group_counts
                     }).round(2)
                     
+                    srm_result = get_analyzer().check_srm(
+                        session_data, 'group_name', proportions_with_percent).iloc[0]
+                    
                     progress_bar.progress(75)
                     
                     status_text.text("完成分组配置...")
                     st.session_state.groups_configured = True
                     st.session_state.proportions = proportions_with_percent
+                    st.session_state.assignment_config = {'experiment': random_seed, 'hash_backend': hash_backend}
+                    st.session_state.group_summary = (comparison_df, srm_result)
+                    st.session_state.show_metric_analysis = True
                     progress_bar.progress(100)
                     status_text.text("分组生成完成！")
                     
-                    st.success("✅ 分组生成成功！")
-                    
-                    # 显示分组分布比较
-                    st.write("分组分布比较：")
-                    st.dataframe(comparison_df)
-                    
-                    # 创建两个列来放置图表
-                    col1, col2 = st.columns(2)
-                    
-                    # 样本数量柱状图
-                    with col1:
-                        st.subheader("样本数量分布")
-                        fig_counts = px.bar(
-                            comparison_df,
-                            y='样本数',
-                            title='各组样本数量',
-                            labels={'index': '组别', 'value': '样本数'},
-                            color=comparison_df.index,
-                            text='样本数'  # 显示具体数值
-                        )
-                        fig_counts.update_traces(textposition='outside')  # 将数值显示在柱子上方
-                        fig_counts.update_layout(
-                            showlegend=False,
-                            height=400,
-                            yaxis_title="样本数量",
-                            xaxis_title="实验组"
-                        )
-                        st.plotly_chart(fig_counts, use_container_width=True)
-                    
-                    # 比例对比柱状图
-                    with col2:
-                        st.subheader("分组比例对比")
-                        fig_props = go.Figure()
-                        
-                        # 添加目标比例柱状图
-                        fig_props.add_trace(go.Bar(
-                            name='目标比例',
-                            x=comparison_df.index,
-                            y=comparison_df['目标比例'],
-                            text=comparison_df['目标比例'].apply(lambda x: f'{x:.1f}%'),
-                            textposition='outside'
-                        ))
-                        
-                        # 添加实际比例柱状图
-                        fig_props.add_trace(go.Bar(
-                            name='实际比例',
-                            x=comparison_df.index,
-                            y=comparison_df['实际比例'],
-                            text=comparison_df['实际比例'].apply(lambda x: f'{x:.1f}%'),
-                            textposition='outside'
-                        ))
-                        
-                        # 更新布局
-                        fig_props.update_layout(
-                            title='目标比例 vs 实际比例',
-                            height=400,
-                            yaxis_title="比例 (%)",
-                            xaxis_title="实验组",
-                            barmode='group',
-                            yaxis=dict(range=[0, 100])  # 固定y轴范围为0-100%
-                        )
-                        st.plotly_chart(fig_props, use_container_width=True)
-                    
-                    st.markdown("### 📥 下载处理后的数据集")
-                    st.markdown("下载包含分组信息的数据集：")
-                    st.markdown(get_download_link(
-                        st.session_state.data,
-                        "processed_dataset_with_groups.xlsx",
-                        "📥 下载分组后的数据集"
-                    ), unsafe_allow_html=True)
-                    
-                    st.session_state.show_metric_analysis = True
-                    
                 except Exception as e:
                     st.error(f"分组配置出错：{str(e)}")
-
-# Visual connector
-if st.session_state.show_metric_analysis:
-    st.markdown("<div class='section-connector'></div>", unsafe_allow_html=True)
+                else:
+                    # Step 3 and the sidebar depend on the generated groups
+                    st.rerun()
+        
+        group_summary = st.session_state.pop("group_summary", None)
+        if group_summary is not None:
+            show_group_summary(session_data, *group_summary)
 
 # Section 3: Metric Analysis
-if st.session_state.show_metric_analysis:
+@st.fragment
+def render_metric_analysis_step():
+    session_data = dataset_store.frame(st.session_state.session_id)
+    if session_data is None:
+        st.warning("由于服务器内存限制，您之前处理的数据集已被释放，请重新上传并处理数据集。")
+        return
+    
     with st.expander("第三步：指标分析", expanded=st.session_state.show_metric_analysis and not st.session_state.show_results):
         status = "completed" if st.session_state.show_results else "active"
         st.markdown(f"""
@@ -847,27 +1213,110 @@ if st.session_state.show_metric_analysis:
         <li><b>均值</b>：比较平均值（如：收入、使用时长）</li>
         <li><b>比例</b>：比较比率或百分比（如：转化率）</li>
         <li><b>比值</b>：比较两个指标的比值（如：人均收入）</li>
+        <li><b>秩检验</b>：Mann-Whitney U 非参数检验，比较偏态指标的分布（如：访问次数、使用时长），结果中的数值为中位数</li>
         </ul>
         </div>
         """, unsafe_allow_html=True)
         
-        numeric_cols = st.session_state.data.select_dtypes(include=[np.number]).columns.tolist()
-        if 'bucket_number' in numeric_cols:
-            numeric_cols.remove('bucket_number')
+        # 指标候选列来自上传时的列概况（已排除实验单元ID列，疑似ID列与常数列排在最后）
+        profile = cached_profile(st.session_state.dataset_key, session_data)
+        numeric_cols = suggest_metric_columns(profile, exclude=[st.session_state.unit_id_col])
         
         metrics = st.multiselect("选择需要分析的指标：", numeric_cols)
         
         if metrics:
             metric_types = []
+            capping = {}
             cols = st.columns(len(metrics))
             for i, metric in enumerate(metrics):
                 with cols[i]:
                     metric_type = st.selectbox(
                         f"{metric} 的指标类型",
-                        ["均值", "比例", "比值"],
+                        ["均值", "比例", "比值", "秩检验"],
                         key=f"metric_type_{i}"
                     )
-                    metric_types.append(metric_type.replace("均值", "mean").replace("比例", "proportion").replace("比值", "ratio"))
+                    metric_types.append(metric_type.replace("均值", "mean").replace("比例", "proportion")
+                                        .replace("比值", "ratio").replace("秩检验", "rank"))
+                    if metric_type in ("均值", "比值"):
+                        cap_label = st.selectbox(
+                            f"{metric} 的异常值截尾",
+                            list(CAP_QUANTILE_OPTIONS),
+                            key=f"metric_cap_{i}",
+                            help="将超过所选分位数的取值截断为该分位数，降低长尾指标（如收入）的方差；分位数由流式分位数摘要近似计算"
+                        )
+                        if CAP_QUANTILE_OPTIONS[cap_label] is not None:
+                            capping[metric] = CAP_QUANTILE_OPTIONS[cap_label]
+            
+            test_method = "asymptotic"
+            if 'bucket_number' in session_data.columns:
+                test_method = st.radio(
+                    "P值计算方法：",
+                    options=["asymptotic", "randomization"],
+                    format_func={"asymptotic": "渐近检验（t检验/正态近似）",
+                                 "randomization": "分桶随机化检验"}.get,
+                    horizontal=True,
+                    help="分桶随机化检验在100个分桶之间随机重新分配实验组，不依赖正态假设，适合比值指标和长尾指标；"
+                         "计算量与用户数无关（仅在本工具生成分组时可用；秩检验指标仍使用 Mann-Whitney U 检验的P值）"
+                )
+            
+            # 分层候选列：取值个数在2到50之间的列（文本列在前），排除分组、分桶、ID列和所选指标
+            stratum_cols = [col for col in suggest_stratum_columns(
+                                profile, exclude=[st.session_state.unit_id_col, 'group_name', 'bucket_number',
+                                                  DUPLICATE_FLAG_COLUMN] + metrics)
+                            if col in session_data.columns]
+            stratify_by = st.multiselect(
+                "事后分层变量（可选）：",
+                stratum_cols,
+                help="按实验前的分类属性（如国家、设备、用户等级）事后分层：均值、比例和比值指标按各层占全部用户的比例"
+                     "对各层均值加权，去除层间差异带来的方差，置信区间通常更窄；秩检验指标不分层。"
+                     "选择多列时按各列取值的组合分层。分桶随机化检验不支持事后分层",
+                disabled=test_method == "randomization"
+            )
+            if test_method == "randomization":
+                # 随机化检验的P值来自未分层的分桶重分配，与分层估计不对应
+                stratify_by = []
+            if stratify_by:
+                # 按列概况中的近似不同值数量估计层数（多列时为各列取值个数之积）
+                n_strata = int(np.prod(profile.loc[stratify_by, 'Approx_Distinct'].to_numpy(dtype=float)))
+                if len(session_data) < STRATUM_MIN_AVG_UNITS * n_strata:
+                    st.warning(f"⚠️ 分层可能过细：所选变量约有 {n_strata} 层，平均每层不足 {STRATUM_MIN_AVG_UNITS} 个用户。"
+                               "某一层中实验组或对照组的有效用户少于2个时，该层不参与比较；"
+                               "没有任何一层满足条件的比较将无法检验。")
+            
+            missing_label = st.selectbox(
+                "指标缺失值处理：",
+                list(MISSING_OPTIONS),
+                help="仅在该指标中排除：缺失值只从该指标（比值指标的分子和分母同时）中剔除；"
+                     "视为0：缺失值按0计算（适合“未发生即为0”的指标，如收入）；"
+                     "删除有缺失值的用户：任一所选指标缺失的用户从所有指标中剔除。"
+                     "结果中的 Treatment_N/Control_N 为各组实际参与计算的用户数"
+            )
+            
+            correction_label = st.selectbox(
+                "多重比较校正：",
+                list(CORRECTION_OPTIONS),
+                help="同时检验多个指标和多个实验组时，至少一个结果“显著”的概率会随比较次数上升。"
+                     "校正在所有指标×实验组的比较上统一进行，结果中增加 P_Value_Adjusted 列，显著性按校正后的P值判断；"
+                     "Bonferroni/Holm 控制整体假阳性率，Benjamini-Hochberg 控制错误发现率（FDR）"
+            )
+            
+            default_record_name = (st.session_state.get('seed_input') if not st.session_state.has_preexisting_groups
+                                   else None) or st.session_state.get('dataset_name') or "AA检验"
+            record_col1, record_col2 = st.columns([1, 2])
+            with record_col1:
+                save_to_history = st.checkbox("保存到历史记录", value=True,
+                                              help="分析结果与配置、数据集指纹一起保存在本地结果库中，可在“历史结果”页面查询各指标的假阳性率")
+            with record_col2:
+                record_name = st.text_input("实验名称（用于历史记录）", value=default_record_name,
+                                            disabled=not save_to_history)
+            
+            progressive_mode = st.checkbox(
+                "渐进式分析（先显示抽样预览）",
+                value=len(session_data) >= PROGRESSIVE_DEFAULT_ROWS,
+                help="先在约1%的用户（按用户ID哈希分桶抽样，与实验分组无关）上完成检验并立即显示结果，"
+                     "置信区间按样本量相应放宽；随后在后台依次扩大到10%和全部数据，完整结果计算完成后自动替换预览。"
+                     "数据量较小时直接计算完整结果。只有完整结果会保存到历史记录"
+            )
             
             if st.button("运行分析"):
                 try:
@@ -879,7 +1328,7 @@ if st.session_state.show_metric_analysis:
                     # 处理预分组数据的情况
                     if st.session_state.has_preexisting_groups:
                         # 获取所有非对照组的组名
-                        all_groups = st.session_state.data['group_name'].unique()
+                        all_groups = session_data['group_name'].unique()
                         control_group = [g for g in all_groups if 'control' in g.lower()]
                         if not control_group:  # 如果没有找到包含'control'的组名，使用第一个组作为对照组
                             control_group = [all_groups[0]]
@@ -895,42 +1344,104 @@ if st.session_state.show_metric_analysis:
                     progress_bar.progress(25)
                     
                     status_text.text("执行统计检验...")
-                    results = st.session_state.analyzer.run_statistical_tests(
-                        data=st.session_state.data,
-                        metrics=metrics,
-                        metric_types=metric_types,
-                        groupname="group_name",
-                        treated_labels=treated_labels,
-                        control_label=control_label,
-                        is_two_sided=is_two_sided,
-                        alternative=alternative
-                    )
-                    progress_bar.progress(75)
+                    is_two_sided, alternative = get_test_direction()
+                    analyzer = get_analyzer()
+                    group_proportions = st.session_state.proportions
                     
-                    status_text.text("生成分析结果...")
-                    st.session_state.results = results
-                    progress_bar.progress(100)
-                    status_text.text("分析完成！")
+                    # 渐进式分析在后台线程中调用，不能读取 st.session_state
+                    def run_tests(data):
+                        return analyzer.run_statistical_tests(
+                            data=data,
+                            metrics=metrics,
+                            metric_types=metric_types,
+                            groupname="group_name",
+                            treated_labels=treated_labels,
+                            control_label=control_label,
+                            is_two_sided=is_two_sided,
+                            alternative=alternative,
+                            group_proportions=group_proportions,
+                            capping=capping,
+                            method=test_method,
+                            correction=CORRECTION_OPTIONS[correction_label],
+                            missing=MISSING_OPTIONS[missing_label],
+                            stratify_by=stratify_by or None
+                        )
+                    
+                    record = None
+                    if save_to_history:
+                        record = dict(
+                            experiment=record_name or default_record_name,
+                            config={
+                                'metrics': metrics, 'metric_types': metric_types,
+                                'treated_labels': treated_labels, 'control_label': control_label,
+                                'alternative': alternative if not is_two_sided else 'two-sided',
+                                'method': test_method, 'capping': capping,
+                                'correction': CORRECTION_OPTIONS[correction_label],
+                                'missing': MISSING_OPTIONS[missing_label],
+                                'stratify_by': stratify_by,
+                                'group_proportions': st.session_state.proportions,
+                                'preexisting_groups': st.session_state.has_preexisting_groups,
+                                'unit_id_col': st.session_state.unit_id_col,
+                            },
+                            dataset_fingerprint=st.session_state.dataset_key,
+                            n_rows=len(session_data),
+                            metric_types=dict(zip(metrics, metric_types)),
+                            correction=CORRECTION_OPTIONS[correction_label]
+                        )
                     
-                    st.success("✅ 分析完成！")
+                    # 新的分析开始后，上一次渐进式分析不再需要继续计算
+                    if st.session_state.progressive is not None:
+                        st.session_state.progressive['job'].cancel()
+                        st.session_state.progressive = None
                     
-                    st.write("分析结果：")
-                    st.dataframe(results)
+                    if progressive_mode:
+                        from progressive import ProgressiveAnalysis
+                        buckets = cached_sample_buckets(st.session_state.dataset_key, st.session_state.unit_id_col,
+                                                        session_data[st.session_state.unit_id_col])
+                        job = ProgressiveAnalysis(session_data, run_tests, buckets)
+                        results = job.start()
+                    else:
+                        job = None
+                        results = run_tests(session_data)
+                    progress_bar.progress(75)
                     
-                    st.markdown("### 📥 下载分析结果")
-                    st.markdown(get_download_link(
-                        results,
-                        "experiment_results.xlsx",
-                        "📥 下载分析结果报告"
-                    ), unsafe_allow_html=True)
+                    status_text.text("生成分析结果...")
+                    if job is not None and job.latest()[0] != 100:
+                        # 抽样预览：由下方的 render_progressive_results 显示并在完成后替换
+                        st.session_state.progressive = {'job': job, 'record': record, 'finished': False}
+                        progress_bar.progress(100)
+                        status_text.text("已显示抽样预览，正在后台计算完整结果...")
+                    else:
+                        st.session_state.results = results
+                        if record is not None:
+                            save_to_results_store(results, record)
+                        progress_bar.progress(100)
+                        status_text.text("分析完成！")
+                        
+                        show_analysis_results(results)
                     
                 except Exception as e:
                     st.error(f"分析过程出错：{str(e)}")
                     st.error("错误详细信息：")
-                    st.write("现有分组：", st.session_state.data['group_name'].unique())
+                    st.write("现有分组：", session_data['group_name'].unique())
                     st.write("指标：", metrics)
                     st.write("指标类型：", metric_types)
+            
+            if st.session_state.progressive is not None:
+                render_progressive_results()
+
+render_upload_step()
+
+# Visual connector
+if st.session_state.show_group_config:
+    st.markdown("<div class='section-connector'></div>", unsafe_allow_html=True)
+    render_group_config_step()
+
+# Visual connector
+if st.session_state.show_metric_analysis:
+    st.markdown("<div class='section-connector'></div>", unsafe_allow_html=True)
+    render_metric_analysis_step()
 
 # Remove the entire Section 4: Results Summary section and its related code
 if st.session_state.show_results:
-    st.markdown("<div class='section-connector'></div>", unsafe_allow_html=True) 
\ No newline at end of file
+    st.markdown("<div class='section-connector'></div>", unsafe_allow_html=True)
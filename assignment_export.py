@@ -0,0 +1,256 @@
+"""
+Partitioned Parquet export of group assignments.
+
+Writes (unit ID, bucket) rows as compressed Parquet, partitioned Hive-style by group and
+optionally by bucket range, so Spark or warehouse jobs can join against the assignments
+directly and prune to the groups (and buckets) they need. IDs are consumed a chunk at a
+time and every chunk is appended to the open partition files, so the full assignment
+table is never materialized. A ``_manifest.json`` with the salt, proportions, allocation,
+row counts and file list is written last; an export without it is incomplete.
+
+Layout::
+
+    <output>/_manifest.json                                             (skipped by Spark/pyarrow readers)
+    <output>/group_name=<group>/part-00000.parquet
+    <output>/group_name=<group>/bucket_range=00-09/part-00000.parquet   (with bucket ranges)
+"""
+import argparse
+import json
+import os
+import zipfile
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Union
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from experiment_analysis import ExperimentAnalysis
+from hashing import DEFAULT_HASH_BACKEND
+
+EXPORT_CHUNK_ROWS = 1_000_000
+DEFAULT_COMPRESSION = 'zstd'
+MANIFEST_FILE = '_manifest.json'
+N_BUCKETS = 100
+
+IdChunks = Union[pd.Series, np.ndarray, List, Iterable[Union[pd.Series, np.ndarray, List]]]
+
+
+def bucket_range_label(bucket: int, width: int) -> str:
+    """Label of the bucket range holding ``bucket``, e.g. '00-09' for width 10."""
+    start = bucket // width * width
+    return f"{start:02d}-{min(start + width, N_BUCKETS) - 1:02d}"
+
+
+def allocation_ranges(group_proportions: Dict[str, Union[str, float, int]]) -> Dict[str, List[List[int]]]:
+    """Bucket ranges [first, last] of each group under the compiled allocation."""
+    groups, bucket_to_group = ExperimentAnalysis.compile_allocation(group_proportions)
+    ranges = {group: [] for group in groups}
+    for bucket, code in enumerate(bucket_to_group):
+        group_ranges = ranges[groups[code]]
+        if group_ranges and group_ranges[-1][1] == bucket - 1:
+            group_ranges[-1][1] = bucket
+        else:
+            group_ranges.append([bucket, bucket])
+    return ranges
+
+
+class AssignmentWriter:
+    """
+    Appends assigned units to partitioned Parquet files.
+
+    Args:
+        output_dir (str): Export directory; must not exist yet or be empty
+        experiment_name (str): Salt the buckets were computed with
+        group_proportions (dict): Group proportions; groups follow from the buckets
+        hash_backend (str): Hashing backend the buckets were computed with
+        bucket_range_width (int, optional): Also partition by ranges of this many buckets
+        compression (str): Parquet compression codec
+        id_column (str): Name of the ID column in the files
+    """
+
+    def __init__(self, output_dir: str, experiment_name: str,
+                 group_proportions: Dict[str, Union[str, float, int]],
+                 hash_backend: str = DEFAULT_HASH_BACKEND, bucket_range_width: Optional[int] = None,
+                 compression: str = DEFAULT_COMPRESSION, id_column: str = 'apollo_key'):
+        if bucket_range_width is not None and not 1 <= bucket_range_width <= N_BUCKETS:
+            raise ValueError(f"bucket_range_width must be between 1 and {N_BUCKETS}")
+        if os.path.isdir(output_dir) and os.listdir(output_dir):
+            raise ValueError(f"Export directory is not empty: {output_dir}")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.experiment_name = experiment_name
+        self.group_proportions = group_proportions
+        self.hash_backend = hash_backend
+        self.bucket_range_width = bucket_range_width
+        self.compression = compression
+        self.id_column = id_column
+        self.groups, self._bucket_to_group = ExperimentAnalysis.compile_allocation(group_proportions)
+        # Partitions as (group, bucket range label or None), and the partition of every bucket
+        bucket_partitions = [
+            (self.groups[code], bucket_range_label(bucket, bucket_range_width) if bucket_range_width else None)
+            for bucket, code in enumerate(self._bucket_to_group)
+        ]
+        self._partitions = list(dict.fromkeys(bucket_partitions))
+        self._bucket_partition = np.array([self._partitions.index(p) for p in bucket_partitions], dtype=np.int64)
+        self._schema = pa.schema([(id_column, pa.string()), ('bucket_number', pa.uint8())])
+        self._writers: Dict[tuple, pq.ParquetWriter] = {}
+        self._rows: Dict[tuple, int] = {}
+
+    def _path(self, partition: tuple) -> str:
+        group, bucket_range = partition
+        parts = [f"group_name={quote(str(group), safe='')}"]
+        if bucket_range is not None:
+            parts.append(f"bucket_range={bucket_range}")
+        return os.path.join(*parts, 'part-00000.parquet')
+
+    def _writer(self, partition: tuple) -> pq.ParquetWriter:
+        if partition not in self._writers:
+            path = os.path.join(self.output_dir, self._path(partition))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._writers[partition] = pq.ParquetWriter(path, self._schema, compression=self.compression)
+            self._rows[partition] = 0
+        return self._writers[partition]
+
+    def write(self, encoded_ids: np.ndarray, buckets: np.ndarray):
+        """
+        Append a chunk of units.
+
+        Args:
+            encoded_ids (np.ndarray): IDs formatted as for bucketing (``ExperimentAnalysis._encode_ids``)
+            buckets (np.ndarray): Bucket number of each ID
+        """
+        buckets = np.asarray(buckets, dtype=np.uint8)
+        ids = pa.array(np.asarray(encoded_ids, dtype=np.bytes_), type=pa.binary()).cast(pa.string())
+        # One stable sort groups the rows by partition; each partition gets one row group per chunk
+        codes = self._bucket_partition[buckets]
+        order = np.argsort(codes, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(self._partitions)))])
+        for code, partition in enumerate(self._partitions):
+            rows = order[bounds[code]:bounds[code + 1]]
+            if len(rows) == 0:
+                continue
+            table = pa.table({self.id_column: ids.take(rows), 'bucket_number': buckets[rows]}, schema=self._schema)
+            self._writer(partition).write_table(table)
+            self._rows[partition] += len(rows)
+
+    def close(self) -> Dict:
+        """Finish all files and write the manifest; returns the manifest."""
+        for writer in self._writers.values():
+            writer.close()
+        files = []
+        for partition in sorted(self._writers, key=self._partitions.index):
+            path = self._path(partition)
+            files.append({
+                'path': path.replace(os.sep, '/'), 'group_name': partition[0], 'bucket_range': partition[1],
+                'rows': self._rows[partition], 'bytes': os.path.getsize(os.path.join(self.output_dir, path)),
+            })
+        group_counts = {group: sum(f['rows'] for f in files if f['group_name'] == group) for group in self.groups}
+        manifest = {
+            'format': 'parquet',
+            'compression': self.compression,
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'experiment': self.experiment_name,
+            'hash_backend': self.hash_backend,
+            'group_proportions': {group: ExperimentAnalysis._extract_percentage(value)
+                                  for group, value in self.group_proportions.items()},
+            'allocation': allocation_ranges(self.group_proportions),
+            'partitioning': ['group_name'] + (['bucket_range'] if self.bucket_range_width else []),
+            'bucket_range_width': self.bucket_range_width,
+            'columns': {self.id_column: 'string', 'bucket_number': 'uint8'},
+            'rows': sum(group_counts.values()),
+            'group_counts': group_counts,
+            'files': files,
+        }
+        # Written last and atomically, so readers never see a manifest of a partial export
+        temporary = os.path.join(self.output_dir, MANIFEST_FILE + '.tmp')
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temporary, os.path.join(self.output_dir, MANIFEST_FILE))
+        return manifest
+
+
+def _chunks(ids: IdChunks, chunk_rows: int) -> Iterable:
+    if isinstance(ids, pd.Series):
+        return (ids.iloc[start:start + chunk_rows] for start in range(0, len(ids), chunk_rows))
+    if isinstance(ids, (np.ndarray, list)):
+        return (ids[start:start + chunk_rows] for start in range(0, len(ids), chunk_rows))
+    return ids
+
+
+def export_assignments(ids: IdChunks, experiment_name: str, group_proportions: Dict[str, Union[str, float, int]],
+                       output_dir: str, hash_backend: str = DEFAULT_HASH_BACKEND,
+                       bucket_range_width: Optional[int] = None, buckets: Optional[IdChunks] = None,
+                       chunk_rows: int = EXPORT_CHUNK_ROWS, compression: str = DEFAULT_COMPRESSION,
+                       id_column: str = 'apollo_key') -> Dict:
+    """
+    Bucket IDs and export the assignments as partitioned Parquet with a manifest.
+
+    Args:
+        ids: A column of IDs (Series, array or list), consumed ``chunk_rows`` at a time, or
+            an iterable of ID chunks such as the ID column of ``pd.read_csv(..., chunksize=...)``
+        experiment_name (str): Salt for ``apollo_bucket``
+        group_proportions (dict): Group proportions (e.g. {'control': '50%', 'treatment': '50%'})
+        output_dir (str): Export directory; must not exist yet or be empty
+        hash_backend (str): Hashing backend
+        bucket_range_width (int, optional): Also partition by ranges of this many buckets
+        buckets (optional): Already computed bucket numbers, chunked like ``ids``; skips hashing
+        chunk_rows (int): IDs per chunk when ``ids`` is a single column
+        compression (str): Parquet compression codec
+        id_column (str): Name of the ID column in the files
+
+    Returns:
+        dict: The manifest
+    """
+    writer = AssignmentWriter(output_dir, experiment_name, group_proportions, hash_backend,
+                              bucket_range_width, compression, id_column)
+    bucket_chunks = iter(_chunks(buckets, chunk_rows)) if buckets is not None else None
+    for chunk in _chunks(ids, chunk_rows):
+        encoded = ExperimentAnalysis._encode_ids(chunk)
+        if bucket_chunks is not None:
+            chunk_buckets = np.asarray(next(bucket_chunks))
+            if len(chunk_buckets) != len(encoded):
+                raise ValueError("ids and buckets must have the same length")
+        else:
+            chunk_buckets = ExperimentAnalysis._hash_buckets(experiment_name, encoded.tolist(), hash_backend)
+        writer.write(encoded, chunk_buckets)
+    return writer.close()
+
+
+def zip_export(output_dir: str, zip_path: str) -> str:
+    """Pack an export directory into a zip file (stored, as Parquet is already compressed)."""
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for root, _, files in os.walk(output_dir):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                archive.write(path, os.path.relpath(path, output_dir))
+    return zip_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bucket the IDs of a CSV file and export the assignments as "
+                                                 "partitioned Parquet")
+    parser.add_argument('ids_csv', help='CSV file with an ID column, read in chunks')
+    parser.add_argument('--id-col', required=True)
+    parser.add_argument('--experiment', required=True, help='Salt (experiment name)')
+    parser.add_argument('--proportions', nargs='+', required=True, metavar='GROUP=PERCENT',
+                        help='e.g. control=50 treatment=50')
+    parser.add_argument('--output', required=True, help='Export directory (new or empty)')
+    parser.add_argument('--hash-backend', default=DEFAULT_HASH_BACKEND)
+    parser.add_argument('--bucket-range-width', type=int, help='Also partition by ranges of this many buckets')
+    parser.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    proportions = dict(item.split('=', 1) for item in args.proportions)
+    proportions = {group: f"{value.rstrip('%')}%" for group, value in proportions.items()}
+    chunks = (chunk[args.id_col] for chunk in pd.read_csv(args.ids_csv, usecols=[args.id_col],
+                                                          chunksize=args.chunk_rows))
+    manifest = export_assignments(chunks, args.experiment, proportions, args.output, args.hash_backend,
+                                  args.bucket_range_width)
+    print(json.dumps({key: manifest[key] for key in ('rows', 'group_counts', 'partitioning')}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
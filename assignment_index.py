@@ -0,0 +1,213 @@
+"""
+Persisted, memory-mapped assignment index.
+
+Stores the bucket of every ID ever seen for an experiment salt as two columnar ``.npy``
+files (sorted IDs and their buckets). Re-opening an experiment memory-maps those files,
+so existing IDs are resolved with a vectorized ``searchsorted`` and only IDs that are not
+in the index yet are hashed.
+
+Layout::
+
+    <root>/<salt key>/manifest.json          current version, salt and ID set fingerprint
+    <root>/<salt key>/<fingerprint>/ids.npy   sorted IDs (fixed-width UTF-8 bytes)
+    <root>/<salt key>/<fingerprint>/buckets.npy
+    <root>/<salt key>/.lock                   serializes writers across sessions and processes
+
+Appends hold an exclusive lock and merge into whatever version is current at that moment,
+so concurrent sessions never drop each other's IDs; opening a version holds a shared lock,
+so it is never removed while being loaded.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+from experiment_analysis import ExperimentAnalysis
+from hashing import DEFAULT_HASH_BACKEND
+
+DEFAULT_INDEX_DIR = os.environ.get(
+    'AA_ASSIGNMENT_INDEX_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'aa_analysis', 'assignment_index')
+)
+
+# Fixed key so that fingerprints are stable across processes and pandas versions.
+_FINGERPRINT_KEY = 'aa_assign_index'.ljust(16, '0')[:16]
+
+
+def _to_keys(ids: Union[pd.Series, np.ndarray, List]) -> np.ndarray:
+    """Format IDs the way ``apollo_bucket`` does and encode them as UTF-8 bytes."""
+    return ExperimentAnalysis._encode_ids(ids)
+
+
+def id_set_fingerprint(keys: np.ndarray) -> str:
+    """Order-independent fingerprint of a set of ID keys (sum of unique 64-bit hashes)."""
+    hashes = np.unique(pd.util.hash_array(keys.astype(object), hash_key=_FINGERPRINT_KEY))
+    return '{:016x}'.format(int(hashes.sum(dtype=np.uint64)))
+
+
+class AssignmentIndex:
+    """Persisted ID -> bucket table for one experiment salt."""
+
+    def __init__(self, experiment_name: str, root_dir: str = DEFAULT_INDEX_DIR,
+                 hash_backend: str = DEFAULT_HASH_BACKEND):
+        self.experiment_name = experiment_name
+        self.hash_backend = hash_backend
+        # Buckets depend on the backend, so non-default backends get their own table.
+        index_key = experiment_name if hash_backend == DEFAULT_HASH_BACKEND else f"{experiment_name}|{hash_backend}"
+        salt_key = hashlib.sha1(index_key.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(root_dir, salt_key)
+        self._manifest_path = os.path.join(self.path, 'manifest.json')
+        self._ids = np.empty(0, dtype='S1')
+        self._buckets = np.empty(0, dtype=np.uint8)
+        self.fingerprint = None
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive: bool):
+        """Hold the index's lock file; a no-op where ``fcntl`` is unavailable."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open(self):
+        if not os.path.exists(self._manifest_path):
+            return
+        with self._locked(exclusive=False):
+            self._load()
+
+    def _load(self):
+        """Memory-map the version named by the manifest; the caller holds the lock."""
+        if not os.path.exists(self._manifest_path):
+            return
+        with open(self._manifest_path) as f:
+            manifest = json.load(f)
+        version_dir = os.path.join(self.path, manifest['fingerprint'])
+        self._ids = np.load(os.path.join(version_dir, 'ids.npy'), mmap_mode='r')
+        self._buckets = np.load(os.path.join(version_dir, 'buckets.npy'), mmap_mode='r')
+        self.fingerprint = manifest['fingerprint']
+
+    def _find(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions of ``keys`` in the sorted ID column and a mask of keys that were found."""
+        found = np.zeros(len(keys), dtype=bool)
+        positions = np.zeros(len(keys), dtype=np.int64)
+        if len(self._ids) == 0:
+            return positions, found
+
+        # Keys wider than the stored column cannot be present; casting the rest to the
+        # stored width keeps the memory-mapped column from being copied.
+        width = self._ids.dtype.itemsize
+        candidates = np.char.str_len(keys) <= width
+        query = keys[candidates].astype(self._ids.dtype)
+        pos = np.searchsorted(self._ids, query)
+        pos_clipped = np.minimum(pos, len(self._ids) - 1)
+        hit = self._ids[pos_clipped] == query
+
+        positions[candidates] = pos_clipped
+        found[candidates] = hit
+        return positions, found
+
+    def _append(self, new_keys: np.ndarray, new_buckets: np.ndarray):
+        """
+        Merge new keys into the index and atomically switch the manifest to the new version.
+
+        Another session may have appended since this one opened the index, so the current
+        version is reloaded under the lock and only keys it does not hold yet are added.
+        """
+        with self._locked(exclusive=True):
+            self._load()
+            _, present = self._find(new_keys)
+            if present.any():
+                new_keys, new_buckets = new_keys[~present], new_buckets[~present]
+            if len(new_keys) == 0:
+                return
+            # The ID sets are disjoint, so the fingerprint of the union is the sum of both.
+            previous = int(self.fingerprint, 16) if self.fingerprint else 0
+            added = int(id_set_fingerprint(new_keys), 16)
+            self._write_version(new_keys, new_buckets, '{:016x}'.format((previous + added) % 2 ** 64))
+
+    def _write_version(self, new_keys: np.ndarray, new_buckets: np.ndarray, fingerprint: str):
+        width = max(self._ids.dtype.itemsize, new_keys.dtype.itemsize)
+        ids = np.concatenate([np.asarray(self._ids).astype(f'S{width}'), new_keys.astype(f'S{width}')])
+        buckets = np.concatenate([np.asarray(self._buckets), new_buckets])
+        order = np.argsort(ids, kind='stable')
+
+        version_dir = os.path.join(self.path, fingerprint)
+        os.makedirs(version_dir, exist_ok=True)
+        np.save(os.path.join(version_dir, 'ids.npy'), ids[order])
+        np.save(os.path.join(version_dir, 'buckets.npy'), buckets[order])
+
+        tmp_manifest = self._manifest_path + '.tmp'
+        with open(tmp_manifest, 'w') as f:
+            json.dump({'experiment_name': self.experiment_name,
+                       'hash_backend': self.hash_backend,
+                       'fingerprint': fingerprint,
+                       'n_ids': int(len(ids))}, f)
+        os.replace(tmp_manifest, self._manifest_path)
+
+        previous = self.fingerprint
+        self._load()
+        if previous is not None and previous != fingerprint:
+            # Open memory maps keep the old files readable until they are released.
+            shutil.rmtree(os.path.join(self.path, previous), ignore_errors=True)
+
+    def lookup(self, ids: Union[pd.Series, np.ndarray, List]) -> np.ndarray:
+        """
+        Bucket numbers for ``ids``, hashing only IDs that are not in the index yet.
+
+        Args:
+            ids (pd.Series, np.ndarray or list): Individual identifiers
+
+        Returns:
+            np.ndarray: Bucket number (0-99) for each ID, in input order
+        """
+        keys = _to_keys(ids)
+        positions, found = self._find(keys)
+        buckets = np.empty(len(keys), dtype=np.uint8)
+        buckets[found] = self._buckets[positions[found]]
+
+        if not found.all():
+            missing_keys, inverse = np.unique(keys[~found], return_inverse=True)
+            missing_buckets = ExperimentAnalysis._hash_buckets(
+                self.experiment_name, missing_keys.tolist(), self.hash_backend)
+            buckets[~found] = missing_buckets[inverse.ravel()]
+            self._append(missing_keys, missing_buckets)
+
+        return buckets
+
+    def assign(self, ids: Union[pd.Series, np.ndarray, List],
+               group_proportions: Dict[str, Union[str, float, int]]) -> Tuple[np.ndarray, pd.Categorical]:
+        """
+        Bucket numbers and group names for ``ids``.
+
+        Groups are derived from the stored buckets through the compiled allocation, so
+        changing the proportions never requires re-hashing.
+
+        Args:
+            ids (pd.Series, np.ndarray or list): Individual identifiers
+            group_proportions (dict): Dictionary of group names and their proportions
+
+        Returns:
+            Tuple[np.ndarray, pd.Categorical]: Bucket numbers and group names in input order
+        """
+        buckets = self.lookup(ids)
+        groups, bucket_to_group = ExperimentAnalysis.compile_allocation(group_proportions)
+        return buckets, pd.Categorical.from_codes(bucket_to_group[buckets], categories=groups)
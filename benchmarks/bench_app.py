@@ -0,0 +1,108 @@
+"""
+Cold-start and per-interaction latency of the Streamlit app, measured with AppTest.
+
+``full_rerun_s`` is what any interaction costs when the whole script reruns; with
+fragment-scoped steps a widget inside a step only costs that step's ``fragment_*_s``.
+The scenario runs in a fresh interpreter so module imports are really cold:
+    python benchmarks/bench_app.py --rows 50000 --repeat 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+_CHILD = r'''
+import functools, json, sys, time
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+app_path, n_rows, repeat = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+timings = {}
+
+# AppTest always reruns the whole script, so the cost of a fragment-scoped rerun is
+# measured by timing each fragment body inside the full runs.
+fragment_samples = {}
+_fragment = st.fragment
+
+def _timed_fragment(func=None, **kwargs):
+    if func is None:
+        return lambda f: _timed_fragment(f, **kwargs)
+
+    @functools.wraps(func)
+    def timed(*args, **kw):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kw)
+        finally:
+            fragment_samples.setdefault(func.__name__, []).append(time.perf_counter() - start)
+    return _fragment(timed, **kwargs)
+
+st.fragment = _timed_fragment
+
+# Streamlit itself is already loaded in a running server, so only the script run is timed.
+start = time.perf_counter()
+at = AppTest.from_file(app_path, default_timeout=600).run()
+timings['cold_start_s'] = time.perf_counter() - start
+
+rng = np.random.default_rng(0)
+data = pd.DataFrame({
+    'user_id': np.arange(n_rows) + 10 ** 6,
+    'revenue': rng.exponential(10, n_rows),
+    'clicks': rng.poisson(3, n_rows),
+    'converted': rng.integers(0, 2, n_rows),
+})
+at.file_uploader[0].upload('bench.csv', data.to_csv(index=False).encode(), 'text/csv').run()
+next(b for b in at.button if b.label == '处理数据集').click().run()
+next(b for b in at.button if b.label == '生成分组').click().run()
+next(m for m in at.multiselect if '指标' in m.label).set_value(['revenue', 'converted']).run()
+
+def interact(label, values):
+    fragment_samples.clear()
+    samples = []
+    for i in range(repeat):
+        widget = next(s for s in at.selectbox if s.label == label)
+        start = time.perf_counter()
+        widget.set_value(values[i % len(values)]).run()
+        samples.append(time.perf_counter() - start)
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return float(np.median(samples))
+
+timings['full_rerun_s'] = interact('converted 的指标类型', ['比例', '均值'])
+for name, samples in fragment_samples.items():
+    timings[f'fragment_{name}_s'] = float(np.median(samples))
+print(json.dumps(timings))
+'''
+
+
+def measure(app_path: str, n_rows: int, repeat: int) -> dict:
+    """Run the AppTest scenario in a fresh interpreter and return its timings."""
+    output = subprocess.run(
+        [sys.executable, '-c', _CHILD, app_path, str(n_rows), str(repeat)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', default=APP_PATH)
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=10, help='Interactions timed')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    timings = measure(args.app, args.rows, args.repeat)
+    for name, seconds in timings.items():
+        print(f"{name:<40} {seconds * 1000:10.1f} ms")
+    print(f"{'total_wall_s':<40} {time.perf_counter() - start:10.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Concurrent-session load test of the Streamlit app, driven by AppTest.
+
+Every simulated analyst opens the app, uploads a synthetic CSV, processes it, generates
+groups, selects metrics and runs the analysis; the harness reports latency percentiles
+per step, the peak resident memory and the CPU use of all sessions together.
+
+AppTest swaps process-global runtime state on every run, so sessions cannot share one
+interpreter: each session runs in its own process. Memory is therefore summed over
+processes, each with its own interpreter and caches, which makes it an upper bound for a
+single server process; CPU contention is real, as all sessions compete for the same cores.
+
+Command line::
+
+    python benchmarks/loadtest_app.py --sessions 8 --rows 100000 --metrics 4
+
+Exits with status 1 when ``--max-p95-s`` is given and a step's p95 latency exceeds it.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+STEPS = ('open', 'upload', 'process', 'groups', 'metrics', 'analysis')
+SAMPLE_INTERVAL_S = 0.25
+
+
+def synthetic_csv(n_rows: int, n_metrics: int, seed: int) -> bytes:
+    """CSV with a unit ID, ``n_metrics`` continuous metrics and one conversion flag."""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    data = {'user_id': np.arange(n_rows) + 10 ** 7 * (seed + 1)}
+    for i in range(n_metrics):
+        data[f'metric_{i}'] = rng.exponential(10, n_rows).round(4)
+    data['converted'] = rng.integers(0, 2, n_rows)
+    return pd.DataFrame(data).to_csv(index=False).encode()
+
+
+def _rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # No procfs: fall back to the peak, reported in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _cpu_seconds() -> float:
+    times = os.times()
+    return times.user + times.system
+
+
+class _Sampler(threading.Thread):
+    """Samples (wall time, RSS, CPU seconds) of the current process."""
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.samples.append((time.time(), _rss_bytes(), _cpu_seconds()))
+            self._done.wait(self.interval)
+
+    def stop(self) -> list:
+        self._done.set()
+        self.join()
+        self.samples.append((time.time(), _rss_bytes(), _cpu_seconds()))
+        return self.samples
+
+
+def _step(at, name: str, action, timings: dict):
+    start = time.perf_counter()
+    action()
+    timings.setdefault(name, []).append(time.perf_counter() - start)
+    if at is not None and (at.exception or at.error):
+        messages = [str(e.value) for e in list(at.exception) + list(at.error)]
+        raise RuntimeError(f"{name}: {messages[0][:200]}")
+
+
+def run_session(app_path: str, session: int, n_rows: int, n_metrics: int, iterations: int,
+                barrier, delay_s: float, shared_file: bool) -> dict:
+    """One analyst: ``iterations`` times the full upload -> groups -> analysis flow."""
+    from streamlit.testing.v1 import AppTest
+
+    sampler = _Sampler(SAMPLE_INTERVAL_S)
+    sampler.start()
+    content = synthetic_csv(n_rows, n_metrics, 0 if shared_file else session)
+    metrics = [f'metric_{i}' for i in range(n_metrics)] + ['converted']
+    timings, errors = {}, []
+
+    # Imports and the first script run are not part of the measured load
+    AppTest.from_file(app_path, default_timeout=3600).run()
+    barrier.wait()
+    time.sleep(delay_s)
+    started_at = time.time()
+
+    for iteration in range(iterations):
+        at = AppTest.from_file(app_path, default_timeout=3600)
+        try:
+            _step(at, 'open', at.run, timings)
+            _step(at, 'upload', lambda: at.file_uploader[0].upload(
+                f'session_{session}.csv', content, 'text/csv').run(), timings)
+            _step(at, 'process', lambda: next(b for b in at.button if b.label == '处理数据集').click().run(), timings)
+            _step(at, 'groups', lambda: next(b for b in at.button if b.label == '生成分组').click().run(), timings)
+            _step(at, 'metrics', lambda: next(m for m in at.multiselect if '指标' in m.label).set_value(
+                metrics).run(), timings)
+            _step(at, 'analysis', lambda: next(b for b in at.button if b.label == '运行分析').click().run(), timings)
+        except (RuntimeError, StopIteration) as e:
+            errors.append(f"session {session}, iteration {iteration}: {e or 'expected widget not found'}")
+
+    finished_at = time.time()
+    return {'timings': timings, 'errors': errors, 'samples': sampler.stop(),
+            'started_at': started_at, 'finished_at': finished_at}
+
+
+def _aggregate_usage(sessions: list, start: float, end: float, interval: float) -> dict:
+    """Peak summed RSS and CPU cores in use between ``start`` and ``end``, from the per-session samples."""
+    grid = np.arange(start, end + interval, interval)
+    total_rss = np.zeros(len(grid))
+    total_cpu = np.zeros(len(grid))
+    peak_session_rss = 0.0
+    for session in sessions:
+        times, rss, cpu = (np.array(column, dtype=np.float64) for column in zip(*session['samples']))
+        alive = (grid >= times[0]) & (grid <= times[-1])
+        total_rss += np.where(alive, np.interp(grid, times, rss), 0)
+        total_cpu += np.interp(grid, times, cpu)
+        peak_session_rss = max(peak_session_rss, rss[(times >= start) & (times <= end)].max(initial=0))
+    cores = np.diff(total_cpu) / interval
+    return {
+        'peak_rss_mb': float(total_rss.max() / 2 ** 20),
+        'peak_session_rss_mb': float(peak_session_rss / 2 ** 20),
+        'peak_cpu_cores': float(cores.max()) if len(cores) else 0.0,
+        'mean_cpu_cores': float((total_cpu[-1] - total_cpu[0]) / max(end - start, interval)),
+    }
+
+
+def run_load_test(app_path: str, n_sessions: int, n_rows: int, n_metrics: int, iterations: int,
+                  ramp_s: float = 0.0, shared_file: bool = False) -> dict:
+    """
+    Run ``n_sessions`` concurrent sessions and summarize their latencies and resource use.
+
+    Returns:
+        dict: Per-step latency percentiles ('steps'), resource usage, errors and wall time
+    """
+    # Keep the results database and assignment index of the load test out of the user's cache
+    workdir = tempfile.mkdtemp(prefix='aa_loadtest_')
+    os.environ['AA_RESULTS_DB'] = os.path.join(workdir, 'results.sqlite')
+    os.environ['AA_ASSIGNMENT_INDEX_DIR'] = os.path.join(workdir, 'assignment_index')
+
+    # Sessions start together (or spread over ``ramp_s``) once every process has warmed up
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager, \
+            ProcessPoolExecutor(max_workers=n_sessions, mp_context=context) as pool:
+        barrier = manager.Barrier(n_sessions)
+        futures = [
+            pool.submit(run_session, app_path, i, n_rows, n_metrics, iterations, barrier,
+                        ramp_s * i / max(n_sessions - 1, 1), shared_file)
+            for i in range(n_sessions)
+        ]
+        sessions = [future.result() for future in futures]
+    start = min(s['started_at'] for s in sessions)
+    end = max(s['finished_at'] for s in sessions)
+    wall_s = end - start
+
+    steps = {}
+    for step in STEPS:
+        samples = np.array([t for s in sessions for t in s['timings'].get(step, [])])
+        if len(samples):
+            steps[step] = {'n': int(len(samples)), 'p50_s': float(np.percentile(samples, 50)),
+                           'p95_s': float(np.percentile(samples, 95)), 'p99_s': float(np.percentile(samples, 99)),
+                           'max_s': float(samples.max())}
+    completed = sum(len(s['timings'].get('analysis', [])) for s in sessions)
+    return {
+        'sessions': n_sessions, 'rows': n_rows, 'metrics': n_metrics + 1, 'iterations': iterations,
+        'steps': steps,
+        **_aggregate_usage(sessions, start, end, SAMPLE_INTERVAL_S),
+        'completed_flows': completed,
+        'flows_per_minute': completed / wall_s * 60 if wall_s > 0 else float('nan'),
+        'wall_s': wall_s,
+        'errors': [e for s in sessions for e in s['errors']],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', default=APP_PATH)
+    parser.add_argument('--sessions', type=int, default=4, help='Concurrent sessions')
+    parser.add_argument('--rows', type=int, default=50_000, help='Rows of each synthetic upload')
+    parser.add_argument('--metrics', type=int, default=3, help='Continuous metrics (plus one conversion flag)')
+    parser.add_argument('--iterations', type=int, default=1, help='Full flows per session')
+    parser.add_argument('--ramp-s', type=float, default=0.0, help='Spread session starts over this many seconds')
+    parser.add_argument('--shared-file', action='store_true', help='All sessions upload the same file')
+    parser.add_argument('--max-p95-s', type=float, help='Fail when a step p95 latency exceeds this')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    report = run_load_test(args.app, args.sessions, args.rows, args.metrics, args.iterations,
+                           args.ramp_s, args.shared_file)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"{args.sessions} sessions x {args.iterations} flows, {args.rows} rows, {args.metrics + 1} metrics")
+        print(f"{'step':<10} {'n':>5} {'p50 s':>9} {'p95 s':>9} {'p99 s':>9} {'max s':>9}")
+        for step, stats in report['steps'].items():
+            print(f"{step:<10} {stats['n']:>5} {stats['p50_s']:>9.2f} {stats['p95_s']:>9.2f} "
+                  f"{stats['p99_s']:>9.2f} {stats['max_s']:>9.2f}")
+        print(f"peak RSS (all sessions)  {report['peak_rss_mb']:10.0f} MB")
+        print(f"peak RSS (one session)   {report['peak_session_rss_mb']:10.0f} MB")
+        print(f"CPU cores peak / mean    {report['peak_cpu_cores']:10.2f} / {report['mean_cpu_cores']:.2f}")
+        print(f"flows per minute         {report['flows_per_minute']:10.2f}")
+        for error in report['errors']:
+            print(f"ERROR {error}")
+
+    slow = {step: stats['p95_s'] for step, stats in report['steps'].items()
+            if args.max_p95_s is not None and stats['p95_s'] > args.max_p95_s}
+    if report['errors'] or slow:
+        for step, p95 in slow.items():
+            print(f"FAIL {step}: p95 {p95:.2f}s > {args.max_p95_s:.2f}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
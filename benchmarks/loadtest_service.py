@@ -0,0 +1,93 @@
+"""
+Load-test harness for the bucketing service.
+
+Starts nothing by itself: run the service first, e.g.
+    python bucketing_service.py --workers 4
+then
+    python benchmarks/loadtest_service.py --requests 2000 --concurrency 32 --batch-size 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+import numpy as np
+
+
+async def _worker(client: httpx.AsyncClient, url: str, queue: asyncio.Queue,
+                  latencies: list, errors: list):
+    while True:
+        payload = await queue.get()
+        try:
+            start = time.perf_counter()
+            response = await client.post(url, json=payload)
+            elapsed = time.perf_counter() - start
+            if response.status_code == 200:
+                latencies.append(elapsed)
+            else:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        finally:
+            queue.task_done()
+
+
+async def run_load_test(url: str, n_requests: int, concurrency: int, batch_size: int,
+                        id_space: int, experiment_name: str) -> dict:
+    """Send ``n_requests`` batch requests with ``concurrency`` in flight and collect latencies."""
+    proportions = {'control_group': '50%', 'treatment_group_1': '25%', 'treatment_group_2': '25%'}
+    rng = random.Random(0)
+
+    queue = asyncio.Queue()
+    for _ in range(n_requests):
+        ids = [str(rng.randrange(id_space)) for _ in range(batch_size)]
+        queue.put_nowait({'experiment_name': experiment_name,
+                          'group_proportions': proportions,
+                          'ids': ids})
+
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        workers = [asyncio.create_task(_worker(client, url, queue, latencies, errors))
+                   for _ in range(concurrency)]
+        start = time.perf_counter()
+        await queue.join()
+        wall = time.perf_counter() - start
+        for w in workers:
+            w.cancel()
+
+    lat_ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'wall_seconds': wall,
+        'requests_per_second': len(latencies) / wall,
+        'ids_per_second': len(latencies) * batch_size / wall,
+        'p50_ms': float(np.percentile(lat_ms, 50)) if len(lat_ms) else float('nan'),
+        'p99_ms': float(np.percentile(lat_ms, 99)) if len(lat_ms) else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for bucketing_service.py")
+    parser.add_argument('--url', default='http://127.0.0.1:8601/v1/assign')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--id-space', type=int, default=100000,
+                        help="Number of distinct IDs to draw from; smaller values exercise the hot-ID cache")
+    parser.add_argument('--experiment-name', default='loadtest_experiment')
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(args.url, args.requests, args.concurrency,
+                                       args.batch_size, args.id_space, args.experiment_name))
+    print(f"requests:      {report['requests']} ({report['errors']} errors)")
+    print(f"wall time:     {report['wall_seconds']:.2f} s")
+    print(f"throughput:    {report['requests_per_second']:.1f} req/s, {report['ids_per_second']:.0f} IDs/s")
+    print(f"latency p50:   {report['p50_ms']:.2f} ms")
+    print(f"latency p99:   {report['p99_ms']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Self-hostable bucketing service.
+
+Serves the same ``apollo_bucket`` + ``assign_groups`` logic as the analysis app over HTTP,
+so that online services can call it instead of re-implementing the hashing by hand.
+
+Run with:
+    python bucketing_service.py --host 0.0.0.0 --port 8601 --workers 4
+"""
+import argparse
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from experiment_analysis import ExperimentAnalysis
+from hashing import DEFAULT_HASH_BACKEND, get_hash_backend
+
+MAX_BATCH_SIZE = int(os.environ.get('AA_SERVICE_MAX_BATCH', 100000))
+ID_CACHE_SIZE = int(os.environ.get('AA_SERVICE_ID_CACHE', 1_000_000))
+PLAN_CACHE_SIZE = 1024
+
+
+class AllocationPlan:
+    """Compiled allocation of one experiment: its salt and a bucket-to-group lookup table."""
+
+    def __init__(self, experiment_name: str, group_proportions: Dict[str, Union[str, float, int]],
+                 hash_backend: str = DEFAULT_HASH_BACKEND):
+        get_hash_backend(hash_backend)
+        self.experiment_name = experiment_name
+        self.hash_backend = hash_backend
+        self.groups, self.bucket_to_group = ExperimentAnalysis.compile_allocation(group_proportions)
+
+    def assign(self, ids: List[Union[str, int, float]]) -> Tuple[List[int], List[str]]:
+        """Return bucket numbers and group names for a batch of IDs."""
+        buckets = np.fromiter((_cached_bucket(self.experiment_name, x, self.hash_backend) for x in ids),
+                              dtype=np.uint8, count=len(ids))
+        group_codes = self.bucket_to_group[buckets]
+        return buckets.tolist(), np.asarray(self.groups, dtype=object)[group_codes].tolist()
+
+
+@lru_cache(maxsize=ID_CACHE_SIZE)
+def _cached_bucket(experiment_name: str, individual_id: Union[str, int, float], hash_backend: str) -> int:
+    """Bucket of one ID, memoized so that hot IDs skip hashing."""
+    return ExperimentAnalysis._single_apollo_bucket(experiment_name, individual_id, hash_backend)
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _compiled_plan(experiment_name: str, frozen_proportions: Tuple[Tuple[str, str], ...],
+                   hash_backend: str) -> AllocationPlan:
+    return AllocationPlan(experiment_name, dict(frozen_proportions), hash_backend)
+
+
+def get_plan(experiment_name: str, group_proportions: Dict[str, Union[str, float, int]],
+             hash_backend: str = DEFAULT_HASH_BACKEND) -> AllocationPlan:
+    """Compiled plan for an experiment configuration, compiled once per worker."""
+    frozen = tuple((str(group), str(prop)) for group, prop in group_proportions.items())
+    return _compiled_plan(experiment_name, frozen, hash_backend)
+
+
+async def health(request: Request) -> JSONResponse:
+    cache = _cached_bucket.cache_info()
+    return JSONResponse({
+        'status': 'ok',
+        'id_cache': {'hits': cache.hits, 'misses': cache.misses, 'size': cache.currsize},
+        'compiled_plans': _compiled_plan.cache_info().currsize
+    })
+
+
+async def assign(request: Request) -> JSONResponse:
+    """
+    Batch assignment endpoint.
+
+    Request body:
+        {"experiment_name": "exp_1",
+         "group_proportions": {"control_group": "50%", "treatment_group_1": "50%"},
+         "ids": ["123", 456, ...],
+         "hash_backend": "sha1"}            (optional, defaults to the legacy SHA-1 scheme)
+
+    Response body:
+        {"experiment_name": "exp_1", "buckets": [...], "groups": [...]}
+    """
+    try:
+        payload = await request.json()
+        experiment_name = payload['experiment_name']
+        group_proportions = payload['group_proportions']
+        ids = payload['ids']
+        hash_backend = payload.get('hash_backend', DEFAULT_HASH_BACKEND)
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        return JSONResponse({'error': f"Invalid request body: {e}"}, status_code=400)
+
+    if not isinstance(ids, list):
+        return JSONResponse({'error': "'ids' must be a list"}, status_code=400)
+    if len(ids) > MAX_BATCH_SIZE:
+        return JSONResponse({'error': f"Batch size exceeds {MAX_BATCH_SIZE}"}, status_code=413)
+
+    try:
+        plan = get_plan(experiment_name, group_proportions, hash_backend)
+        # Hashing a batch is CPU-bound; off the event loop, /health and other requests stay responsive
+        buckets, groups = await run_in_threadpool(plan.assign, ids)
+    except (ValueError, TypeError, AttributeError) as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    return JSONResponse({'experiment_name': experiment_name, 'buckets': buckets, 'groups': groups})
+
+
+app = Starlette(routes=[
+    Route('/health', health, methods=['GET']),
+    Route('/v1/assign', assign, methods=['POST']),
+])
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="AA bucketing service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8601)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    uvicorn.run('bucketing_service:app', host=args.host, port=args.port,
+                workers=args.workers, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Excel ingestion.
+
+``pd.read_excel`` builds openpyxl's full workbook object model before pandas sees a
+single value. These loaders stream rows from a read-only workbook (or read whole
+columns from xlrd for legacy ``.xls``), so only the chosen sheet and columns are
+materialized, directly into per-column arrays.
+"""
+import io
+from typing import Dict, List, Optional, Sequence, Union
+
+import pandas as pd
+
+FileSource = Union[bytes, io.IOBase]
+
+PREVIEW_ROWS = 200
+
+
+def _as_buffer(source: FileSource) -> io.IOBase:
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def _is_legacy_xls(filename: str) -> bool:
+    return filename.lower().endswith('.xls')
+
+
+def _header_names(raw_header: Sequence) -> List[str]:
+    """
+    Column names from the header row, named like ``pd.read_excel`` does.
+
+    Blank cells become 'Unnamed: <position>', and repeated names get a '.1', '.2', ...
+    suffix that skips names already in the header (named columns are renamed before
+    unnamed ones), so no column is merged into another.
+    """
+    names = [f"Unnamed: {i}" if value is None else str(value) for i, value in enumerate(raw_header)]
+    unnamed = [i for i, value in enumerate(raw_header) if value is None]
+    counts: Dict[str, int] = {}
+    for i in [i for i in range(len(names)) if raw_header[i] is not None] + unnamed:
+        name = original = names[i]
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[original] = count + 1
+            name = f"{original}.{count}"
+            count = count + 1 if name in names else counts.get(name, 0)
+        names[i] = name
+        counts[name] = count + 1
+    return names
+
+
+def list_excel_sheets(source: FileSource, filename: str) -> List[str]:
+    """
+    Sheet names of a workbook without parsing any cell data.
+
+    Args:
+        source (bytes or file-like): Workbook content
+        filename (str): Original file name, used to pick the xlsx or xls parser
+
+    Returns:
+        List[str]: Sheet names in workbook order
+    """
+    if _is_legacy_xls(filename):
+        import xlrd
+        book = xlrd.open_workbook(file_contents=_as_buffer(source).read(), on_demand=True)
+        return book.sheet_names()
+
+    from openpyxl import load_workbook
+    book = load_workbook(_as_buffer(source), read_only=True, data_only=True)
+    try:
+        return book.sheetnames
+    finally:
+        book.close()
+
+
+def read_excel_columns(source: FileSource, filename: str, sheet_name: Optional[str] = None,
+                       columns: Optional[Sequence[str]] = None,
+                       nrows: Optional[int] = None) -> pd.DataFrame:
+    """
+    Stream selected columns of one sheet into a DataFrame.
+
+    The first row is used as the header. Cells are appended straight into one list per
+    selected column, so no row objects or unused columns are kept in memory.
+
+    Args:
+        source (bytes or file-like): Workbook content
+        filename (str): Original file name, used to pick the xlsx or xls parser
+        sheet_name (str, optional): Sheet to read; defaults to the first sheet
+        columns (sequence of str, optional): Columns to load; defaults to all columns
+        nrows (int, optional): Stop after this many data rows (used for previews)
+
+    Returns:
+        pd.DataFrame: Selected columns in the requested order
+    """
+    if _is_legacy_xls(filename):
+        return _read_xls_columns(source, sheet_name, columns, nrows)
+
+    from openpyxl import load_workbook
+    book = load_workbook(_as_buffer(source), read_only=True, data_only=True)
+    try:
+        sheet = book[sheet_name] if sheet_name is not None else book.worksheets[0]
+        header = _header_names(next(sheet.iter_rows(max_row=1, values_only=True), ()))
+        positions = _column_positions(header, columns)
+        if not positions:
+            return pd.DataFrame()
+
+        # Restrict parsing to the span of selected columns; cells outside it are skipped.
+        first_col = min(positions)
+        rows = sheet.iter_rows(min_row=2, min_col=first_col + 1, max_col=max(positions) + 1,
+                               values_only=True)
+        values: Dict[int, list] = {pos: [] for pos in positions}
+        n_read = 0
+        for row in rows:
+            if nrows is not None and n_read >= nrows:
+                break
+            for pos in positions:
+                offset = pos - first_col
+                values[pos].append(row[offset] if offset < len(row) else None)
+            n_read += 1
+    finally:
+        book.close()
+
+    frame = pd.DataFrame({header[pos]: values[pos] for pos in positions})
+    return _drop_trailing_empty_rows(frame)
+
+
+def _read_xls_columns(source: FileSource, sheet_name: Optional[str],
+                      columns: Optional[Sequence[str]], nrows: Optional[int]) -> pd.DataFrame:
+    import xlrd
+    book = xlrd.open_workbook(file_contents=_as_buffer(source).read(), on_demand=True)
+    try:
+        sheet = book.sheet_by_name(sheet_name) if sheet_name is not None else book.sheet_by_index(0)
+        if sheet.nrows == 0:
+            return pd.DataFrame()
+        header = _header_names([None if v == '' else v for v in sheet.row_values(0)])
+        positions = _column_positions(header, columns)
+        end_row = sheet.nrows if nrows is None else min(sheet.nrows, nrows + 1)
+        # xlrd stores cells column-addressable, so each selected column is read in one call.
+        frame = pd.DataFrame({
+            header[pos]: [None if v == '' else v for v in sheet.col_values(pos, start_rowx=1, end_rowx=end_row)]
+            for pos in positions
+        })
+    finally:
+        book.release_resources()
+    return _drop_trailing_empty_rows(frame)
+
+
+def _column_positions(header: List[str], columns: Optional[Sequence[str]]) -> List[int]:
+    if columns is None:
+        return list(range(len(header)))
+    missing = [col for col in columns if col not in header]
+    if missing:
+        raise ValueError(f"Columns not found in sheet: {', '.join(missing)}")
+    return [header.index(col) for col in columns]
+
+
+def _drop_trailing_empty_rows(frame: pd.DataFrame) -> pd.DataFrame:
+    # Read-only sheets often report formatted but empty rows past the data.
+    non_empty = frame.notna().any(axis=1).to_numpy()
+    if non_empty.all() or len(frame) == 0:
+        return frame
+    last = len(non_empty) - non_empty[::-1].argmax() if non_empty.any() else 0
+    return frame.iloc[:last]
+
+
+def preview_excel(source: FileSource, filename: str, sheet_name: Optional[str] = None,
+                  n_rows: int = PREVIEW_ROWS) -> pd.DataFrame:
+    """First ``n_rows`` rows of a sheet with all columns, for choosing what to load."""
+    return read_excel_columns(source, filename, sheet_name, nrows=n_rows)
@@ -0,0 +1,220 @@
+"""
+Process-level dataset store shared by all Streamlit sessions.
+
+Uploaded datasets are deduplicated by content hash and kept once; sessions get
+shallow copies and keep their derived columns (``apollo_key``, ``bucket_number``,
+``group_name``, ...) as small per-session overlays. Together with pandas
+Copy-on-Write this means five analysts opening the same export share one copy of it.
+
+A global memory quota evicts datasets nobody uses and, if needed, the overlays of
+the least recently active sessions; a per-session quota bounds overlay size.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+MB = 1024 * 1024
+DEFAULT_GLOBAL_QUOTA = int(os.environ.get('AA_STORE_GLOBAL_QUOTA_MB', 4096)) * MB
+DEFAULT_SESSION_QUOTA = int(os.environ.get('AA_STORE_SESSION_QUOTA_MB', 1024)) * MB
+
+
+def content_key(*parts: bytes) -> str:
+    """Content hash identifying an upload together with the options used to parse it."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def _frame_nbytes(frame: pd.DataFrame) -> int:
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def _series_nbytes(series: pd.Series) -> int:
+    return int(series.memory_usage(index=False, deep=True))
+
+
+def _buffer_key(series: pd.Series) -> tuple:
+    # Columns assigned from one another (e.g. 'apollo_key' from the ID column) share their data
+    if isinstance(series.dtype, np.dtype):
+        values = series.to_numpy(copy=False)
+        return values.__array_interface__['data'][0], values.nbytes
+    return id(series.array), None
+
+
+def _overlays_nbytes(overlays: Dict[str, pd.Series]) -> int:
+    """Bytes held by a session's overlays, counting data shared by several of them once."""
+    distinct = {_buffer_key(col): col for col in overlays.values()}
+    return sum(_series_nbytes(col) for col in distinct.values())
+
+
+class _Session:
+    def __init__(self):
+        self.dataset_key = None
+        self.overlays: Dict[str, pd.Series] = {}
+        self.nbytes = 0
+        self.last_access = time.monotonic()
+
+
+class DatasetStore:
+    """Deduplicated, read-only datasets plus per-session column overlays."""
+
+    def __init__(self, global_quota: int = DEFAULT_GLOBAL_QUOTA,
+                 session_quota: int = DEFAULT_SESSION_QUOTA):
+        self.global_quota = global_quota
+        self.session_quota = session_quota
+        self._datasets: 'OrderedDict[str, pd.DataFrame]' = OrderedDict()
+        self._dataset_nbytes: Dict[str, int] = {}
+        self._sessions: Dict[str, _Session] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def usage(self) -> int:
+        """Bytes held by datasets and overlays."""
+        with self._lock:
+            return sum(self._dataset_nbytes.values()) + sum(s.nbytes for s in self._sessions.values())
+
+    def get_or_load(self, key: str, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Shared dataset for ``key``, parsing it only if no session has loaded it yet.
+
+        Args:
+            key (str): Content key of the upload (see ``content_key``)
+            loader (callable): Returns the parsed DataFrame; only called on a miss
+
+        Returns:
+            pd.DataFrame: Shallow copy of the shared dataset; never modify it in place
+        """
+        with self._lock:
+            frame = self._datasets.get(key)
+        if frame is None:
+            # Parse outside the lock so other sessions are not blocked by a slow upload.
+            frame = loader()
+            with self._lock:
+                if key not in self._datasets:
+                    self._datasets[key] = frame
+                    self._dataset_nbytes[key] = _frame_nbytes(frame)
+                    self._evict_unreferenced_over_quota(keep=key)
+                frame = self._datasets.get(key, frame)
+        with self._lock:
+            if key in self._datasets:
+                self._datasets.move_to_end(key)
+        return frame.copy(deep=False)
+
+    def attach(self, session_id: str, key: str, columns: Dict[str, pd.Series]):
+        """
+        Point a session at a loaded dataset with a fresh set of derived columns.
+
+        Raises:
+            KeyError: If the dataset is not (or no longer) in the store
+            MemoryError: If the columns exceed the per-session or global quota
+        """
+        with self._lock:
+            if key not in self._datasets:
+                raise KeyError("Dataset is not loaded")
+            session = self._session(session_id)
+            session.dataset_key = key
+            session.overlays = {}
+            session.nbytes = 0
+        self.set_columns(session_id, columns)
+
+    def set_columns(self, session_id: str, columns: Dict[str, pd.Series]):
+        """
+        Store derived columns for a session without touching the shared dataset.
+
+        Raises:
+            MemoryError: If the session's overlays exceed the per-session quota
+        """
+        with self._lock:
+            session = self._session(session_id)
+            if session.dataset_key not in self._datasets:
+                raise KeyError("Session has no dataset loaded")
+            overlays = dict(session.overlays)
+            overlays.update(columns)
+            nbytes = _overlays_nbytes(overlays)
+            if nbytes > self.session_quota:
+                raise MemoryError(
+                    f"Session data exceeds its quota ({nbytes / MB:.0f} MB > {self.session_quota / MB:.0f} MB)")
+            session.overlays = overlays
+            session.nbytes = nbytes
+            try:
+                self._enforce_global_quota(protect=session_id)
+            except MemoryError:
+                self._sessions.pop(session_id)
+                self._evict_unreferenced_over_quota()
+                raise
+
+    def frame(self, session_id: str) -> Optional[pd.DataFrame]:
+        """
+        The session's view of its dataset: a shallow copy with the overlays applied.
+
+        Returns None if the session has no dataset or it has been evicted.
+        """
+        with self._lock:
+            if session_id not in self._sessions:
+                return None
+            session = self._session(session_id)
+            base = self._datasets.get(session.dataset_key)
+            if base is None:
+                return None
+            self._datasets.move_to_end(session.dataset_key)
+            overlays = session.overlays
+        view = base.copy(deep=False)
+        for name, values in overlays.items():
+            view[name] = values
+        return view
+
+    def release(self, session_id: str):
+        """
+        Drop a session's overlays and its reference to the shared dataset.
+
+        The dataset itself stays loaded until the quota needs its memory: other sessions may
+        have uploaded the same file and not processed it yet.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._evict_unreferenced_over_quota()
+
+    def _session(self, session_id: str) -> _Session:
+        session = self._sessions.setdefault(session_id, _Session())
+        session.last_access = time.monotonic()
+        return session
+
+    def _referenced(self) -> set:
+        return {s.dataset_key for s in self._sessions.values() if s.dataset_key is not None}
+
+    def _evict_unreferenced_over_quota(self, keep: Optional[str] = None):
+        # Uploads nobody has processed yet only displace other idle uploads, never sessions;
+        # the least recently used go first, so a just-loaded upload is the last one dropped.
+        referenced = self._referenced() | {keep}
+        for key in [k for k in self._datasets if k not in referenced]:
+            if self.usage <= self.global_quota:
+                break
+            self._drop_dataset(key)
+
+    def _drop_dataset(self, key: str):
+        del self._datasets[key]
+        del self._dataset_nbytes[key]
+
+    def _enforce_global_quota(self, protect: Optional[str]):
+        while self.usage > self.global_quota:
+            referenced = self._referenced()
+            idle = next((k for k in self._datasets if k not in referenced), None)
+            if idle is not None:
+                self._drop_dataset(idle)
+                continue
+
+            # Every dataset is in use: detach the least recently active other session.
+            others = [(s.last_access, sid) for sid, s in self._sessions.items() if sid != protect]
+            if not others:
+                raise MemoryError(
+                    f"Dataset exceeds the global memory quota ({self.global_quota / MB:.0f} MB)")
+            _, victim = min(others)
+            self._sessions.pop(victim)
@@ -1,39 +1,103 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
 import hashlib
 from typing import Dict, List, Union, Tuple
+from srm import SRM_ALPHA, srm_check
+from hashing import DEFAULT_HASH_BACKEND, get_hash_backend
+from unit_ids import encode_ids
+from winsorization import CapSpec, winsorize_columns
+from rank_test import RankCounts
+from inference import (MISSING_POLICIES, MULTIPLE_COMPARISON_METHODS, adjust_p_values, apply_missing_policy,
+                       confidence_bounds, group_covariance, group_moments, missing_mask, p_values)
+from parallel_tests import MIN_PARALLEL_CELLS, metric_columns
+from randomization import (DEFAULT_PERMUTATIONS, group_buckets, metric_bucket_totals,
+                           randomization_test, treated_and_control_buckets)
+
+TEST_METHODS = ('asymptotic', 'randomization')
+METRIC_TYPES = ('mean', 'ratio', 'proportion', 'rank')
 
 class ExperimentAnalysis:
     def __init__(self):
         self.alpha = 0.05  # Default significance level
     
     @staticmethod
-    def apollo_bucket(experiment_name: str, individual_id: Union[str, List[str], int, float]) -> Union[int, Tuple[List[int], List]]:
+    def _single_apollo_bucket(exp_name: str, ind_id: Union[str, int, float],
+                              hash_backend: str = DEFAULT_HASH_BACKEND) -> int:
+        """Bucket (0-99) of a single individual ID."""
+        if isinstance(ind_id, (float, int)):
+            ind_id = '{:.0f}'.format(ind_id)
+        else:
+            ind_id = str(ind_id)
+        if hash_backend != DEFAULT_HASH_BACKEND:
+            return int(get_hash_backend(hash_backend).buckets(exp_name, [bytes(ind_id, encoding='UTF-8')])[0])
+        sha1 = hashlib.sha1()
+        raw_key = ind_id + exp_name + 'exp_bucket'
+        sha1.update(bytes(raw_key, encoding='UTF-8'))
+        sha1_int = int.from_bytes(sha1.digest()[-4:], byteorder='big')
+        return sha1_int % 100
+
+    @staticmethod
+    def _encode_ids(individual_ids: Union[pd.Series, np.ndarray, List]) -> np.ndarray:
+        """Format individual IDs the same way ``_single_apollo_bucket`` does, missing ones included, as UTF-8 bytes."""
+        return encode_ids(individual_ids, na_rep=None)
+
+    @staticmethod
+    def _hash_buckets(experiment_name: str, encoded_ids: List[bytes],
+                      hash_backend: str = DEFAULT_HASH_BACKEND) -> np.ndarray:
+        """Buckets for IDs that are already formatted and UTF-8 encoded."""
+        return get_hash_backend(hash_backend).buckets(experiment_name, encoded_ids)
+
+    @staticmethod
+    def bucket_array(experiment_name: str, individual_ids: Union[pd.Series, np.ndarray, List],
+                     hash_backend: str = DEFAULT_HASH_BACKEND) -> np.ndarray:
+        """
+        Bucket numbers for many IDs at once, identical to calling ``apollo_bucket`` per ID.
+        
+        Args:
+            experiment_name (str): Name of the experiment for consistent bucketing
+            individual_ids (pd.Series/np.ndarray/list): Individual identifiers to be bucketed
+            hash_backend (str): Hashing backend ('sha1', 'blake2b' or 'siphash64')
+        
+        Returns:
+            np.ndarray: uint8 bucket numbers (0-99) in input order
+        """
+        encoded = ExperimentAnalysis._encode_ids(individual_ids).tolist()
+        return ExperimentAnalysis._hash_buckets(experiment_name, encoded, hash_backend)
+
+    @staticmethod
+    def apollo_bucket(experiment_name: str, individual_id: Union[str, List[str], int, float],
+                      hash_backend: str = DEFAULT_HASH_BACKEND) -> Union[int, Tuple[List[int], List]]:
         """
         Generate consistent bucket numbers (0-99) for experimental units.
         
         Args:
             experiment_name (str): Name of the experiment for consistent bucketing
             individual_id (str/list/int/float): Individual identifier(s) to be bucketed
+            hash_backend (str): Hashing backend; the default 'sha1' is the legacy scheme
         
         Returns:
             Union[int, Tuple[List[int], List]]: Bucket number(s) for the individual(s)
         """
-        def _single_apollo_bucket(exp_name: str, ind_id: Union[str, int, float]) -> int:
-            sha1 = hashlib.sha1()
-            if isinstance(ind_id, (float, int)):
-                ind_id = '{:.0f}'.format(ind_id)
-            else:
-                ind_id = str(ind_id)
-            raw_key = ind_id + exp_name + 'exp_bucket'
-            sha1.update(bytes(raw_key, encoding='UTF-8'))
-            sha1_int = int.from_bytes(sha1.digest()[-4:], byteorder='big')
-            return sha1_int % 100
+        _single_apollo_bucket = ExperimentAnalysis._single_apollo_bucket
 
         if isinstance(individual_id, list):
-            return [_single_apollo_bucket(experiment_name, x) for x in individual_id], individual_id
-        return _single_apollo_bucket(experiment_name, individual_id)
+            return [_single_apollo_bucket(experiment_name, x, hash_backend) for x in individual_id], individual_id
+        return _single_apollo_bucket(experiment_name, individual_id, hash_backend)
+
+    @staticmethod
+    def _extract_percentage(input_value: Union[str, float, int]) -> int:
+        """Convert a proportion given as '50%', '0.5', 0.5 or 50 to an integer percentage."""
+        if isinstance(input_value, str):
+            if input_value.endswith('%'):
+                return int(input_value[:-1])
+            try:
+                float_value = float(input_value)
+                return int(float_value * 100) if 0 <= float_value <= 1 else int(float_value)
+            except ValueError:
+                raise ValueError(f"Invalid input string: {input_value}")
+        elif isinstance(input_value, (float, int)):
+            return int(input_value * 100) if 0 <= input_value <= 1 else int(input_value)
+        raise ValueError("Input must be a string, integer, or float.")
 
     @staticmethod
     def assign_groups(bucket_number: int, group_proportions: Dict[str, Union[str, float, int]]) -> str:
@@ -47,18 +111,7 @@ class ExperimentAnalysis:
         Returns:
             str: Assigned group name
         """
-        def extract_percentage(input_value: Union[str, float, int]) -> int:
-            if isinstance(input_value, str):
-                if input_value.endswith('%'):
-                    return int(input_value[:-1])
-                try:
-                    float_value = float(input_value)
-                    return int(float_value * 100) if 0 <= float_value <= 1 else int(float_value)
-                except ValueError:
-                    raise ValueError(f"Invalid input string: {input_value}")
-            elif isinstance(input_value, (float, int)):
-                return int(input_value * 100) if 0 <= input_value <= 1 else int(input_value)
-            raise ValueError("Input must be a string, integer, or float.")
+        extract_percentage = ExperimentAnalysis._extract_percentage
 
         total_percentage = sum(extract_percentage(val) for val in group_proportions.values())
         if total_percentage != 100:
@@ -72,189 +125,536 @@ class ExperimentAnalysis:
             start_bucket += prop
         return list(group_proportions.keys())[-1]  # Return last group if no match found
 
-    def _get_confidence_interval(self, point_estimate: float, std_error: float, 
-                               is_two_sided: bool = True, alternative: str = 'two-sided') -> List[float]:
-        """Calculate confidence interval based on test type."""
-        if is_two_sided:
-            z_value = stats.norm.ppf(1 - self.alpha/2)
-            margin = z_value * std_error
-            return [
-                round(point_estimate - margin, 6),
-                round(point_estimate + margin, 6)
-            ]
-        else:
-            z_value = stats.norm.ppf(1 - self.alpha)
-            if alternative == 'less':
-                return [float('-inf'), round(point_estimate + z_value * std_error, 6)]
-            else:  # alternative == 'greater'
-                return [round(point_estimate - z_value * std_error, 6), float('inf')]
-
-    def test_mean(self, data: pd.DataFrame, groupname: str, treated_label: str, 
-                  control_label: str, test_metric: str, is_two_sided: bool = True, 
-                  alternative: str = 'two-sided') -> List:
-        """Conduct t-test for mean metrics."""
-        treated = data[data[groupname] == treated_label][test_metric]
-        control = data[data[groupname] == control_label][test_metric]
-        
-        treated_mean = treated.mean()
-        control_mean = control.mean()
-        
-        mae = treated_mean - control_mean
-        mape = treated_mean / control_mean - 1
-        
-        t_stats, pval = stats.ttest_ind(treated, control, equal_var=False)
+    @staticmethod
+    def compile_allocation(group_proportions: Dict[str, Union[str, float, int]]) -> Tuple[List[str], np.ndarray]:
+        """
+        Compile group proportions into a bucket-to-group lookup table.
         
-        std_error = np.sqrt(
-            np.var(treated, ddof=1) / len(treated) +
-            np.var(control, ddof=1) / len(control)
-        )
+        The table reproduces ``assign_groups`` for every bucket, so assigning many units
+        becomes a single array lookup instead of one proportion walk per unit.
         
-        ci = self._get_confidence_interval(mae, std_error, is_two_sided, alternative)
+        Args:
+            group_proportions (dict): Dictionary of group names and their proportions
         
-        p_value = pval if is_two_sided else (
-            pval / 2 if (t_stats < 0 and alternative == 'less') or 
-            (t_stats > 0 and alternative == 'greater') else 1 - pval / 2
+        Returns:
+            Tuple[List[str], np.ndarray]: Group names and an array of 100 group indices
+        """
+        groups = list(group_proportions.keys())
+        group_index = {group: i for i, group in enumerate(groups)}
+        bucket_to_group = np.array(
+            [group_index[ExperimentAnalysis.assign_groups(bucket, group_proportions)]
+             for bucket in range(100)],
+            dtype=np.uint8
         )
+        return groups, bucket_to_group
+
+    def check_srm(self, data: pd.DataFrame, groupname: str,
+                  group_proportions: Dict[str, Union[str, float, int]],
+                  by: Union[str, List[str], None] = None,
+                  alpha: float = SRM_ALPHA) -> pd.DataFrame:
+        """
+        Check for sample ratio mismatch against the configured group proportions.
         
-        sig = "显著" if p_value < self.alpha else "不显著"
-        
-        return [treated_mean, control_mean, mae, mape, t_stats, p_value, ci, sig]
-
-    def _get_ratio_variance(self, x: np.ndarray, y: np.ndarray) -> float:
-        """Calculate variance for ratio metrics."""
-        x_var = np.var(x, ddof=1)/len(x)
-        y_var = np.var(y, ddof=1)/len(y)
-        x_mean, y_mean = np.mean(x), np.mean(y)
-        cov = np.cov(x, y)[0,1]/len(x)
+        Args:
+            data (pd.DataFrame): Input dataset
+            groupname (str): Column name containing group labels
+            group_proportions (dict): Dictionary of group names and their proportions
+            by (str or List[str], optional): Segment column(s), one check per segment
+            alpha (float): Significance level for flagging a mismatch
         
-        return (1/pow(y_mean,2)*x_var + 
-                pow(x_mean,2)/pow(y_mean,4)*y_var - 
-                2*x_mean/pow(y_mean,3)*cov)
+        Returns:
+            pd.DataFrame: Observed counts, chi-square statistic, p-value and SRM flag per check
+        """
+        proportions = {group: self._extract_percentage(prop)
+                       for group, prop in group_proportions.items()}
+        return srm_check(data, groupname, proportions, by=by, alpha=alpha)
+
+    def _single_test(self, data: pd.DataFrame, groupname: str, treated_label: str, control_label: str,
+                     metric: str, metric_type: str, is_two_sided: bool, alternative: str,
+                     rank_counts: RankCounts = None) -> List:
+        """One comparison as [treated, control, diff, relative diff, statistic, p-value, CI, significance]."""
+        row = self._test_grid(
+            data, [metric], [metric_type], groupname, [treated_label], control_label,
+            'two-sided' if is_two_sided else alternative,
+            rank_counts={metric: rank_counts} if rank_counts is not None else None
+        ).iloc[0]
+        sig = "显著" if row['P_Value'] < self.alpha else "不显著"
+        return [row['Treatment_Value'], row['Control_Value'], row['Absolute_Diff'], row['Relative_Diff'],
+                row['T_Statistic'], row['P_Value'], [round(row['CI_Lower'], 6), round(row['CI_Upper'], 6)], sig]
+
+    def test_mean(self, data: pd.DataFrame, groupname: str, treated_label: str, 
+                  control_label: str, test_metric: str, is_two_sided: bool = True, 
+                  alternative: str = 'two-sided') -> List:
+        """Conduct t-test for mean metrics."""
+        return self._single_test(data, groupname, treated_label, control_label, test_metric, 'mean',
+                                 is_two_sided, alternative)
 
     def test_ratio(self, data: pd.DataFrame, groupname: str, treated_label: str,
                    control_label: str, x_var: str, y_var: str, is_two_sided: bool = True,
                    alternative: str = 'two-sided') -> List:
         """Conduct statistical test for ratio metrics."""
-        treated_data = data[data[groupname] == treated_label]
-        control_data = data[data[groupname] == control_label]
-        
-        x_treated, y_treated = treated_data[x_var], treated_data[y_var]
-        x_control, y_control = control_data[x_var], control_data[y_var]
-        
-        treated_ratio = np.sum(x_treated) / np.sum(y_treated)
-        control_ratio = np.sum(x_control) / np.sum(y_control)
-        
-        diff = treated_ratio - control_ratio
-        relative_diff = diff / control_ratio
-        
-        std_error = np.sqrt(
-            self._get_ratio_variance(x_treated, y_treated) +
-            self._get_ratio_variance(x_control, y_control)
-        )
-        
-        t_stat = diff / std_error
-        ci = self._get_confidence_interval(diff, std_error, is_two_sided, alternative)
-        
-        if is_two_sided:
-            p_value = 2 * (1 - stats.norm.cdf(abs(t_stat)))
-        else:
-            p_value = (stats.norm.cdf(t_stat) if alternative == 'less' 
-                      else 1 - stats.norm.cdf(t_stat))
-        
-        sig = "显著" if p_value < self.alpha else "不显著"
-        
-        return [treated_ratio, control_ratio, diff, relative_diff, t_stat, p_value, ci, sig]
+        return self._single_test(data, groupname, treated_label, control_label, f"{x_var}/{y_var}", 'ratio',
+                                 is_two_sided, alternative)
 
     def test_proportion(self, data: pd.DataFrame, groupname: str, treated_label: str,
                        control_label: str, metric: str, is_two_sided: bool = True,
                        alternative: str = 'two-sided') -> List:
         """Conduct binomial test for proportion metrics."""
-        treated = data[data[groupname] == treated_label][metric]
-        control = data[data[groupname] == control_label][metric]
-        
-        treated_rate = treated.mean()
-        control_rate = control.mean()
-        
-        diff = treated_rate - control_rate
-        relative_diff = diff / control_rate
-        
-        std_error = np.sqrt(
-            treated_rate*(1-treated_rate)/len(treated) +
-            control_rate*(1-control_rate)/len(control)
-        )
-        
-        t_stat = diff / std_error
-        ci = self._get_confidence_interval(diff, std_error, is_two_sided, alternative)
-        
-        if is_two_sided:
-            p_value = 2 * (1 - stats.norm.cdf(abs(t_stat)))
-        else:
-            p_value = (stats.norm.cdf(t_stat) if alternative == 'less'
-                      else 1 - stats.norm.cdf(t_stat))
-        
-        sig = "显著" if p_value < self.alpha else "不显著"
+        return self._single_test(data, groupname, treated_label, control_label, metric, 'proportion',
+                                 is_two_sided, alternative)
+
+    def test_rank(self, data: pd.DataFrame, groupname: str, treated_label: str,
+                  control_label: str, metric: str, is_two_sided: bool = True,
+                  alternative: str = 'two-sided', rank_counts: RankCounts = None) -> List:
+        """
+        Conduct Mann-Whitney U test (tie-corrected) for skewed metrics.
         
-        return [treated_rate, control_rate, diff, relative_diff, t_stat, p_value, ci, sig]
+        Treatment and control values are medians. The confidence interval is not defined
+        for this test and is reported as NaN. Pass ``rank_counts`` built once with
+        ``RankCounts.from_values`` (or from a ``RankHistogram`` for out-of-core data) to share
+        the sorted values between comparisons.
+        """
+        return self._single_test(data, groupname, treated_label, control_label, metric, 'rank',
+                                 is_two_sided, alternative, rank_counts)
+
+    @staticmethod
+    def _compare_metric(columns: List[np.ndarray], codes: np.ndarray, n_groups: int, treated: np.ndarray,
+                        control: int, metric_type: str) -> Dict[str, np.ndarray]:
+        """
+        Estimates of one mean, ratio or proportion metric for all treatment groups at once.
+
+        ``columns`` are the metric's float columns with NaN on the rows to leave out
+        (``inference.apply_missing_policy``); ``treated`` holds the group codes of the treatment
+        groups and ``control`` the code of the control group. 'DF' is NaN where the statistic
+        is compared with the normal distribution.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if metric_type == 'ratio':
+                x_values, y_values = columns
+                x, y = group_moments(x_values, codes, n_groups), group_moments(y_values, codes, n_groups)
+                cov = group_covariance(x_values, y_values, codes, n_groups, x['mean'], y['mean'])
+                count = x['count']
+                values = x['sum'] / y['sum']
+                # Delta-method variance of the ratio of means
+                variances = (x['var'] / count / y['mean'] ** 2
+                             + x['mean'] ** 2 / y['mean'] ** 4 * y['var'] / count
+                             - 2 * x['mean'] / y['mean'] ** 3 * cov / count)
+            else:
+                moments = group_moments(columns[0], codes, n_groups)
+                count = moments['count']
+                values = moments['mean']
+                if metric_type == 'mean':
+                    variances = moments['var'] / count
+                else:  # proportion
+                    variances = values * (1 - values) / count
+
+            treated_value, control_value = values[treated], np.full(len(treated), values[control])
+            diff = treated_value - control_value
+            std_error = np.sqrt(variances[treated] + variances[control])
+            statistic = diff / std_error
+            df = np.full(len(treated), np.nan)
+            if metric_type == 'mean':
+                relative_diff = treated_value / control_value - 1
+                # Welch-Satterthwaite degrees of freedom
+                treated_var, control_var = variances[treated], variances[control]
+                df = (treated_var + control_var) ** 2 / (
+                    treated_var ** 2 / (count[treated] - 1) + control_var ** 2 / (count[control] - 1))
+            else:
+                relative_diff = diff / control_value
+        return {'Treatment_Value': treated_value, 'Control_Value': control_value,
+                'Treatment_N': count[treated], 'Control_N': np.full(len(treated), count[control]),
+                'Absolute_Diff': diff, 'Relative_Diff': relative_diff, 'Std_Error': std_error,
+                'T_Statistic': statistic, 'DF': df, 'P_Value': np.full(len(treated), np.nan)}
+
+    @staticmethod
+    def _stratum_codes(data: pd.DataFrame, stratify_by: List[str]) -> Tuple[np.ndarray, int]:
+        """Stratum code of each row (missing values form their own stratum) and the number of strata."""
+        missing = [col for col in stratify_by if col not in data.columns]
+        if missing:
+            raise ValueError(f"Stratification column(s) not found: {', '.join(missing)}")
+        codes = data.groupby(stratify_by, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+        return codes, int(codes.max()) + 1 if len(codes) else 0
+
+    @staticmethod
+    def _compare_stratified(columns: List[np.ndarray], codes: np.ndarray, n_groups: int, treated: np.ndarray,
+                            control: int, metric_type: str, strata: Tuple[np.ndarray, int]) -> Dict[str, np.ndarray]:
+        """
+        Post-stratified estimates of one mean, ratio or proportion metric for all treatment groups.
+
+        Moments are computed per group x stratum cell in one pass; everything after that works on
+        the (groups x strata) table. Each group's estimate is the mean of its stratum means,
+        weighted by the share of each stratum among all valid units, and its variance is the
+        sum of the squared weights times the within-stratum variances. A stratum enters a
+        comparison only when both groups have at least 2 valid units in it; the weights are
+        renormalized over the strata that do. A comparison without any such stratum (strata too
+        fine for the data) has NaN estimates and 0 units.
+        """
+        stratum_codes, n_strata = strata
+        cell_codes = np.where(codes >= 0, codes * n_strata + stratum_codes, -1)
+        n_cells = n_groups * n_strata
+
+        def table(values):
+            return values.reshape(n_groups, n_strata)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if metric_type == 'ratio':
+                x_values, y_values = columns
+                x = group_moments(x_values, cell_codes, n_cells)
+                y = group_moments(y_values, cell_codes, n_cells)
+                cov = group_covariance(x_values, y_values, cell_codes, n_cells, x['mean'], y['mean'])
+                count = table(x['count'])
+                cells = {'x': table(x['mean']), 'y': table(y['mean']), 'var_x': table(x['var']) / count,
+                         'var_y': table(y['var']) / count, 'cov': table(cov) / count}
+            else:
+                moments = group_moments(columns[0], cell_codes, n_cells)
+                count = table(moments['count'])
+                mean = table(moments['mean'])
+                variance = table(moments['var']) if metric_type == 'mean' else mean * (1 - mean)
+                cells = {'x': mean, 'var_x': variance / count}
+
+            usable = (count[treated] >= 2) & (count[control] >= 2)
+            estimable = usable.any(axis=1)
+            weights = np.where(usable, count.sum(axis=0), 0.0)
+            weights = weights / weights.sum(axis=1, keepdims=True)
+
+            def combine(cell, squared=False):
+                # Weighted sum over the usable strata, for the treatment groups and for the control
+                w = weights ** 2 if squared else weights
+                return (np.where(usable, w * cell[treated], 0).sum(axis=1),
+                        np.where(usable, w * cell[control], 0).sum(axis=1))
+
+            (treated_x, control_x), (treated_var_x, control_var_x) = combine(cells['x']), combine(cells['var_x'], True)
+            if metric_type == 'ratio':
+                (treated_y, control_y), (treated_var_y, control_var_y) = (combine(cells['y']),
+                                                                          combine(cells['var_y'], True))
+                treated_cov, control_cov = combine(cells['cov'], True)
+                treated_value, control_value = treated_x / treated_y, control_x / control_y
+                treated_var = (treated_var_x / treated_y ** 2 + treated_x ** 2 / treated_y ** 4 * treated_var_y
+                               - 2 * treated_x / treated_y ** 3 * treated_cov)
+                control_var = (control_var_x / control_y ** 2 + control_x ** 2 / control_y ** 4 * control_var_y
+                               - 2 * control_x / control_y ** 3 * control_cov)
+            else:
+                treated_value, control_value = treated_x, control_x
+                treated_var, control_var = treated_var_x, control_var_x
+
+            diff = treated_value - control_value
+            std_error = np.sqrt(treated_var + control_var)
+            statistic = diff / std_error
+            df = np.full(len(treated), np.nan)
+            if metric_type == 'mean':
+                relative_diff = treated_value / control_value - 1
+                # Welch-Satterthwaite degrees of freedom over all cells of the two groups
+                treated_cells = weights ** 2 * cells['var_x'][treated]
+                control_cells = weights ** 2 * cells['var_x'][control]
+                df = (treated_var + control_var) ** 2 / (
+                    np.where(usable, treated_cells ** 2 / (count[treated] - 1), 0).sum(axis=1)
+                    + np.where(usable, control_cells ** 2 / (count[control] - 1), 0).sum(axis=1))
+            else:
+                relative_diff = diff / control_value
+            # Masked sums over no stratum at all are 0, not estimates
+            treated_value, control_value, diff, relative_diff, std_error, statistic = (
+                np.where(estimable, value, np.nan)
+                for value in (treated_value, control_value, diff, relative_diff, std_error, statistic))
+        return {'Treatment_Value': treated_value, 'Control_Value': control_value,
+                'Treatment_N': np.where(usable, count[treated], 0).sum(axis=1),
+                'Control_N': np.where(usable, count[control], 0).sum(axis=1),
+                'Absolute_Diff': diff, 'Relative_Diff': relative_diff, 'Std_Error': std_error,
+                'T_Statistic': statistic, 'DF': df, 'P_Value': np.full(len(treated), np.nan)}
+
+    @staticmethod
+    def _compare_rank(rank_counts: RankCounts, treated_labels: List, control_label,
+                      alternative: str) -> Dict[str, np.ndarray]:
+        """Mann-Whitney U tests of a rank metric; P_Value is exact here rather than from the statistic."""
+        def valid_count(label):
+            return rank_counts.groups[label][1].sum() if label in rank_counts.groups else 0
+
+        control_median = rank_counts.median(control_label)
+        rows = []
+        for treated_label in treated_labels:
+            _, z_stat, p_value, _ = rank_counts.mann_whitney(treated_label, control_label, alternative)
+            treated_median = rank_counts.median(treated_label)
+            diff = treated_median - control_median
+            relative_diff = diff / control_median if control_median != 0 else np.nan
+            rows.append((treated_median, control_median, valid_count(treated_label), valid_count(control_label),
+                         diff, relative_diff, z_stat, p_value))
+        values = np.array(rows, dtype=np.float64).reshape(len(treated_labels), 8).T
+        nan = np.full(len(treated_labels), np.nan)
+        return {'Treatment_Value': values[0], 'Control_Value': values[1], 'Treatment_N': values[2],
+                'Control_N': values[3], 'Absolute_Diff': values[4], 'Relative_Diff': values[5],
+                'Std_Error': nan, 'T_Statistic': values[6], 'DF': nan, 'P_Value': values[7]}
+
+    @staticmethod
+    def _cap_metrics(data: pd.DataFrame, metrics: List[str], metric_types: List[str],
+                     capping: Dict[str, CapSpec]) -> Tuple[Dict[str, pd.DataFrame], Dict[str, Tuple]]:
+        """Winsorized dataset per capped metric, and its (lower, upper, capped rows)."""
+        types = dict(zip(metrics, metric_types))
+        metric_data, cap_summary = {}, {}
+        for metric, spec in capping.items():
+            if metric not in types:
+                raise ValueError(f"Capping given for unknown metric: {metric}")
+            if types[metric] in ('proportion', 'rank'):
+                raise ValueError(f"Capping is not supported for {types[metric]} metric: {metric}")
+            column = metric.split('/')[0] if types[metric] == 'ratio' else metric
+            metric_data[metric], summary = winsorize_columns(data, {column: spec})
+            lower, upper, n_capped = summary.loc[column, ['Lower', 'Upper', 'Capped_Rows']]
+            cap_summary[metric] = (lower, upper, int(n_capped))
+        return metric_data, cap_summary
+
+    def _test_grid(self, data: pd.DataFrame, metrics: List[str], metric_types: List[str], groupname: str,
+                   treated_labels: List, control_label, alternative: str = 'two-sided',
+                   capping: Dict[str, CapSpec] = None, method: str = 'asymptotic',
+                   bucket_col: str = 'bucket_number', n_permutations: int = DEFAULT_PERMUTATIONS,
+                   random_state: int = 0, rank_counts: Dict[str, RankCounts] = None,
+                   missing: str = 'exclude', drop_unit_columns: List[str] = None,
+                   stratify_by: Union[str, List[str]] = None) -> pd.DataFrame:
+        """
+        Unrounded estimates, p-values and confidence bounds of every treatment x metric comparison.
+
+        Rows are ordered by treatment group, then metric. Per-group moments are computed once
+        per metric for all groups; p-values and bounds are computed for the whole grid at once.
+        Multiple-comparison adjustment and significance are left to the caller, which may
+        combine several grids first (``parallel_tests``). Under ``missing='drop_unit'``, units
+        with a NaN in any of ``drop_unit_columns`` (default: every column the metrics read)
+        are left out. With ``stratify_by``, mean, ratio and proportion metrics are post-stratified.
+        """
+        unknown_types = sorted(set(metric_types) - set(METRIC_TYPES))
+        if unknown_types:
+            raise ValueError(f"Unsupported metric type: {unknown_types[0]}")
+        codes, groups = pd.factorize(data[groupname])
+        group_codes = {group: code for code, group in enumerate(groups)}
+        for label in list(treated_labels) + [control_label]:
+            if label not in group_codes:
+                raise ValueError(f"Group not found in data: {label}")
+        treated = np.array([group_codes[label] for label in treated_labels], dtype=np.int64)
+        control = group_codes[control_label]
+
+        metric_data, cap_summary = self._cap_metrics(data, metrics, metric_types, capping or {})
+        rank_counts = dict(rank_counts or {})
+        strata = None
+        if stratify_by is not None:
+            strata = self._stratum_codes(data, [stratify_by] if isinstance(stratify_by, str) else list(stratify_by))
+
+        def float_column(frame, name):
+            return frame[name].to_numpy(dtype=np.float64, na_value=np.nan)
+
+        dropped = None
+        if missing == 'drop_unit':
+            # One validity mask over all analysed columns, shared by every metric
+            dropped = missing_mask([float_column(data, name)
+                                    for name in drop_unit_columns or metric_columns(metrics, metric_types)])
+
+        metric_columns_by_metric, blocks = {}, []
+        for metric, metric_type in zip(metrics, metric_types):
+            frame = metric_data.get(metric, data)
+            columns = apply_missing_policy(
+                [float_column(frame, name) for name in (metric.split('/') if metric_type == 'ratio' else [metric])],
+                missing, dropped)
+            metric_columns_by_metric[metric] = columns
+            if metric_type == 'rank':
+                if metric not in rank_counts:
+                    # Values sorted per group once per rank metric, shared by every treatment comparison
+                    rank_counts[metric] = RankCounts.from_values(columns[0], data[groupname])
+                blocks.append(self._compare_rank(rank_counts[metric], treated_labels, control_label, alternative))
+            elif strata is not None:
+                blocks.append(self._compare_stratified(columns, codes, len(groups), treated, control, metric_type,
+                                                       strata))
+            else:
+                blocks.append(self._compare_metric(columns, codes, len(groups), treated, control, metric_type))
+
+        # (treatment, metric) grid flattened treatment-major
+        columns = {name: np.stack([block[name] for block in blocks], axis=1).ravel() for name in blocks[0]}
+        grid = pd.DataFrame({
+            'Treatment_Group': np.repeat(np.array(treated_labels, dtype=object), len(metrics)),
+            'Metric': np.tile(np.array(metrics, dtype=object), len(treated_labels)),
+            **columns,
+        })
+
+        exact = np.tile(np.array(metric_types) == 'rank', len(treated_labels))
+        p_value = p_values(grid['T_Statistic'].to_numpy(), alternative, grid['DF'].to_numpy())
+        grid['P_Value'] = np.where(exact, grid['P_Value'].to_numpy(), p_value)
+        lower, upper = confidence_bounds(grid['Absolute_Diff'].to_numpy(), grid['Std_Error'].to_numpy(),
+                                         self.alpha, alternative)
+        # Rank tests have no confidence interval, not even the open side of a one-sided one
+        grid['CI_Lower'], grid['CI_Upper'] = np.where(exact, np.nan, lower), np.where(exact, np.nan, upper)
+
+        if method == 'randomization':
+            # Buckets per group and per-bucket metric totals are computed once for all comparisons
+            buckets_by_group = group_buckets(data[bucket_col], data[groupname])
+            buckets = data[bucket_col].to_numpy()
+            totals = {}
+            for metric, metric_type in zip(metrics, metric_types):
+                if metric_type == 'rank':
+                    # Rank metrics keep their Mann-Whitney p-value
+                    continue
+                names = metric.split('/') if metric_type == 'ratio' else [metric]
+                frame = pd.DataFrame(dict(zip(names, metric_columns_by_metric[metric]), **{bucket_col: buckets}))
+                totals[metric] = metric_bucket_totals(frame, bucket_col, metric, metric_type)
+            permuted = []
+            for treated_label in treated_labels:
+                treated_buckets, control_buckets = treated_and_control_buckets(
+                    buckets_by_group, treated_label, control_label)
+                for metric in metrics:
+                    if metric not in totals:
+                        permuted.append((np.nan, 0))
+                        continue
+                    _, p, n_evaluated = randomization_test(*totals[metric], treated_buckets, control_buckets,
+                                                           alternative, n_permutations, random_state)
+                    permuted.append((p, n_evaluated))
+            grid['P_Value'] = np.where(exact, grid['P_Value'].to_numpy(), [p for p, _ in permuted])
+            grid['Permutations'] = [n for _, n in permuted]
+
+        cap = [cap_summary.get(metric, (np.nan, np.nan, 0)) for metric in metrics]
+        for i, name in enumerate(['Cap_Lower', 'Cap_Upper', 'Capped_Rows']):
+            grid[name] = np.tile(np.array([c[i] for c in cap]), len(treated_labels))
+        grid['Capped_Rows'] = grid['Capped_Rows'].astype(np.int64)
+        grid['Treatment_N'] = grid['Treatment_N'].astype(np.int64)
+        grid['Control_N'] = grid['Control_N'].astype(np.int64)
+        return grid.drop(columns='DF')
+
+    def _finalize_results(self, grid: pd.DataFrame, correction: str = None, capping: bool = False) -> pd.DataFrame:
+        """Multiple-comparison adjustment, significance and rounding of a ``_test_grid`` output."""
+        results_df = grid if capping else grid.drop(columns=['Cap_Lower', 'Cap_Upper', 'Capped_Rows'])
+        p_value = results_df['P_Value'].to_numpy()
+        if correction is not None:
+            # One family across all metrics and treatment groups
+            p_value = adjust_p_values(p_value, correction)
+            results_df.insert(results_df.columns.get_loc('P_Value') + 1, 'P_Value_Adjusted', p_value)
+        # Comparisons without a p-value (e.g. no valid units) are not "not significant"
+        results_df.insert(results_df.columns.get_loc('CI_Upper') + 1, 'Significance',
+                          np.select([p_value < self.alpha, np.isnan(p_value)], ["显著", "无法检验"], "不显著"))
+        float_columns = [col for col in results_df.columns
+                         if col not in ('Treatment_Group', 'Metric', 'Treatment_N', 'Control_N', 'Significance',
+                                        'Permutations', 'Capped_Rows')]
+        results_df[float_columns] = results_df[float_columns].round(6)
+        return results_df
 
     def run_statistical_tests(self, data: pd.DataFrame, metrics: List[str], 
                             metric_types: List[str], groupname: str,
                             treated_labels: Union[str, List[str]], control_label: str,
                             is_two_sided: bool = True,
-                            alternative: str = 'two-sided') -> pd.DataFrame:
+                            alternative: str = 'two-sided',
+                            group_proportions: Dict[str, Union[str, float, int]] = None,
+                            srm_action: str = 'annotate',
+                            capping: Dict[str, CapSpec] = None,
+                            method: str = 'asymptotic',
+                            bucket_col: str = 'bucket_number',
+                            n_permutations: int = DEFAULT_PERMUTATIONS,
+                            random_state: int = 0,
+                            n_jobs: int = 1,
+                            correction: str = None,
+                            missing: str = 'exclude',
+                            stratify_by: Union[str, List[str]] = None) -> pd.DataFrame:
         """
         Run statistical tests for multiple metrics and multiple treatment groups.
         
+        All comparisons are computed column-wise: one pass over each metric column gives the
+        moments of every group, and p-values and confidence bounds of the whole treatment x
+        metric grid come from single vectorized calls (``inference``).
+        
         Args:
             data (pd.DataFrame): Input dataset
             metrics (List[str]): List of metrics to test
-            metric_types (List[str]): List of metric types ('mean', 'ratio', or 'proportion')
+            metric_types (List[str]): List of metric types ('mean', 'ratio', 'proportion', or
+                'rank' for a Mann-Whitney U test; ranks are computed once per metric and shared
+                by all treatment groups)
             groupname (str): Column name containing group labels
             treated_labels (str or List[str]): Label(s) for treatment group(s)
             control_label (str): Label for control group
             is_two_sided (bool): Whether to perform two-sided test
             alternative (str): 'two-sided', 'less', or 'greater'
+            group_proportions (dict, optional): Configured group proportions; when given, a
+                sample ratio mismatch check is run before the tests
+            srm_action (str): 'annotate' adds SRM columns to the results, 'block' raises
+                a ValueError when a mismatch is detected
+            capping (dict, optional): Metric -> upper cap quantile (e.g. 0.999) or a
+                (lower, upper) pair of quantiles. The metric is winsorized over all groups
+                at thresholds from a streaming quantile sketch; ratio metrics are capped on
+                their numerator. Adds 'Cap_Lower', 'Cap_Upper' and 'Capped_Rows' columns to
+                the results (NaN bounds and 0 rows for uncapped metrics)
+            method (str): 'asymptotic' uses the t-test / normal approximation; 'randomization'
+                takes P_Value and Significance from a bucket-level randomization test
+                (``randomization.randomization_test``) and adds a 'Permutations' column.
+                Confidence intervals stay normal approximations; rank metrics keep their
+                Mann-Whitney p-value (0 permutations)
+            bucket_col (str): Column with apollo_bucket numbers, used by 'randomization'
+            n_permutations (int): Random bucket re-assignments per comparison
+            random_state (int): Seed of the bucket re-assignments
+            n_jobs (int): Worker processes; above 1 the metrics are split over processes that
+                share the metric columns through shared memory (``parallel_tests``), unless
+                there are fewer than ``MIN_PARALLEL_CELLS`` rows x metrics
+            correction (str, optional): Multiple-comparison adjustment over all metrics and
+                treatment groups together: 'bonferroni', 'holm' or 'bh' (Benjamini-Hochberg).
+                Adds a 'P_Value_Adjusted' column, on which Significance is then based
+            missing (str): Handling of missing metric values: 'exclude' leaves a unit out of
+                that metric only (out of both sides of a ratio metric when either is missing),
+                'zero' counts missing values as 0, 'drop_unit' leaves units with a missing value
+                in any analysed column out of every metric. Valid units per group are reported
+                in 'Treatment_N' and 'Control_N'
+            stratify_by (str or List[str], optional): Categorical pre-period column(s) to
+                post-stratify on. Mean, ratio and proportion metrics are then estimated as
+                stratum means weighted by the stratum shares of all units, which removes the
+                between-stratum variance; rank metrics are not stratified. Missing values of
+                these columns form a stratum of their own. Not supported with
+                method='randomization'
         
         Returns:
-            pd.DataFrame: Statistical test results
+            pd.DataFrame: One row per treatment group and metric with estimates, valid units per
+                group, 'Std_Error',
+                'T_Statistic', 'P_Value', the confidence bounds 'CI_Lower' and 'CI_Upper'
+                (-inf/inf on the open side of one-sided tests) and 'Significance'
         """
+        if srm_action not in ('annotate', 'block'):
+            raise ValueError(f"Unsupported srm_action: {srm_action}")
+        if method not in TEST_METHODS:
+            raise ValueError(f"Unsupported method: {method}. Available methods: {', '.join(TEST_METHODS)}")
+        if method == 'randomization' and bucket_col not in data.columns:
+            raise ValueError(f"Randomization inference needs the bucket column '{bucket_col}'")
+        if method == 'randomization' and stratify_by:
+            # Bucket permutations of raw totals would not test the post-stratified estimate
+            raise ValueError("Randomization inference does not support stratify_by; "
+                             "use method='asymptotic' for post-stratified estimates")
+        if correction is not None and correction not in MULTIPLE_COMPARISON_METHODS:
+            raise ValueError(f"Unsupported correction: {correction}. "
+                             f"Available methods: {', '.join(MULTIPLE_COMPARISON_METHODS)}")
+        if missing not in MISSING_POLICIES:
+            raise ValueError(f"Unsupported missing value policy: {missing}. "
+                             f"Available policies: {', '.join(MISSING_POLICIES)}")
+        if is_two_sided:
+            alternative = 'two-sided'
+        
         # Convert single treatment label to list for consistent processing
         if isinstance(treated_labels, str):
             treated_labels = [treated_labels]
         
-        results = []
-        for treated_label in treated_labels:
-            for metric, metric_type in zip(metrics, metric_types):
-                if metric_type == 'mean':
-                    result = self.test_mean(data, groupname, treated_label, control_label,
-                                          metric, is_two_sided, alternative)
-                elif metric_type == 'ratio':
-                    x_var, y_var = metric.split('/')
-                    result = self.test_ratio(data, groupname, treated_label, control_label,
-                                           x_var, y_var, is_two_sided, alternative)
-                elif metric_type == 'proportion':
-                    result = self.test_proportion(data, groupname, treated_label, control_label,
-                                               metric, is_two_sided, alternative)
-                else:
-                    raise ValueError(f"Unsupported metric type: {metric_type}")
-                
-                results.append([treated_label, metric] + result)
-        
-        results_df = pd.DataFrame(
-            results,
-            columns=['Treatment_Group', 'Metric', 'Treatment_Value', 'Control_Value',
-                    'Absolute_Diff', 'Relative_Diff', 'T_Statistic', 'P_Value',
-                    'Confidence_Interval', 'Significance']
-        )
-        
-        # Round all numeric columns to 6 decimal places
-        numeric_columns = ['Treatment_Value', 'Control_Value', 'Absolute_Diff', 
-                         'Relative_Diff', 'T_Statistic', 'P_Value']
-        for col in numeric_columns:
-            results_df[col] = results_df[col].apply(lambda x: round(x, 6) if isinstance(x, (int, float)) else x)
-        
-        # Round values in Confidence_Interval
-        results_df['Confidence_Interval'] = results_df['Confidence_Interval'].apply(
-            lambda x: [round(x[0], 6), round(x[1], 6)] if isinstance(x[0], (int, float)) else x
-        )
+        srm_result = None
+        if group_proportions is not None:
+            srm_result = self.check_srm(data, groupname, group_proportions).iloc[0]
+            if srm_result['SRM'] and srm_action == 'block':
+                raise ValueError(
+                    f"Sample ratio mismatch detected (p={srm_result['P_Value']:.2e}); "
+                    "results would be biased")
+        
+        if n_jobs > 1 and len(metrics) > 1 and len(data) * len(metrics) >= MIN_PARALLEL_CELLS:
+            from parallel_tests import run_tests_parallel
+            unknown = [metric for metric in (capping or {}) if metric not in metrics]
+            if unknown:
+                raise ValueError(f"Capping given for unknown metric: {unknown[0]}")
+            grid = run_tests_parallel(
+                self, data, metrics, metric_types, groupname, treated_labels, control_label, n_jobs,
+                bucket_col if method == 'randomization' else None,
+                alternative=alternative, capping=capping, method=method,
+                n_permutations=n_permutations, random_state=random_state, missing=missing,
+                stratify_by=stratify_by)
+        else:
+            grid = self._test_grid(data, metrics, metric_types, groupname, treated_labels, control_label,
+                                   alternative, capping, method, bucket_col, n_permutations, random_state,
+                                   missing=missing, stratify_by=stratify_by)
         
+        return self._add_srm_columns(self._finalize_results(grid, correction, bool(capping)), srm_result)
+
+    @staticmethod
+    def _add_srm_columns(results_df: pd.DataFrame, srm_result: pd.Series = None) -> pd.DataFrame:
+        if srm_result is not None:
+            results_df['SRM_P_Value'] = srm_result['P_Value']
+            results_df['SRM_Check'] = "样本比例失衡" if srm_result['SRM'] else "正常"
         return results_df
\ No newline at end of file
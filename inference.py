@@ -0,0 +1,213 @@
+"""
+Vectorized inference over a grid of comparisons.
+
+Every (treatment group, metric) comparison is reduced to an estimate, its standard error
+and, for Welch t-tests, its degrees of freedom. These are built from per-group moments
+computed in one pass over each metric column, for all groups at once. P-values,
+confidence bounds and multiple-comparison adjustments are then computed for the whole
+grid as NumPy arrays, with one SciPy call per distribution rather than one per
+comparison, so the cost of the statistics no longer grows with the number of comparisons
+times the number of rows.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import stats
+
+ALTERNATIVES = ('two-sided', 'less', 'greater')
+# How missing metric values are handled: left out of that metric only, counted as 0, or the
+# whole unit left out of every metric
+MISSING_POLICIES = ('exclude', 'zero', 'drop_unit')
+# Bonferroni and Holm control the family-wise error rate, Benjamini-Hochberg the false discovery rate
+MULTIPLE_COMPARISON_METHODS = ('bonferroni', 'holm', 'bh')
+
+
+def missing_mask(columns: List[np.ndarray]) -> np.ndarray:
+    """Rows with a NaN in any of the given columns."""
+    mask = np.zeros(len(columns[0]), dtype=bool)
+    for values in columns:
+        mask |= np.isnan(values)
+    return mask
+
+
+def apply_missing_policy(columns: List[np.ndarray], policy: str,
+                         dropped: Optional[np.ndarray] = None) -> List[np.ndarray]:
+    """
+    The columns a metric reads, with NaN on every row the metric should leave out.
+
+    Under 'exclude' a row is left out when any of the metric's columns is NaN, so both sides
+    of a ratio cover the same rows; under 'zero' NaNs become 0; under 'drop_unit' the rows
+    in ``dropped`` (units with a NaN in any analysed column) are left out. Columns without
+    rows to leave out are returned as they are.
+
+    Args:
+        columns (List[np.ndarray]): float64 columns of one metric (two for ratio metrics)
+        policy (str): One of MISSING_POLICIES
+        dropped (np.ndarray, optional): Rows dropped under 'drop_unit', from ``missing_mask``
+
+    Returns:
+        List[np.ndarray]: The columns, in the same order
+    """
+    if policy not in MISSING_POLICIES:
+        raise ValueError(f"Unsupported missing value policy: {policy}. "
+                         f"Available policies: {', '.join(MISSING_POLICIES)}")
+    if policy == 'zero':
+        return [np.where(np.isnan(values), 0.0, values) if np.isnan(values).any() else values
+                for values in columns]
+    if policy == 'drop_unit':
+        excluded = dropped if dropped is not None else missing_mask(columns)
+    else:
+        excluded = missing_mask(columns) if len(columns) > 1 else None
+    if excluded is None or not excluded.any():
+        return columns
+    return [np.where(excluded, np.nan, values) for values in columns]
+
+
+def group_moments(values: np.ndarray, codes: np.ndarray, n_groups: int) -> Dict[str, np.ndarray]:
+    """
+    Per-group count, sum, mean and sample variance (ddof=1) of the non-null values of a column.
+
+    NaN rows are masked out rather than copied away, so one pass serves every group. The
+    variance is computed around the group means (two passes), which stays accurate for
+    metrics with a large mean and a small spread.
+
+    Args:
+        values (np.ndarray): Metric value of each row
+        codes (np.ndarray): Group code (0 to n_groups-1) of each row; -1 for rows without group
+        n_groups (int): Number of groups
+
+    Returns:
+        dict: 'count', 'sum', 'mean' and 'var' arrays of length n_groups
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = (codes >= 0) & ~np.isnan(values)
+    count = np.bincount(codes[valid], minlength=n_groups).astype(np.float64)
+    # bincount sums sequentially; summing around the overall mean keeps the error small for
+    # metrics with a large offset
+    shift = values[valid].mean() if valid.any() else 0.0
+    shifted_total = np.bincount(codes[valid], weights=values[valid] - shift, minlength=n_groups)
+    total = shifted_total + shift * count
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = shift + shifted_total / count
+        deviations = values[valid] - mean[codes[valid]]
+        var = np.bincount(codes[valid], weights=deviations * deviations, minlength=n_groups) / (count - 1)
+    return {'count': count, 'sum': total, 'mean': mean, 'var': var}
+
+
+def group_covariance(x: np.ndarray, y: np.ndarray, codes: np.ndarray, n_groups: int,
+                     x_mean: np.ndarray, y_mean: np.ndarray) -> np.ndarray:
+    """
+    Per-group sample covariance (ddof=1) of two columns around the given group means.
+
+    Rows where either column is NaN are left out.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = (codes >= 0) & ~np.isnan(x) & ~np.isnan(y)
+    codes = codes[valid]
+    products = (x[valid] - x_mean[codes]) * (y[valid] - y_mean[codes])
+    count = np.bincount(codes, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.bincount(codes, weights=products, minlength=n_groups) / (count - 1)
+
+
+def _check_alternative(alternative: str):
+    if alternative not in ALTERNATIVES:
+        raise ValueError(f"Unsupported alternative: {alternative}. Available: {', '.join(ALTERNATIVES)}")
+
+
+def p_values(statistic: np.ndarray, alternative: str = 'two-sided',
+             df: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    P-values of test statistics under a standard normal or Student t null distribution.
+
+    Args:
+        statistic (np.ndarray): Test statistics
+        alternative (str): 'two-sided', 'less', or 'greater'
+        df (np.ndarray, optional): Degrees of freedom of each statistic; NaN (or no array)
+            means the normal distribution
+
+    Returns:
+        np.ndarray: P-values; NaN where the statistic is NaN
+    """
+    _check_alternative(alternative)
+    statistic = np.asarray(statistic, dtype=np.float64)
+    if alternative == 'two-sided':
+        tail = np.abs(statistic)
+    else:
+        tail = statistic if alternative == 'greater' else -statistic
+    # Survival functions rather than 1 - cdf, so very small p-values do not round to zero
+    p = stats.norm.sf(tail)
+    if df is not None:
+        df = np.broadcast_to(np.asarray(df, dtype=np.float64), statistic.shape)
+        t_rows = ~np.isnan(df)
+        if t_rows.any():
+            p[t_rows] = stats.t.sf(tail[t_rows], df[t_rows])
+    return np.minimum(2 * p, 1.0) if alternative == 'two-sided' else p
+
+
+def confidence_bounds(estimate: np.ndarray, std_error: np.ndarray, alpha: float,
+                      alternative: str = 'two-sided') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Normal-approximation confidence bounds of estimates.
+
+    One-sided alternatives give a one-sided interval: 'less' has a lower bound of -inf and
+    'greater' an upper bound of +inf.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Lower and upper bounds
+    """
+    _check_alternative(alternative)
+    estimate = np.asarray(estimate, dtype=np.float64)
+    std_error = np.asarray(std_error, dtype=np.float64)
+    if alternative == 'two-sided':
+        margin = stats.norm.ppf(1 - alpha / 2) * std_error
+        return estimate - margin, estimate + margin
+    margin = stats.norm.ppf(1 - alpha) * std_error
+    unbounded = np.full(estimate.shape, np.inf)
+    if alternative == 'less':
+        return -unbounded, estimate + margin
+    return estimate - margin, unbounded
+
+
+def adjust_p_values(p: np.ndarray, method: str) -> np.ndarray:
+    """
+    Adjust p-values for multiple comparisons.
+
+    The family is every non-NaN p-value passed in; NaN p-values stay NaN and are not counted.
+
+    Args:
+        p (np.ndarray): Unadjusted p-values
+        method (str): 'bonferroni', 'holm' (step-down Bonferroni) or 'bh' (Benjamini-Hochberg
+            false discovery rate)
+
+    Returns:
+        np.ndarray: Adjusted p-values, capped at 1, in the order of ``p``
+    """
+    if method not in MULTIPLE_COMPARISON_METHODS:
+        raise ValueError(f"Unsupported multiple comparison method: {method}. "
+                         f"Available methods: {', '.join(MULTIPLE_COMPARISON_METHODS)}")
+    p = np.asarray(p, dtype=np.float64)
+    adjusted = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    family = p[valid]
+    m = len(family)
+    if m == 0:
+        return adjusted
+
+    if method == 'bonferroni':
+        adjusted[valid] = np.minimum(family * m, 1.0)
+        return adjusted
+
+    order = np.argsort(family, kind='stable')
+    ranked = family[order]
+    if method == 'holm':
+        # The i-th smallest p-value (0-based) is multiplied by m - i, and adjusted values may not decrease
+        ranked = np.maximum.accumulate((m - np.arange(m)) * ranked)
+    else:
+        # The i-th smallest (1-based) is multiplied by m / i, then made monotone from the largest down
+        ranked = np.minimum.accumulate((m / np.arange(1, m + 1) * ranked)[::-1])[::-1]
+    family_adjusted = np.empty(m)
+    family_adjusted[order] = np.minimum(ranked, 1.0)
+    adjusted[valid] = family_adjusted
+    return adjusted
@@ -0,0 +1,86 @@
+import streamlit as st
+import pandas as pd
+from scipy import stats
+from results_store import ResultsStore
+
+st.set_page_config(
+    page_title="AA历史结果",
+    layout="wide",
+    initial_sidebar_state="expanded",
+    page_icon="📈"
+)
+
+@st.cache_resource
+def get_results_store():
+    """Process-wide handle on the local results warehouse"""
+    return ResultsStore()
+
+results_store = get_results_store()
+
+st.title("📈 历史AA结果")
+st.markdown("每次在主页面“运行分析”时勾选“保存到历史记录”，结果会连同配置和数据集指纹保存在本地结果库中。"
+            "AA实验中各组没有真实差异，因此指标被判为显著的比例就是该指标的假阳性率（FPR），应接近显著性水平。")
+
+experiments = results_store.experiments()
+if not experiments:
+    st.info("暂无历史记录。请先在主页面完成一次指标分析并保存到历史记录。")
+    st.stop()
+
+# 查询条件
+filter_col1, filter_col2, filter_col3, filter_col4 = st.columns(4)
+with filter_col1:
+    days = st.number_input("最近天数", min_value=1, max_value=3650, value=90, step=1)
+with filter_col2:
+    experiment = st.selectbox("实验", options=["全部实验"] + experiments)
+    experiment = None if experiment == "全部实验" else experiment
+with filter_col3:
+    alpha = st.number_input("显著性水平", min_value=0.001, max_value=0.5, value=0.05, step=0.005, format="%.3f")
+with filter_col4:
+    exclude_srm = st.checkbox("排除样本比例失衡（SRM）的运行", value=True)
+
+fpr = results_store.false_positive_rates(experiment=experiment, days=days, alpha=alpha, exclude_srm=exclude_srm)
+
+st.subheader(f"各指标假阳性率（最近 {days} 天）")
+if fpr.empty:
+    st.info("所选时间范围内没有记录。")
+    st.stop()
+
+# 假阳性次数服从二项分布 Binomial(Tests, alpha)；单侧检验判断 FPR 是否显著高于显著性水平
+fpr['FPR_P_Value'] = stats.binom.sf(fpr['Significant'] - 1, fpr['Tests'], alpha)
+fpr['FPR偏高'] = fpr['FPR_P_Value'] < 0.05
+st.dataframe(fpr.rename(columns={
+    'Tests': '检验次数', 'Significant': '显著次数', 'FPR': '假阳性率', 'Runs': '运行次数',
+    'First_Run': '最早运行', 'Last_Run': '最近运行', 'FPR_P_Value': '二项检验p值'
+}).style.format({'假阳性率': '{:.2%}', '二项检验p值': '{:.4f}'}))
+if fpr['FPR偏高'].any():
+    st.warning("⚠️ 以下指标的假阳性率显著高于显著性水平，检验方法或数据可能存在问题：" +
+               "、".join(map(str, fpr.index[fpr['FPR偏高']])))
+
+import plotly.express as px
+fig = px.bar(fpr.reset_index(), x='Metric', y='FPR', text=fpr['FPR'].map('{:.1%}'.format),
+             labels={'Metric': '指标', 'FPR': '假阳性率'})
+fig.add_hline(y=alpha, line_dash="dash", line_color="red", annotation_text=f"α = {alpha:g}")
+st.plotly_chart(fig, use_container_width=True)
+
+# 单个指标的趋势和明细
+metric = st.selectbox("查看指标明细：", options=fpr.index.tolist())
+# 与上表使用同一显著性定义：校正后的P值（如有）低于所选显著性水平
+daily = results_store.daily_significance(metric, experiment=experiment, days=days, alpha=alpha,
+                                         exclude_srm=exclude_srm)
+if not daily.empty:
+    daily['FPR'] = daily['Significant'] / daily['Tests']
+    fig = px.line(daily, x='Date', y='FPR', markers=True, hover_data=['Tests', 'Significant'],
+                  labels={'Date': '日期', 'FPR': '每日显著比例'})
+    fig.add_hline(y=alpha, line_dash="dash", line_color="red")
+    st.plotly_chart(fig, use_container_width=True)
+
+st.write(f"{metric} 的历史结果：")
+st.dataframe(results_store.results(metric=metric, experiment=experiment, days=days).drop(columns=['run_id']))
+
+st.subheader("最近的运行")
+runs = results_store.runs(experiment=experiment, days=days, limit=200)
+runs['config'] = runs['config'].map(lambda config: ", ".join(f"{k}={v}" for k, v in config.items()))
+st.dataframe(runs.rename(columns={
+    'experiment': '实验', 'created_at': '运行时间', 'dataset_fingerprint': '数据集指纹',
+    'n_rows': '行数', 'config': '配置'
+}))
@@ -0,0 +1,264 @@
+"""
+Multi-core ``run_statistical_tests`` over a shared metric matrix.
+
+The group codes and the metric columns (plus the bucket column for randomization tests)
+are packed once into a single float64 matrix in ``multiprocessing.shared_memory``, one
+contiguous row per column. Worker processes attach to that block by name and wrap it in
+a DataFrame without copying, so starting a worker costs a few KB of metadata rather than
+a pickled copy of the dataset. Each worker then runs the ordinary serial tests on a
+slice of the metrics, and the slices are put back in the serial result order. Workers
+return unrounded results, so that multiple-comparison adjustment and rounding happen once
+over the whole grid in the parent.
+
+Starting worker processes takes seconds, so one pool is kept per process and reused by
+every call; each task attaches to its call's block and detaches when done. Below
+``MIN_PARALLEL_CELLS`` rows x metrics the serial tests are faster than any hand-off, and
+``run_statistical_tests`` does not use the pool.
+
+Layout of the matrix::
+
+    row 0      group code of each unit (index into the group labels; NaN without group)
+    row 1..n   metric columns, as float64 (then the bucket and stratum codes when used)
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+# Name of the group-code column inside the shared matrix
+GROUP_CODE_COLUMN = '__group_code__'
+# Name of the stratum-code column inside the shared matrix, for post-stratified tests
+STRATUM_CODE_COLUMN = '__stratum_code__'
+# Fewest rows x metrics worth sending to worker processes
+MIN_PARALLEL_CELLS = 5_000_000
+
+
+class SharedMetricMatrix:
+    """
+    Group codes and metric columns in one shared-memory block.
+
+    Create it in the parent process with ``SharedMetricMatrix.create`` and pass ``handle``
+    to workers, which open the same block with ``SharedMetricMatrix.attach``. The creator
+    unlinks the block on ``close``.
+    """
+
+    def __init__(self, block: shared_memory.SharedMemory, columns: List[str], labels: List[Hashable],
+                 n_rows: int, owner: bool):
+        self._block = block
+        self.columns = columns
+        self.labels = labels
+        self.n_rows = n_rows
+        self._owner = owner
+        self.array = np.ndarray((len(columns) + 1, n_rows), dtype=np.float64, buffer=block.buf)
+
+    @classmethod
+    def create(cls, data: pd.DataFrame, groupname: str, columns: Sequence[str]) -> 'SharedMetricMatrix':
+        """
+        Copy the group column (as codes) and ``columns`` of ``data`` into a new shared block.
+
+        Raises:
+            ValueError: If a column is missing or not numeric
+        """
+        columns = list(dict.fromkeys(columns))
+        missing = [col for col in [groupname] + columns if col not in data.columns]
+        if missing:
+            raise ValueError(f"Columns not found: {', '.join(missing)}")
+        non_numeric = [col for col in columns
+                       if not (pd.api.types.is_numeric_dtype(data[col]) or pd.api.types.is_bool_dtype(data[col]))]
+        if non_numeric:
+            raise ValueError(f"Metric columns must be numeric: {', '.join(non_numeric)}")
+
+        codes, labels = pd.factorize(data[groupname])
+        n_rows = len(data)
+        block = shared_memory.SharedMemory(create=True, size=max(1, (len(columns) + 1) * n_rows * 8))
+        matrix = cls(block, columns, labels.tolist(), n_rows, owner=True)
+        try:
+            matrix.array[0] = codes
+            matrix.array[0, codes < 0] = np.nan
+            for i, col in enumerate(columns, start=1):
+                matrix.array[i] = data[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        except BaseException:
+            matrix.close()
+            raise
+        return matrix
+
+    @property
+    def handle(self) -> Dict:
+        """Picklable description of the block for ``attach``."""
+        return {'name': self._block.name, 'columns': self.columns, 'labels': self.labels, 'n_rows': self.n_rows}
+
+    @classmethod
+    def attach(cls, handle: Dict) -> 'SharedMetricMatrix':
+        """Open a block created in another process, without copying it."""
+        block = shared_memory.SharedMemory(name=handle['name'])
+        return cls(block, handle['columns'], handle['labels'], handle['n_rows'], owner=False)
+
+    def frame(self) -> pd.DataFrame:
+        """DataFrame view of the matrix; group codes are in ``GROUP_CODE_COLUMN``."""
+        # The transposed C-ordered matrix is exactly pandas' internal block layout, so no copy is made
+        return pd.DataFrame(self.array.T, columns=[GROUP_CODE_COLUMN] + self.columns, copy=False)
+
+    def code(self, label: Hashable) -> float:
+        """Group code of a label."""
+        if label not in self.labels:
+            raise ValueError(f"Group not found in data: {label}")
+        return float(self.labels.index(label))
+
+    def close(self):
+        """Release the view; the creating process also frees the shared block."""
+        self.array = None
+        self._block.close()
+        if self._owner:
+            self._block.unlink()
+
+    def __enter__(self) -> 'SharedMetricMatrix':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def metric_columns(metrics: Sequence[str], metric_types: Sequence[str]) -> List[str]:
+    """Data columns the given metrics read (both sides of ratio metrics)."""
+    columns = []
+    for metric, metric_type in zip(metrics, metric_types):
+        columns.extend(metric.split('/') if metric_type == 'ratio' else [metric])
+    return list(dict.fromkeys(columns))
+
+
+def _run_slice(handle: Dict, metrics: List[str], metric_types: List[str], treated_codes: List[float],
+               control_code: float, alpha: float, options: Dict) -> pd.DataFrame:
+    from experiment_analysis import ExperimentAnalysis
+
+    analysis = ExperimentAnalysis()
+    analysis.alpha = alpha
+    matrix = SharedMetricMatrix.attach(handle)
+    try:
+        frame = matrix.frame()
+        results = analysis._test_grid(frame, metrics, metric_types, GROUP_CODE_COLUMN,
+                                      treated_codes, control_code, **options)
+        # The block can only be closed once no view of it is left
+        del frame
+        return results
+    finally:
+        matrix.close()
+
+
+def _process_context():
+    # Workers should not inherit the parent's threads (e.g. Streamlit's), so they are forked from a
+    # clean server instead, which imports the analysis modules once rather than once per worker
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['experiment_analysis'])
+    return context
+
+
+# Worker pool shared by all calls in this process, created on first use
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(n_workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers < n_workers:
+            if _pool is not None:
+                # Tasks already submitted to the smaller pool still finish
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=_process_context())
+            _pool_workers = n_workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    # A pool whose worker died cannot run tasks any more; the next call starts a new one
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is pool:
+            _pool, _pool_workers = None, 0
+
+
+def run_tests_parallel(analysis, data: pd.DataFrame, metrics: List[str], metric_types: List[str],
+                       groupname: str, treated_labels: List[Hashable], control_label: Hashable,
+                       n_jobs: int = DEFAULT_WORKERS, bucket_col: Optional[str] = None,
+                       **options) -> pd.DataFrame:
+    """
+    Run ``analysis._test_grid`` with the metrics split over worker processes.
+
+    SRM checks, multiple-comparison adjustment and rounding belong to the caller; ``options``
+    are the remaining keyword arguments of ``_test_grid`` and are passed to every worker
+    unchanged.
+
+    Args:
+        analysis (ExperimentAnalysis): Analysis whose significance level is used
+        data (pd.DataFrame): Input dataset
+        metrics (List[str]): Metrics to test
+        metric_types (List[str]): Metric types
+        groupname (str): Column with group labels
+        treated_labels (List): Treatment group labels
+        control_label: Control group label
+        n_jobs (int): Number of worker processes
+        bucket_col (str, optional): Bucket column to share as well (randomization tests)
+
+    Returns:
+        pd.DataFrame: The same rows, in the same order, as the serial ``_test_grid``
+    """
+    columns = metric_columns(metrics, metric_types) + ([bucket_col] if bucket_col else [])
+    slices = [list(s) for s in np.array_split(np.arange(len(metrics)), min(n_jobs, len(metrics))) if len(s)]
+    if bucket_col:
+        options = dict(options, bucket_col=bucket_col)
+
+    capping = options.pop('capping', None) or {}
+    if options.get('stratify_by') is not None:
+        # Strata are coded once here, so the (possibly text) stratification columns need not be shared
+        stratify_by = options['stratify_by']
+        stratum_codes, _ = analysis._stratum_codes(data, [stratify_by] if isinstance(stratify_by, str)
+                                                   else list(stratify_by))
+        data = data.assign(**{STRATUM_CODE_COLUMN: stratum_codes})
+        columns.append(STRATUM_CODE_COLUMN)
+        options['stratify_by'] = STRATUM_CODE_COLUMN
+    if options.get('missing') == 'drop_unit':
+        # A unit missing any analysed column is dropped from every slice, not only from its own
+        options['drop_unit_columns'] = metric_columns(metrics, metric_types)
+
+    with SharedMetricMatrix.create(data, groupname, columns) as matrix:
+        treated_codes = [matrix.code(label) for label in treated_labels]
+        control_code = matrix.code(control_label)
+        pool = _get_pool(len(slices))
+        futures = []
+        try:
+            for s in slices:
+                slice_metrics = [metrics[i] for i in s]
+                slice_capping = {metric: spec for metric, spec in capping.items() if metric in slice_metrics}
+                futures.append(pool.submit(_run_slice, matrix.handle, slice_metrics,
+                                           [metric_types[i] for i in s], treated_codes, control_code,
+                                           analysis.alpha, dict(options, capping=slice_capping)))
+            parts = [future.result() for future in futures]
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+        finally:
+            # The block is freed on leaving this block, so no task may still be reading it
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+
+    results = pd.concat(parts, ignore_index=True)
+    results['Treatment_Group'] = results['Treatment_Group'].map(lambda code: matrix.labels[int(code)])
+    # Serial order: treatment groups in the given order, metrics in the given order within each
+    treated_order = {label: i for i, label in enumerate(treated_labels)}
+    metric_order = {metric: i for i, metric in enumerate(metrics)}
+    order = np.lexsort((results['Metric'].map(metric_order).to_numpy(),
+                        results['Treatment_Group'].map(treated_order).to_numpy()))
+    return results.iloc[order].reset_index(drop=True)
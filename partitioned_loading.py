@@ -0,0 +1,357 @@
+"""
+Multi-file (partitioned) CSV/Parquet input.
+
+Exports often arrive as hundreds of daily part files. A directory, a glob pattern or a list
+of paths is expanded into parts, which are processed as a pipeline so that disk and cores
+are busy at the same time:
+
+- a thread pool reads each part and decompresses gzip/bz2 CSVs (both release the GIL),
+- a process pool parses the part and folds it into per-group accumulators
+  (``MetricSketch`` per group and metric), which are small and cheap to send back,
+- the main process merges each part's accumulators as soon as that part is done.
+
+At most a few parts per worker are in flight, so memory stays bounded however many parts
+there are. ``load_parts`` instead returns the concatenated rows, for callers (like the app)
+that need the full dataset.
+
+Command line::
+
+    python partitioned_loading.py "exports/2024-*.csv.gz" --group-col group_name --metrics revenue clicks
+"""
+import argparse
+import bz2
+import glob
+import gzip
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from sketches import MetricSketch
+
+PART_SUFFIXES = ('.csv', '.csv.gz', '.csv.bz2', '.parquet', '.pq')
+DEFAULT_IO_THREADS = min(32, (os.cpu_count() or 1) * 4)
+DEFAULT_PROCESSES = os.cpu_count() or 1
+# Parts read ahead per parsing process; bounds the raw bytes held in memory
+_PARTS_IN_FLIGHT_PER_PROCESS = 2
+SUMMARY_QUANTILES = (0.5,)
+
+PartSource = Union[str, Sequence[str]]
+
+
+def _is_part(name: str) -> bool:
+    return name.lower().endswith(PART_SUFFIXES)
+
+
+def list_parts(source: PartSource) -> List[str]:
+    """
+    Expand a directory, glob pattern, single file or list of any of these into part files.
+
+    Directories are searched recursively (e.g. ``date=2024-01-01/part-0.parquet`` layouts).
+    Parts are returned sorted, so results do not depend on directory listing order.
+
+    Raises:
+        ValueError: If nothing matches or a matched file is not a CSV/Parquet part
+    """
+    sources = [source] if isinstance(source, (str, os.PathLike)) else list(source)
+    parts = []
+    for item in map(str, sources):
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                parts.extend(os.path.join(root, name) for name in files if _is_part(name))
+        elif glob.has_magic(item):
+            parts.extend(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+        elif os.path.isfile(item):
+            parts.append(item)
+        else:
+            raise ValueError(f"No such file or directory: {item}")
+    unsupported = [path for path in parts if not _is_part(path)]
+    if unsupported:
+        raise ValueError(f"Unsupported part file(s): {', '.join(unsupported[:5])}. "
+                         f"Supported: {', '.join(PART_SUFFIXES)}")
+    if not parts:
+        raise ValueError(f"No CSV or Parquet parts found in {source}")
+    return sorted(set(parts))
+
+
+def read_part_bytes(path: str) -> bytes:
+    """Read a part and decompress it if it is a compressed CSV (runs on the I/O threads)."""
+    with open(path, 'rb') as f:
+        payload = f.read()
+    lower = path.lower()
+    if lower.endswith('.gz'):
+        return gzip.decompress(payload)
+    if lower.endswith('.bz2'):
+        return bz2.decompress(payload)
+    return payload
+
+
+def parse_part(name: str, payload: bytes, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Parse the (decompressed) content of a part.
+
+    Args:
+        name (str): File name, used to tell CSV from Parquet
+        payload (bytes): Content as returned by ``read_part_bytes``
+        columns (sequence of str, optional): Columns to load; defaults to all
+
+    Returns:
+        pd.DataFrame: Rows of the part
+    """
+    lower = name.lower()
+    usecols = list(columns) if columns is not None else None
+    if lower.endswith(('.parquet', '.pq')):
+        return pd.read_parquet(io.BytesIO(payload), columns=usecols)
+    return pd.read_csv(io.BytesIO(payload), usecols=usecols)
+
+
+class GroupAccumulators:
+    """
+    Mergeable per-group statistics: row counts and a ``MetricSketch`` per group and metric.
+
+    Args:
+        metrics (sequence of str): Metric columns to accumulate
+    """
+
+    def __init__(self, metrics: Sequence[str]):
+        self.metrics = list(metrics)
+        self.rows: Dict[Hashable, int] = {}
+        self.sketches: Dict[Hashable, Dict[str, MetricSketch]] = {}
+        self.parts = 0
+
+    def _group(self, group: Hashable) -> Dict[str, MetricSketch]:
+        if group not in self.sketches:
+            self.sketches[group] = {metric: MetricSketch() for metric in self.metrics}
+            self.rows[group] = 0
+        return self.sketches[group]
+
+    def update(self, frame: pd.DataFrame, group_col: str):
+        """Fold a chunk of rows into the accumulators."""
+        missing = [col for col in [group_col] + self.metrics if col not in frame.columns]
+        if missing:
+            raise ValueError(f"Columns not found: {', '.join(missing)}")
+        codes, groups = pd.factorize(frame[group_col])
+        counts = np.bincount(codes[codes >= 0], minlength=len(groups))
+        values = {metric: pd.to_numeric(frame[metric], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                  for metric in self.metrics}
+        for code, group in enumerate(groups):
+            rows = codes == code
+            sketches = self._group(group)
+            self.rows[group] += int(counts[code])
+            for metric in self.metrics:
+                sketches[metric].update(values[metric][rows])
+        self.parts += 1
+
+    def merge(self, other: 'GroupAccumulators') -> 'GroupAccumulators':
+        """Fold another set of accumulators (over the same metrics) into this one."""
+        if other.metrics != self.metrics:
+            raise ValueError("Accumulators over different metrics cannot be merged")
+        for group, sketches in other.sketches.items():
+            own = self._group(group)
+            self.rows[group] += other.rows[group]
+            for metric, sketch in sketches.items():
+                own[metric].merge(sketch)
+        self.parts += other.parts
+        return self
+
+    def group_counts(self) -> pd.Series:
+        """Rows per group, e.g. for ``srm.srm_test``."""
+        return pd.Series(self.rows, name='Rows').sort_index()
+
+    def summary(self) -> pd.DataFrame:
+        """
+        One row per (group, metric) with 'Rows', 'Count', 'Mean', 'Std', 'Min', 'P50' and 'Max'.
+
+        The median is approximate (``QuantileSketch``); everything else is exact.
+        """
+        records = []
+        for group in sorted(self.sketches, key=str):
+            for metric, sketch in self.sketches[group].items():
+                moments = sketch.moments
+                records.append({
+                    'Group': group, 'Metric': metric, 'Rows': self.rows[group], 'Count': moments.count,
+                    'Mean': moments.mean if moments.count else np.nan, 'Std': moments.std,
+                    'Min': moments.min, 'P50': sketch.quantiles.quantile(SUMMARY_QUANTILES[0]), 'Max': moments.max,
+                })
+        columns = ['Group', 'Metric', 'Rows', 'Count', 'Mean', 'Std', 'Min', 'P50', 'Max']
+        return pd.DataFrame(records, columns=columns).set_index(['Group', 'Metric'])
+
+
+def _aggregate_part(name: str, payload: bytes, group_col: str, metrics: List[str]) -> GroupAccumulators:
+    # Runs in a worker process: only the small accumulators travel back, not the rows
+    accumulators = GroupAccumulators(metrics)
+    accumulators.update(parse_part(name, payload, [group_col] + metrics), group_col)
+    return accumulators
+
+
+def _process_context():
+    # Forking a process that already runs I/O threads is unsafe; forkserver forks from a clean server
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _pipeline(paths: List[str], io_threads: int, processes: int,
+              work: Callable, merge: Callable[[str, object], None]):
+    """Read parts on threads, run ``work(name, payload)`` on processes, merge results as they finish."""
+    in_flight = max(1, processes) * _PARTS_IN_FLIGHT_PER_PROCESS
+    remaining = iter(paths)
+    with ThreadPoolExecutor(max_workers=io_threads) as io_pool, \
+            ProcessPoolExecutor(max_workers=processes, mp_context=_process_context()) as cpu_pool:
+        reading, working = {}, {}
+
+        def refill():
+            while len(reading) + len(working) < in_flight:
+                path = next(remaining, None)
+                if path is None:
+                    return
+                reading[io_pool.submit(read_part_bytes, path)] = path
+
+        refill()
+        while reading or working:
+            done, _ = wait(list(reading) + list(working), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in reading:
+                    path = reading.pop(future)
+                    working[cpu_pool.submit(work, path, _result(future, path))] = path
+                else:
+                    path = working.pop(future)
+                    merge(path, _result(future, path))
+            refill()
+
+
+def _result(future, path: str):
+    try:
+        return future.result()
+    except Exception as e:
+        raise ValueError(f"Failed to process part {path}: {e}") from e
+
+
+def aggregate_parts(source: PartSource, group_col: str, metrics: Sequence[str],
+                    io_threads: int = DEFAULT_IO_THREADS, processes: int = DEFAULT_PROCESSES,
+                    on_part: Optional[Callable[[str, int, int], None]] = None) -> GroupAccumulators:
+    """
+    Per-group statistics of partitioned data without materializing it.
+
+    Args:
+        source (str or list): Directory, glob pattern, file, or a list of these
+        group_col (str): Column with group labels
+        metrics (sequence of str): Metric columns
+        io_threads (int): Threads reading and decompressing parts
+        processes (int): Processes parsing and aggregating parts; 0 runs everything in
+            the calling process (still reading on threads)
+        on_part (callable, optional): Called as ``on_part(path, done, total)`` after each part
+
+    Returns:
+        GroupAccumulators: Merged accumulators over all parts
+    """
+    paths = list_parts(source)
+    metrics = list(metrics)
+    accumulators = GroupAccumulators(metrics)
+    done = 0
+
+    def merge(path: str, part: GroupAccumulators):
+        nonlocal done
+        accumulators.merge(part)
+        done += 1
+        if on_part is not None:
+            on_part(path, done, len(paths))
+
+    work = _PartWork(_aggregate_part, group_col, metrics)
+    if processes > 0:
+        _pipeline(paths, io_threads, processes, work, merge)
+    else:
+        with ThreadPoolExecutor(max_workers=io_threads) as io_pool:
+            for path, payload in zip(paths, io_pool.map(read_part_bytes, paths)):
+                merge(path, work(path, payload))
+    return accumulators
+
+
+class _PartWork:
+    """Picklable ``work(name, payload)`` callable with bound extra arguments."""
+
+    def __init__(self, func: Callable, *args):
+        self.func = func
+        self.args = args
+
+    def __call__(self, name: str, payload: bytes):
+        return self.func(name, payload, *self.args)
+
+
+def load_parts(source: Union[PartSource, Iterable[Tuple[str, bytes]]], columns: Optional[Sequence[str]] = None,
+               io_threads: int = DEFAULT_IO_THREADS) -> pd.DataFrame:
+    """
+    Concatenated rows of all parts, read and parsed on a thread pool.
+
+    Args:
+        source: Directory, glob pattern, file or list of them; or (name, content) pairs of
+            files that are already in memory, such as uploads
+        columns (sequence of str, optional): Columns to load; defaults to all
+        io_threads (int): Threads reading, decompressing and parsing parts
+
+    Returns:
+        pd.DataFrame: Rows of all parts in part order, with a fresh RangeIndex
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        source = list(source)
+    if isinstance(source, (str, os.PathLike)) or not _is_pairs(source):
+        paths = list_parts(source)
+
+        def read(path: str) -> pd.DataFrame:
+            return parse_part(path, read_part_bytes(path), columns)
+        items = paths
+    else:
+        def read(item: Tuple[str, bytes]) -> pd.DataFrame:
+            name, content = item
+            lower = name.lower()
+            if lower.endswith('.gz'):
+                content = gzip.decompress(content)
+            elif lower.endswith('.bz2'):
+                content = bz2.decompress(content)
+            return parse_part(name, content, columns)
+        items = list(source)
+        if not items:
+            raise ValueError("No parts given")
+
+    with ThreadPoolExecutor(max_workers=io_threads) as pool:
+        frames = list(pool.map(read, items))
+    columns_seen = {tuple(frame.columns) for frame in frames}
+    if len(columns_seen) > 1:
+        raise ValueError("Parts have different columns; select the columns to load")
+    return pd.concat(frames, ignore_index=True)
+
+
+def _is_pairs(items: list) -> bool:
+    return bool(items) and all(isinstance(item, tuple) and len(item) == 2 for item in items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-group metric summary of partitioned CSV/Parquet exports")
+    parser.add_argument('source', nargs='+', help='Directories, glob patterns or part files')
+    parser.add_argument('--group-col', required=True)
+    parser.add_argument('--metrics', nargs='+', required=True)
+    parser.add_argument('--io-threads', type=int, default=DEFAULT_IO_THREADS)
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES)
+    parser.add_argument('--output', help='Write the summary to this CSV file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    accumulators = aggregate_parts(
+        args.source, args.group_col, args.metrics, args.io_threads, args.processes,
+        on_part=lambda path, done, total: print(f"[{done}/{total}] {path}", flush=True)
+    )
+    summary = accumulators.summary()
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(summary)
+    print(f"{accumulators.parts} parts, {sum(accumulators.rows.values())} rows "
+          f"in {time.perf_counter() - start:.1f}s")
+    if args.output:
+        summary.to_csv(args.output)
+
+
+if __name__ == '__main__':
+    main()
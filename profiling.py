@@ -0,0 +1,181 @@
+"""
+One-pass column profiling.
+
+Streams the dataset in row chunks through mergeable sketches and keeps one summary row
+per column: dtype, null rate, approximate cardinality and duplicate count, moments and
+approximate quantiles. The app profiles each upload once and derives its ID, group and
+metric column suggestions and its statistics tab from the profile instead of rescanning
+the data on every rerun.
+"""
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from sketches import DistinctSketch, MetricSketch
+
+PROFILE_CHUNK_ROWS = 1_000_000
+PROFILE_QUANTILES = (0.25, 0.5, 0.75)
+# Most distinct values of a column offered for post-stratification
+MAX_STRATUM_LEVELS = 50
+
+# Values inspected when looking for group labels such as 'control_group'
+_GROUP_SAMPLE_ROWS = 100
+# Columns whose values are (almost) all distinct are treated as ID candidates
+_ID_DISTINCT_RATIO = 0.95
+
+
+def _is_numeric(dtype) -> bool:
+    return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+
+
+def _is_text(dtype) -> bool:
+    return pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+
+
+def _mentions_group(name: str, head: pd.Series) -> bool:
+    if 'group' in str(name).lower():
+        return True
+    if not _is_text(head.dtype):
+        return False
+    return bool(head.astype(str).str.lower().str.contains('group', regex=False).any())
+
+
+def profile_dataset(data: pd.DataFrame, chunk_rows: int = PROFILE_CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Profile every column in a single streaming pass.
+
+    Args:
+        data (pd.DataFrame): Dataset to profile
+        chunk_rows (int): Rows per chunk fed to the sketches
+
+    Returns:
+        pd.DataFrame: One row per column (indexed by column name) with 'Dtype', 'Numeric',
+            'Count', 'Null_Rate', 'Approx_Distinct', 'Duplicates', 'Mentions_Group', and for numeric
+            columns 'Mean', 'Std', 'Min', 'P25', 'P50', 'P75' and 'Max'. Distinct and duplicate
+            counts are exact below 4096 distinct values; above that, duplicates are only reported
+            when they exceed twice the sketch error
+    """
+    n_rows = len(data)
+    rows = []
+    for name in data.columns:
+        column = data[name]
+        numeric = _is_numeric(column.dtype)
+        distinct = DistinctSketch()
+        metric = MetricSketch() if numeric else None
+        non_null = 0
+
+        for start in range(0, max(n_rows, 1), chunk_rows):
+            chunk = column.iloc[start:start + chunk_rows]
+            valid = chunk[chunk.notna()]
+            non_null += len(valid)
+            distinct.update(valid)
+            if numeric:
+                metric.update(valid.to_numpy(dtype=np.float64))
+
+        approx_distinct = min(distinct.estimate(), non_null)
+        duplicates = non_null - approx_distinct
+        if duplicates < 2 * distinct.relative_error * non_null:
+            # Within the sketch's error band a nearly unique column is reported as unique.
+            approx_distinct, duplicates = non_null, 0
+        row = {
+            'Column': name,
+            'Dtype': str(column.dtype),
+            'Numeric': numeric,
+            'Count': non_null,
+            'Null_Rate': 1 - non_null / n_rows if n_rows else 0.0,
+            'Approx_Distinct': int(round(approx_distinct)),
+            'Duplicates': int(round(duplicates)),
+            'Mentions_Group': _mentions_group(name, column.head(_GROUP_SAMPLE_ROWS)),
+        }
+        if numeric:
+            moments = metric.moments
+            p25, p50, p75 = metric.quantiles.quantile(PROFILE_QUANTILES)
+            row.update({'Mean': moments.mean if moments.count else np.nan, 'Std': moments.std,
+                        'Min': moments.min, 'P25': p25, 'P50': p50, 'P75': p75, 'Max': moments.max})
+        rows.append(row)
+
+    columns = ['Column', 'Dtype', 'Numeric', 'Count', 'Null_Rate', 'Approx_Distinct', 'Duplicates',
+               'Mentions_Group', 'Mean', 'Std', 'Min', 'P25', 'P50', 'P75', 'Max']
+    return pd.DataFrame(rows, columns=columns).set_index('Column')
+
+
+def numeric_columns(profile: pd.DataFrame) -> List[str]:
+    """Columns that were profiled as numeric."""
+    return profile.index[profile['Numeric']].tolist()
+
+
+def suggest_id_columns(profile: pd.DataFrame) -> List[str]:
+    """
+    All columns, best unit-ID candidates first.
+
+    Columns whose values are (almost) all distinct come first, those with 'id' or 'key' in
+    their name ahead of the rest; the remaining columns keep their original order.
+    """
+    ratio = profile['Approx_Distinct'] / profile['Count'].clip(lower=1)
+    names = profile.index.to_series().astype(str).str.lower()
+    named_like_id = names.str.contains('id') | names.str.contains('key')
+    score = (ratio >= _ID_DISTINCT_RATIO).astype(int) * 2 + named_like_id.astype(int)
+    order = np.argsort(-score.to_numpy(), kind='stable')
+    return profile.index[order].tolist()
+
+
+def suggest_group_columns(profile: pd.DataFrame) -> List[str]:
+    """Columns whose name or leading values mention 'group'."""
+    return profile.index[profile['Mentions_Group']].tolist()
+
+
+def suggest_sum_columns(profile: pd.DataFrame, exclude: Optional[List[str]] = None) -> List[str]:
+    """
+    Numeric columns to sum when merging a unit's duplicate rows.
+
+    0/1 indicator columns (conversion flags and the like) are left out: their sums would
+    no longer be proportions.
+    """
+    exclude = set(exclude or [])
+    candidates = profile.loc[[c for c in numeric_columns(profile) if c not in exclude]]
+    indicator = (candidates['Min'].isin([0, 1]) & candidates['Max'].isin([0, 1])
+                 & (candidates['Approx_Distinct'] <= 2))
+    return candidates.index[~indicator].tolist()
+
+
+def suggest_metric_columns(profile: pd.DataFrame, exclude: Optional[List[str]] = None) -> List[str]:
+    """
+    Numeric columns usable as metrics, most likely metrics first.
+
+    Non-constant columns come before constant ones, and columns that look like IDs
+    (nearly all values distinct and integer-valued) go last.
+    """
+    exclude = set(exclude or [])
+    candidates = profile.loc[[c for c in numeric_columns(profile) if c not in exclude]]
+    distinct_ratio = candidates['Approx_Distinct'] / candidates['Count'].clip(lower=1)
+    integer_valued = candidates['Dtype'].str.startswith(('int', 'uint', 'Int', 'UInt'))
+    looks_like_id = (distinct_ratio >= _ID_DISTINCT_RATIO) & integer_valued
+    constant = candidates['Approx_Distinct'] <= 1
+    score = looks_like_id.astype(int) * 2 + constant.astype(int)
+    order = np.argsort(score.to_numpy(), kind='stable')
+    return candidates.index[order].tolist()
+
+
+def suggest_stratum_columns(profile: pd.DataFrame, exclude: Optional[List[str]] = None,
+                            max_levels: int = MAX_STRATUM_LEVELS) -> List[str]:
+    """
+    Columns usable for post-stratification: between 2 and ``max_levels`` distinct values.
+
+    Text columns come before numeric ones, which are more often metrics than categories.
+    """
+    exclude = set(exclude or [])
+    candidates = profile.loc[[c for c in profile.index if c not in exclude]]
+    categorical = candidates['Approx_Distinct'].between(2, max_levels)
+    candidates = candidates[categorical]
+    order = np.argsort(candidates['Numeric'].to_numpy().astype(int), kind='stable')
+    return candidates.index[order].tolist()
+
+
+def describe_from_profile(profile: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """``DataFrame.describe()``-style table for numeric columns, built from the profile."""
+    columns = numeric_columns(profile) if columns is None else columns
+    table = profile.loc[columns, ['Count', 'Mean', 'Std', 'Min', 'P25', 'P50', 'P75', 'Max']]
+    table = table.rename(columns={'Count': 'count', 'Mean': 'mean', 'Std': 'std', 'Min': 'min',
+                                  'P25': '25%', 'P50': '50%', 'P75': '75%', 'Max': 'max'})
+    return table.T.astype(float)
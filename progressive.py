@@ -0,0 +1,157 @@
+"""
+Progressive analysis: an instant preview on a sample of units, refined to the exact result.
+
+Units are sampled by hashing their IDs into 100 buckets with the ``apollo_bucket`` scheme,
+under a fixed name of its own, so the sample does not depend on (and is balanced across)
+the experiment's own assignment, and every unit of a duplicated ID falls on the same side.
+The sample of a stage is every unit with a bucket below its percentage, so samples are
+nested: each stage adds units to the previous one.
+
+The first stage runs in the caller's thread and is returned straight away; the remaining
+stages, the last being the full dataset, run one after another on a background thread and
+replace ``latest`` as each one finishes. Sample results carry a ``Sample_Percent`` column;
+the exact results are those of an ordinary analysis. Sample results are computed from the
+sample alone, so their standard errors and confidence intervals are wider (by about
+``1/sqrt(percent/100)``) than those of the full data, as they should be.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from experiment_analysis import ExperimentAnalysis
+
+# Sampling hashes every unit ID once per dataset; SipHash-64 is the fastest backend
+SAMPLE_EXPERIMENT_NAME = '__progressive_sample__'
+SAMPLE_HASH_BACKEND = 'siphash64'
+# Percentages of units analysed by the successive stages; the last stage is always 100
+DEFAULT_STAGES = (1, 10, 100)
+# Sample stages with fewer rows than this are skipped: the next stage is fast enough anyway
+MIN_STAGE_ROWS = 50_000
+SAMPLE_PERCENT_COLUMN = 'Sample_Percent'
+
+# Refinement stages of all sessions share a few threads, so they cannot take over the server
+_REFINE_POOL = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 1) // 2),
+                                  thread_name_prefix='progressive')
+
+
+def sample_buckets(unit_ids: Union[pd.Series, np.ndarray],
+                   experiment_name: str = SAMPLE_EXPERIMENT_NAME,
+                   hash_backend: str = SAMPLE_HASH_BACKEND) -> np.ndarray:
+    """
+    Sampling bucket (0-99) of each row's unit; units with a bucket below p form a p% sample.
+
+    Args:
+        unit_ids (pd.Series/np.ndarray): Unit ID of each row
+        experiment_name (str): Name hashed with the IDs; keep it different from the experiment's
+        hash_backend (str): Hashing backend ('sha1', 'blake2b' or 'siphash64')
+
+    Returns:
+        np.ndarray: uint8 buckets in row order
+    """
+    return ExperimentAnalysis.bucket_array(experiment_name, unit_ids, hash_backend)
+
+
+def plan_stages(buckets: np.ndarray, stages: Sequence[int] = DEFAULT_STAGES,
+                min_rows: int = MIN_STAGE_ROWS) -> Tuple[int, ...]:
+    """
+    The stages worth running for a dataset: sample stages with at least ``min_rows`` rows, then 100.
+
+    Args:
+        buckets (np.ndarray): Sampling bucket of each row, from ``sample_buckets``
+        stages (Sequence[int]): Candidate percentages (1-100)
+        min_rows (int): Fewest rows a sample stage must have
+
+    Returns:
+        Tuple[int, ...]: Increasing percentages ending with 100
+    """
+    if any(not 1 <= percent <= 100 for percent in stages):
+        raise ValueError("Stage percentages must be between 1 and 100")
+    rows_below = np.cumsum(np.bincount(buckets, minlength=100))
+    return tuple(sorted(percent for percent in set(stages)
+                        if percent < 100 and rows_below[percent - 1] >= min_rows)) + (100,)
+
+
+class ProgressiveAnalysis:
+    """
+    Results of an analysis that are refined from a sample preview to the full data.
+
+    ``run_tests`` receives the rows of a stage (the data itself for the last stage) and
+    returns its results; it runs outside the caller's thread for every stage but the first,
+    so it must not touch UI or session state.
+    """
+
+    def __init__(self, data: pd.DataFrame, run_tests: Callable[[pd.DataFrame], pd.DataFrame],
+                 buckets: np.ndarray, stages: Optional[Sequence[int]] = None):
+        if len(buckets) != len(data):
+            raise ValueError("Sampling buckets must have one entry per row")
+        self.data = data
+        self.run_tests = run_tests
+        self.buckets = buckets
+        self.stages = plan_stages(buckets) if stages is None else plan_stages(buckets, stages, 0)
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._latest: Tuple[Optional[int], Optional[pd.DataFrame]] = (None, None)
+        self._error: Optional[BaseException] = None
+        self._future = None
+
+    def _run_stage(self, percent: int) -> pd.DataFrame:
+        rows = self.data if percent == 100 else self.data[self.buckets < percent]
+        results = self.run_tests(rows)
+        if percent < 100:
+            results.insert(0, SAMPLE_PERCENT_COLUMN, percent)
+        with self._lock:
+            self._latest = (percent, results)
+        return results
+
+    def _refine(self, stages: Tuple[int, ...]):
+        try:
+            for percent in stages:
+                if self._cancelled.is_set():
+                    return
+                self._run_stage(percent)
+        except Exception as e:
+            with self._lock:
+                self._error = e
+
+    def start(self) -> pd.DataFrame:
+        """
+        Run the first stage, then the rest in the background.
+
+        Returns:
+            pd.DataFrame: Results of the first stage (the exact results when it is the only one)
+
+        Raises:
+            Whatever ``run_tests`` raises on the first stage
+        """
+        results = self._run_stage(self.stages[0])
+        if len(self.stages) > 1:
+            self._future = _REFINE_POOL.submit(self._refine, self.stages[1:])
+        return results
+
+    def latest(self) -> Tuple[Optional[int], Optional[pd.DataFrame]]:
+        """The most refined results so far, with the percentage of units they are based on."""
+        with self._lock:
+            return self._latest
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """The exception a background stage raised, if any."""
+        with self._lock:
+            return self._error
+
+    @property
+    def done(self) -> bool:
+        """Whether no more refinement will happen: exact results, an error, or cancelled."""
+        with self._lock:
+            finished = self._latest[0] == 100 or self._error is not None
+        return finished or (self._cancelled.is_set() and (self._future is None or self._future.done()))
+
+    def cancel(self):
+        """Stop refining after the running stage; a stage not yet started is dropped."""
+        self._cancelled.set()
+        if self._future is not None:
+            self._future.cancel()
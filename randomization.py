@@ -0,0 +1,178 @@
+"""
+Bucket-level randomization inference.
+
+Units are assigned to groups by whole ``apollo_bucket`` buckets, so re-assigning the
+buckets of two groups at random is a valid randomization test. Every metric is first
+reduced to per-bucket totals (one pass over the data); each permutation then only sums
+at most 100 bucket totals, and permutations are evaluated in batches as NumPy matrix
+operations. The cost therefore does not depend on the number of units, and the test
+makes no normality or variance assumption, which suits ratio and heavy-tailed metrics.
+"""
+import itertools
+import math
+from typing import Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+N_BUCKETS = 100
+DEFAULT_PERMUTATIONS = 10000
+# Permutations evaluated per matrix operation
+_BATCH_SIZE = 8192
+
+
+def bucket_totals(buckets: Union[pd.Series, np.ndarray], values: Union[pd.Series, np.ndarray],
+                  n_buckets: int = N_BUCKETS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum and count of the non-null values in every bucket.
+
+    Args:
+        buckets (array-like): Bucket number (0 to n_buckets-1) of each row
+        values (array-like): Metric value of each row
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Per-bucket sums and counts, each of length n_buckets
+    """
+    buckets = np.asarray(buckets, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if not valid.all():
+        buckets, values = buckets[valid], values[valid]
+    sums = np.bincount(buckets, weights=values, minlength=n_buckets)
+    counts = np.bincount(buckets, minlength=n_buckets).astype(np.float64)
+    return sums, counts
+
+
+def group_buckets(buckets: Union[pd.Series, np.ndarray], groups: Union[pd.Series, np.ndarray],
+                  n_buckets: int = N_BUCKETS) -> dict:
+    """
+    Buckets belonging to each group.
+
+    Raises:
+        ValueError: If a bucket holds units of more than one group, in which case
+            assignment was not by whole buckets and the randomization test is invalid
+    """
+    pairs = pd.DataFrame({'bucket': np.asarray(buckets), 'group': np.asarray(groups)}).drop_duplicates()
+    if pairs['bucket'].duplicated().any():
+        mixed = sorted(pairs.loc[pairs['bucket'].duplicated(), 'bucket'].unique().tolist())
+        raise ValueError(f"Buckets {mixed[:5]} contain more than one group; "
+                         "randomization inference requires assignment by whole buckets")
+    if not pairs['bucket'].between(0, n_buckets - 1).all():
+        raise ValueError(f"Bucket numbers must be between 0 and {n_buckets - 1}")
+    return {group: np.sort(rows['bucket'].to_numpy(dtype=np.int64)) for group, rows in pairs.groupby('group')}
+
+
+def _ratio_difference(numerator: np.ndarray, denominator: np.ndarray,
+                      treated: np.ndarray, total_numerator: float, total_denominator: float) -> np.ndarray:
+    # treated: (n_permutations, n_treated) bucket positions; control is the rest of the pool
+    treated_numerator = numerator[treated].sum(axis=1)
+    treated_denominator = denominator[treated].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (treated_numerator / treated_denominator
+                - (total_numerator - treated_numerator) / (total_denominator - treated_denominator))
+
+
+def _random_assignments(rng: np.random.Generator, n_pool: int, n_treated: int, size: int) -> np.ndarray:
+    return rng.random((size, n_pool)).argsort(axis=1)[:, :n_treated]
+
+
+def randomization_test(numerator: np.ndarray, denominator: np.ndarray,
+                       treated_buckets: Sequence[int], control_buckets: Sequence[int],
+                       alternative: str = 'two-sided', n_permutations: int = DEFAULT_PERMUTATIONS,
+                       random_state: Union[int, None] = 0) -> Tuple[float, float, int]:
+    """
+    Randomization p-value of a difference of ratios of bucket totals.
+
+    The statistic is ``sum(numerator) / sum(denominator)`` over the treated buckets minus
+    the same over the control buckets: a difference in means when the denominator holds
+    unit counts, or in ratio metrics when it holds the ratio's denominator totals. When the
+    buckets can be split in at most ``n_permutations`` ways, all splits are enumerated and
+    the p-value is exact.
+
+    Args:
+        numerator (np.ndarray): Per-bucket numerator totals (see ``bucket_totals``)
+        denominator (np.ndarray): Per-bucket denominator totals
+        treated_buckets (sequence of int): Buckets of the treatment group
+        control_buckets (sequence of int): Buckets of the control group
+        alternative (str): 'two-sided', 'less', or 'greater'
+        n_permutations (int): Number of random re-assignments
+        random_state (int, optional): Seed of the permutations
+
+    Returns:
+        Tuple[float, float, int]: Observed difference, p-value and number of assignments evaluated
+    """
+    if alternative not in ('two-sided', 'less', 'greater'):
+        raise ValueError(f"Unsupported alternative: {alternative}")
+    if n_permutations < 1:
+        raise ValueError("n_permutations must be positive")
+    treated_buckets = np.asarray(treated_buckets, dtype=np.int64)
+    control_buckets = np.asarray(control_buckets, dtype=np.int64)
+    if len(treated_buckets) == 0 or len(control_buckets) == 0:
+        raise ValueError("Both groups need at least one bucket")
+
+    pool = np.concatenate([treated_buckets, control_buckets])
+    numerator = np.asarray(numerator, dtype=np.float64)[pool]
+    denominator = np.asarray(denominator, dtype=np.float64)[pool]
+    total_numerator, total_denominator = numerator.sum(), denominator.sum()
+    n_treated = len(treated_buckets)
+    observed = float(_ratio_difference(numerator, denominator, np.arange(n_treated)[None, :],
+                                       total_numerator, total_denominator)[0])
+    # Assignments that tie with the observed one up to rounding count as extreme
+    tolerance = 1e-9 * max(abs(observed), np.finfo(np.float64).tiny)
+
+    def n_extreme(differences: np.ndarray) -> int:
+        if alternative == 'greater':
+            return int(np.count_nonzero(differences >= observed - tolerance))
+        if alternative == 'less':
+            return int(np.count_nonzero(differences <= observed + tolerance))
+        return int(np.count_nonzero(np.abs(differences) >= abs(observed) - tolerance))
+
+    n_splits = math.comb(len(pool), n_treated)
+    if n_splits <= n_permutations:
+        # Exact: enumerate every split (the observed one included)
+        splits = np.array(list(itertools.combinations(range(len(pool)), n_treated)), dtype=np.int64)
+        extreme = n_extreme(_ratio_difference(numerator, denominator, splits, total_numerator, total_denominator))
+        return observed, extreme / n_splits, n_splits
+
+    rng = np.random.default_rng(random_state)
+    extreme = 0
+    for start in range(0, n_permutations, _BATCH_SIZE):
+        size = min(_BATCH_SIZE, n_permutations - start)
+        treated = _random_assignments(rng, len(pool), n_treated, size)
+        extreme += n_extreme(_ratio_difference(numerator, denominator, treated, total_numerator, total_denominator))
+    # The observed assignment is itself one of the possible assignments
+    return observed, (extreme + 1) / (n_permutations + 1), n_permutations
+
+
+def metric_bucket_totals(data: pd.DataFrame, bucket_col: str, metric: str,
+                         metric_type: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-bucket numerator and denominator of a metric, computed once and shared by all comparisons.
+
+    Args:
+        data (pd.DataFrame): Dataset with a bucket column
+        bucket_col (str): Column with bucket numbers
+        metric (str): Metric name; ratio metrics are given as 'numerator/denominator'
+        metric_type (str): 'mean', 'proportion' or 'ratio'
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Per-bucket numerator and denominator totals
+    """
+    buckets = data[bucket_col]
+    if metric_type == 'ratio':
+        x_var, y_var = metric.split('/')
+        numerator, _ = bucket_totals(buckets, data[x_var])
+        denominator, _ = bucket_totals(buckets, data[y_var])
+        return numerator, denominator
+    if metric_type in ('mean', 'proportion'):
+        return bucket_totals(buckets, data[metric])
+    raise ValueError(f"Randomization inference is not supported for metric type: {metric_type}")
+
+
+def treated_and_control_buckets(buckets_by_group: dict, treated_label: str,
+                                control_label: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Buckets of a treatment and the control group; ValueError if either has none."""
+    missing = [label for label in (treated_label, control_label) if label not in buckets_by_group]
+    if missing:
+        raise ValueError(f"No buckets found for group(s): {', '.join(map(str, missing))}")
+    return buckets_by_group[treated_label], buckets_by_group[control_label]
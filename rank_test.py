@@ -0,0 +1,213 @@
+"""
+Mann-Whitney U test from per-group sorted value counts.
+
+The values of a metric are sorted once per group and run-length encoded into distinct
+values with counts; this is the rank information of every group, computed once per metric
+and shared by all treatment-versus-control comparisons. A comparison merges the two
+groups' sorted runs (a stable sort of two presorted runs is a linear merge) and gets the
+U statistic and the tie correction from cumulative counts, without ranking the pooled
+values again.
+
+For data that does not fit in memory, ``RankHistogram`` counts chunks into fixed bins
+(e.g. quantile edges from a ``QuantileSketch``) instead; values in the same bin are then
+treated as ties, which the tie correction accounts for. Discrete metrics such as counts
+of sessions or clicks are exact when every distinct value gets its own bin.
+"""
+from typing import Dict, Hashable, Iterable, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from sketches import QuantileSketch
+
+DEFAULT_HISTOGRAM_BINS = 4096
+
+
+def _run_lengths(ordered: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct values and their counts of a sorted array."""
+    if len(ordered) == 0:
+        return ordered, np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], ordered[1:] != ordered[:-1]]))
+    return ordered[starts], np.diff(np.append(starts, len(ordered)))
+
+
+def _ties(counts: np.ndarray) -> float:
+    return float(np.sum(counts ** 3 - counts))
+
+
+class RankCounts:
+    """
+    Distinct values and their counts for each group.
+
+    Args:
+        groups (dict): Group label -> (ascending distinct values, count of each value)
+        exact (bool): False when values are histogram bins rather than distinct values
+    """
+
+    def __init__(self, groups: Dict[Hashable, Tuple[np.ndarray, np.ndarray]], exact: bool = True):
+        self.groups = groups
+        self.exact = exact
+
+    @classmethod
+    def from_values(cls, values: Union[pd.Series, np.ndarray],
+                    groups: Union[pd.Series, np.ndarray]) -> 'RankCounts':
+        """Exact counts of in-memory data; NaNs and rows without a group are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        codes, labels = pd.factorize(np.asarray(groups), use_na_sentinel=True)
+        valid = ~np.isnan(values) & (codes >= 0)
+        values, codes = values[valid], codes[valid]
+        return cls({label: _run_lengths(np.sort(values[codes == code])) for code, label in enumerate(labels)})
+
+    def median(self, group: Hashable) -> float:
+        """Median of a group (from the bins' lower edges for histograms); NaN without values."""
+        if group not in self.groups:
+            return np.nan
+        cell_values, counts = self.groups[group]
+        total = int(counts.sum())
+        if total == 0:
+            return np.nan
+        middle = np.searchsorted(np.cumsum(counts), [(total - 1) // 2, total // 2], side='right')
+        return float(cell_values[middle].mean())
+
+    def _u_statistic(self, treated: Hashable, control: Hashable) -> Tuple[float, float, float, float]:
+        """U of the treatment group, group sizes and the sum of t**3 - t over pooled ties."""
+        treated_values, treated_counts = self.groups[treated]
+        control_values, control_counts = self.groups[control]
+        # Merging the two sorted runs; control runs first, so on equal values control comes first
+        order = np.argsort(np.concatenate([control_values, treated_values]), kind='stable')
+        merged_position = np.flatnonzero(order >= len(control_values))
+        # Control runs merged before each treated run; the last of them may hold the same value
+        control_before = merged_position - np.arange(len(treated_values))
+        control_through = np.concatenate([[0], np.cumsum(control_counts)])[control_before].astype(np.float64)
+        last = np.maximum(control_before - 1, 0)
+        same = (control_before > 0) & (control_values[last] == treated_values)
+        equal = np.where(same, control_counts[last], 0).astype(np.float64)
+        treated_weight = treated_counts.astype(np.float64)
+
+        # Control values below each treated value count fully, equal ones count half
+        u1 = float(np.sum(treated_weight * (control_through - 0.5 * equal)))
+        ties = _ties(treated_weight + equal) + _ties(control_counts.astype(np.float64)) - _ties(equal)
+        return u1, float(treated_weight.sum()), float(control_counts.sum()), ties
+
+    def mann_whitney(self, treated: Hashable, control: Hashable,
+                     alternative: str = 'two-sided') -> Tuple[float, float, float, float]:
+        """
+        Tie-corrected Mann-Whitney U test of a treatment group against the control group.
+
+        Uses the normal approximation with continuity correction, as
+        ``scipy.stats.mannwhitneyu(method='asymptotic')`` does.
+
+        Args:
+            treated (hashable): Treatment group label
+            control (hashable): Control group label
+            alternative (str): 'two-sided', 'less', or 'greater' (treatment vs. control)
+
+        Returns:
+            Tuple[float, float, float, float]: U statistic of the treatment group, z score,
+                p-value and standard error of U; all NaN when either group has no
+                non-missing value
+        """
+        if alternative not in ('two-sided', 'less', 'greater'):
+            raise ValueError(f"Unsupported alternative: {alternative}")
+        # Groups without values (histograms only know groups they have counted) cannot be
+        # compared; like the t-tests, this gives NaN rather than failing the other comparisons
+        if any(label not in self.groups or len(self.groups[label][0]) == 0 for label in (treated, control)):
+            return np.nan, np.nan, np.nan, np.nan
+        u1, n1, n2, ties = self._u_statistic(treated, control)
+        n = n1 + n2
+        mean = n1 * n2 / 2
+        tie_term = ties / (n * (n - 1)) if n > 1 else 0.0
+        std_error = float(np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term)))
+        if std_error == 0:
+            return u1, 0.0, 1.0, 0.0
+
+        if alternative == 'two-sided':
+            z = (abs(u1 - mean) - 0.5) / std_error
+            p_value = min(1.0, 2 * stats.norm.sf(z))
+            z = np.sign(u1 - mean) * z
+        elif alternative == 'greater':
+            z = (u1 - mean - 0.5) / std_error
+            p_value = stats.norm.sf(z)
+        else:
+            z = (u1 - mean + 0.5) / std_error
+            p_value = stats.norm.cdf(z)
+        return u1, float(z), float(p_value), std_error
+
+
+class RankHistogram:
+    """
+    Mergeable per-group histogram over fixed bin edges, for data read in chunks.
+
+    Args:
+        edges (np.ndarray): Ascending inner bin edges; bin i holds values in
+            [edges[i-1], edges[i]), with open-ended first and last bins
+    """
+
+    def __init__(self, edges: np.ndarray):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self._counts: Dict[Hashable, np.ndarray] = {}
+
+    def update(self, values: Union[pd.Series, np.ndarray], groups: Union[pd.Series, np.ndarray]):
+        """Add a chunk of values with their group labels; NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        groups = np.asarray(groups)
+        valid = ~np.isnan(values)
+        bins = np.searchsorted(self.edges, values[valid], side='right')
+        codes, labels = pd.factorize(groups[valid])
+        n_bins = len(self.edges) + 1
+        for code, label in enumerate(labels):
+            counts = np.bincount(bins[codes == code], minlength=n_bins)
+            if label in self._counts:
+                self._counts[label] += counts
+            else:
+                self._counts[label] = counts
+
+    def merge(self, other: 'RankHistogram') -> 'RankHistogram':
+        """Fold another histogram with the same edges into this one."""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Histograms with different edges cannot be merged")
+        for label, counts in other._counts.items():
+            self._counts[label] = self._counts[label] + counts if label in self._counts else counts.copy()
+        return self
+
+    def rank_counts(self) -> RankCounts:
+        """Counts per non-empty bin, each bin represented by its lower edge."""
+        edges = self.edges
+        # The open first bin sits just below the first edge so it stays a bin of its own
+        lower = np.concatenate([[np.nextafter(edges[0], -np.inf)], edges]) if len(edges) else np.zeros(1)
+        groups = {}
+        for label, counts in self._counts.items():
+            nonzero = np.flatnonzero(counts)
+            groups[label] = (lower[nonzero], counts[nonzero])
+        return RankCounts(groups, exact=False)
+
+
+def histogram_edges(sketch: QuantileSketch, n_bins: int = DEFAULT_HISTOGRAM_BINS) -> np.ndarray:
+    """
+    Bin edges for a metric summarized by a sketch.
+
+    When the sketch holds at most ``n_bins`` distinct values (``retained_values``), each
+    of them starts a bin of its own, so a discrete metric whose values were all retained
+    is counted exactly. Values too rare to be retained by the sketch (fewer than about
+    ``count / k`` occurrences) share the bin of the next smaller retained value. Otherwise
+    the edges are evenly spaced quantiles; quantiles that coincide collapse into one edge.
+    """
+    distinct = sketch.retained_values()
+    if len(distinct) <= n_bins:
+        return distinct
+    return np.unique(sketch.quantile(np.linspace(0, 1, n_bins + 1)[1:-1]))
+
+
+def rank_counts_from_chunks(chunks: Iterable[Tuple[Union[pd.Series, np.ndarray], Union[pd.Series, np.ndarray]]],
+                            edges: np.ndarray) -> RankCounts:
+    """
+    Approximate rank counts of data read in chunks of (values, groups).
+
+    The edges have to be known before the pass, e.g. from ``histogram_edges`` over a sketch
+    collected by an earlier profiling pass.
+    """
+    histogram = RankHistogram(edges)
+    for values, groups in chunks:
+        histogram.update(values, groups)
+    return histogram.rank_counts()
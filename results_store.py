@@ -0,0 +1,311 @@
+"""
+Local warehouse of statistical test results.
+
+Every ``run_statistical_tests`` output recorded here is kept in an embedded SQLite
+database together with the configuration that produced it and the fingerprint of the
+dataset. Result rows carry the experiment name and run time of their run, and are indexed
+by (metric, run time) and (experiment, metric, run time), so questions such as "how often
+was metric X significant in AA runs over the last 90 days" are answered by one indexed
+aggregate query however many runs have been stored.
+
+Layout::
+
+    runs     one row per recorded run: experiment, time, dataset fingerprint, JSON config
+    results  one row per (run, treatment group, metric)
+"""
+import json
+import os
+import sqlite3
+import uuid
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RESULTS_DB = os.environ.get(
+    'AA_RESULTS_DB',
+    os.path.join(os.path.expanduser('~'), '.cache', 'aa_analysis', 'results.sqlite')
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    experiment TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    dataset_fingerprint TEXT,
+    n_rows INTEGER,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    experiment TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    treatment_group TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    metric_type TEXT,
+    treatment_value REAL,
+    control_value REAL,
+    absolute_diff REAL,
+    relative_diff REAL,
+    statistic REAL,
+    p_value REAL,
+    p_value_adjusted REAL,
+    correction TEXT,
+    ci_lower REAL,
+    ci_upper REAL,
+    significant INTEGER NOT NULL,
+    srm INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_experiment_time ON runs (experiment, created_at);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (created_at);
+CREATE INDEX IF NOT EXISTS results_metric_time ON results (metric, created_at);
+CREATE INDEX IF NOT EXISTS results_experiment_metric_time ON results (experiment, metric, created_at);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id);
+"""
+
+# Columns added to the results table after its first release, added to older databases on open
+_ADDED_RESULT_COLUMNS = {'p_value_adjusted': 'REAL', 'correction': 'TEXT'}
+
+# Columns of ``run_statistical_tests`` output -> results table columns
+_RESULT_COLUMNS = {
+    'Treatment_Group': 'treatment_group',
+    'Metric': 'metric',
+    'Treatment_Value': 'treatment_value',
+    'Control_Value': 'control_value',
+    'Absolute_Diff': 'absolute_diff',
+    'Relative_Diff': 'relative_diff',
+    'T_Statistic': 'statistic',
+    'P_Value': 'p_value',
+}
+
+
+def _timestamp(moment: datetime) -> str:
+    # ISO-8601 in UTC sorts lexicographically in time order, so the indexes serve range queries
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _float(value) -> Optional[float]:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(value) else value
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+class ResultsStore:
+    """Embedded SQLite store of recorded test results."""
+
+    def __init__(self, path: str = DEFAULT_RESULTS_DB):
+        self.path = path
+        self._keepalive = None
+        if path == ':memory:':
+            # A shared in-memory database lives as long as one connection to it stays open
+            self._uri = f'file:aa_results_{uuid.uuid4().hex}?mode=memory&cache=shared'
+            self._keepalive = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._uri = None
+        with closing(self._connect()) as connection, connection:
+            if self._keepalive is None:
+                connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+            existing = {row[1] for row in connection.execute('PRAGMA table_info(results)')}
+            for column, column_type in _ADDED_RESULT_COLUMNS.items():
+                if column not in existing:
+                    connection.execute(f'ALTER TABLE results ADD COLUMN {column} {column_type}')
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call, so Streamlit sessions on different threads never share one
+        if self._uri is not None:
+            connection = sqlite3.connect(self._uri, uri=True, timeout=30)
+        else:
+            connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA foreign_keys=ON')
+        return connection
+
+    def record_run(self, results: pd.DataFrame, experiment: str, config: Optional[Dict] = None,
+                   dataset_fingerprint: Optional[str] = None, n_rows: Optional[int] = None,
+                   metric_types: Optional[Dict[str, str]] = None, correction: Optional[str] = None,
+                   created_at: Optional[datetime] = None) -> str:
+        """
+        Store one ``run_statistical_tests`` output.
+
+        Args:
+            results (pd.DataFrame): Output of ``run_statistical_tests``
+            experiment (str): Experiment (or AA check) name the run belongs to
+            config (dict, optional): Parameters of the run, stored as JSON
+            dataset_fingerprint (str, optional): Content hash of the analysed dataset
+            n_rows (int, optional): Number of rows analysed
+            metric_types (dict, optional): Metric -> metric type
+            correction (str, optional): Multiple-comparison correction of the run, whose
+                'P_Value_Adjusted' column is then stored next to the raw p-value
+            created_at (datetime, optional): Run time; defaults to now (UTC)
+
+        Returns:
+            str: ID of the recorded run
+        """
+        missing = [column for column in list(_RESULT_COLUMNS) + ['Significance'] if column not in results.columns]
+        if missing:
+            raise ValueError(f"Results are missing column(s): {', '.join(missing)}")
+        run_id = uuid.uuid4().hex
+        timestamp = _timestamp(created_at or datetime.now(timezone.utc))
+        metric_types = metric_types or {}
+
+        rows = []
+        for record in results.to_dict('records'):
+            if 'CI_Lower' in record:
+                lower, upper = record['CI_Lower'], record['CI_Upper']
+            else:
+                # Results from before CI_Lower/CI_Upper held the interval as a list
+                interval = record.get('Confidence_Interval')
+                lower, upper = (interval[0], interval[1]) if isinstance(interval, (list, tuple)) else (None, None)
+            srm = record.get('SRM_Check')
+            rows.append((
+                run_id, experiment, timestamp, str(record['Treatment_Group']), str(record['Metric']),
+                metric_types.get(record['Metric']),
+                *(_float(record[column]) for column in list(_RESULT_COLUMNS)[2:]),
+                _float(record.get('P_Value_Adjusted')), correction if 'P_Value_Adjusted' in record else None,
+                _float(lower), _float(upper),
+                int(record['Significance'] == '显著'),
+                None if srm is None else int(srm != '正常'),
+            ))
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT INTO runs (run_id, experiment, created_at, dataset_fingerprint, n_rows, config) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (run_id, experiment, timestamp, dataset_fingerprint, n_rows,
+                 json.dumps(config or {}, ensure_ascii=False, default=_json_default))
+            )
+            connection.executemany(
+                'INSERT INTO results (run_id, experiment, created_at, treatment_group, metric, metric_type, '
+                'treatment_value, control_value, absolute_diff, relative_diff, statistic, p_value, '
+                'p_value_adjusted, correction, ci_lower, ci_upper, significant, srm) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+        return run_id
+
+    def _query(self, sql: str, params: List) -> pd.DataFrame:
+        with closing(self._connect()) as connection:
+            return pd.read_sql_query(sql, connection, params=params)
+
+    @staticmethod
+    def _filters(experiment: Optional[str], metric: Optional[str], days: Optional[float],
+                 now: Optional[datetime]) -> tuple:
+        clauses, params = [], []
+        if experiment is not None:
+            clauses.append('experiment = ?')
+            params.append(experiment)
+        if metric is not None:
+            clauses.append('metric = ?')
+            params.append(metric)
+        if days is not None:
+            clauses.append('created_at >= ?')
+            params.append(_timestamp((now or datetime.now(timezone.utc)) - timedelta(days=days)))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    @staticmethod
+    def _significant(alpha: Optional[float]) -> tuple:
+        # The stored flag, or the p-value the run's significance was based on (the corrected one
+        # when the run used a correction) compared with alpha
+        if alpha is None:
+            return 'significant', []
+        return 'CASE WHEN COALESCE(p_value_adjusted, p_value) < ? THEN 1 ELSE 0 END', [alpha]
+
+    def false_positive_rates(self, metric: Optional[str] = None, experiment: Optional[str] = None,
+                             days: Optional[float] = 90, alpha: Optional[float] = None,
+                             exclude_srm: bool = False, now: Optional[datetime] = None) -> pd.DataFrame:
+        """
+        Share of significant results per metric, i.e. the false positive rate of AA runs.
+
+        Args:
+            metric (str, optional): Only this metric
+            experiment (str, optional): Only runs of this experiment
+            days (float, optional): Only runs of the last ``days`` days; None for all
+            alpha (float, optional): Count results as significant when their p-value (the
+                corrected one for runs with a multiple-comparison correction) is below ``alpha``,
+                instead of using the significance stored with each result
+            exclude_srm (bool): Leave out results of runs with a sample ratio mismatch
+            now (datetime, optional): End of the time window; defaults to now
+
+        Returns:
+            pd.DataFrame: Per metric 'Tests', 'Significant', 'FPR', 'Runs', 'First_Run' and 'Last_Run'
+        """
+        where, params = self._filters(experiment, metric, days, now)
+        if exclude_srm:
+            where += (' AND ' if where else ' WHERE ') + '(srm IS NULL OR srm = 0)'
+        significant, significant_params = self._significant(alpha)
+        params = significant_params + params
+        table = self._query(
+            f'SELECT metric AS Metric, COUNT(*) AS Tests, SUM({significant}) AS Significant, '
+            f'COUNT(DISTINCT run_id) AS Runs, MIN(created_at) AS First_Run, MAX(created_at) AS Last_Run '
+            f'FROM results{where} GROUP BY metric ORDER BY metric',
+            params
+        )
+        table['Significant'] = table['Significant'].fillna(0).astype(int)
+        table['FPR'] = table['Significant'] / table['Tests']
+        return table[['Metric', 'Tests', 'Significant', 'FPR', 'Runs', 'First_Run', 'Last_Run']].set_index('Metric')
+
+    def runs(self, experiment: Optional[str] = None, days: Optional[float] = None,
+             limit: int = 500) -> pd.DataFrame:
+        """Recorded runs, newest first."""
+        where, params = self._filters(experiment, None, days, None)
+        runs = self._query(
+            f'SELECT run_id, experiment, created_at, dataset_fingerprint, n_rows, config '
+            f'FROM runs{where} ORDER BY created_at DESC LIMIT ?',
+            params + [limit]
+        )
+        runs['config'] = runs['config'].map(json.loads)
+        return runs
+
+    def results(self, run_id: Optional[str] = None, metric: Optional[str] = None,
+                experiment: Optional[str] = None, days: Optional[float] = None) -> pd.DataFrame:
+        """Stored result rows, newest first."""
+        where, params = self._filters(experiment, metric, days, None)
+        if run_id is not None:
+            where += (' AND ' if where else ' WHERE ') + 'run_id = ?'
+            params.append(run_id)
+        return self._query(f'SELECT * FROM results{where} ORDER BY created_at DESC', params)
+
+    def daily_significance(self, metric: str, experiment: Optional[str] = None,
+                           days: Optional[float] = 90, alpha: Optional[float] = None,
+                           exclude_srm: bool = False) -> pd.DataFrame:
+        """
+        Tests and significant results of a metric per day, for trend charts.
+
+        ``alpha`` and ``exclude_srm`` count significance as ``false_positive_rates`` does.
+        """
+        where, params = self._filters(experiment, metric, days, None)
+        if exclude_srm:
+            where += ' AND (srm IS NULL OR srm = 0)'
+        significant, significant_params = self._significant(alpha)
+        return self._query(
+            f'SELECT substr(created_at, 1, 10) AS Date, COUNT(*) AS Tests, SUM({significant}) AS Significant '
+            f'FROM results{where} GROUP BY Date ORDER BY Date',
+            significant_params + params
+        )
+
+    def metrics(self) -> List[str]:
+        return self._query('SELECT DISTINCT metric FROM results ORDER BY metric', [])['metric'].tolist()
+
+    def experiments(self) -> List[str]:
+        return self._query('SELECT DISTINCT experiment FROM runs ORDER BY experiment', [])['experiment'].tolist()
+
+    def delete_run(self, run_id: str):
+        """Remove a run and its results."""
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM results WHERE run_id = ?', (run_id,))
+            connection.execute('DELETE FROM runs WHERE run_id = ?', (run_id,))
+
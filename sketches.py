@@ -0,0 +1,263 @@
+"""
+Mergeable streaming sketches.
+
+Every sketch is updated chunk by chunk and sketches built over different parts of the
+data can be merged, so statistics over data that is never in memory at once (or is
+split over threads, processes or files) need a single pass and no full sort.
+"""
+from typing import Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+ArrayLike = Union[pd.Series, np.ndarray, Sequence]
+
+_HASH_KEY = 'aa_sketch_hashes'
+
+
+def hash_values(values: ArrayLike) -> np.ndarray:
+    """64-bit hashes of ``values`` (any dtype, including mixed object columns)."""
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values)
+    return pd.util.hash_pandas_object(values, index=False, hash_key=_HASH_KEY).to_numpy()
+
+
+def _sorted_unique(values: np.ndarray) -> np.ndarray:
+    # np.unique on uint64 takes a slow hash-table path in recent numpy versions.
+    values = np.sort(values)
+    return values[np.concatenate([[True], values[1:] != values[:-1]])] if len(values) else values
+
+
+class MomentSketch:
+    """Count, mean, variance, min and max, merged with Chan's parallel update."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.nan
+        self.max = np.nan
+
+    def update(self, values: ArrayLike):
+        """Add a chunk of values; NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        other = MomentSketch()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+        self.merge(other)
+
+    def merge(self, other: 'MomentSketch') -> 'MomentSketch':
+        """Fold another sketch into this one."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (ddof=1)."""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+
+class DistinctSketch:
+    """
+    K-minimum-values estimate of the number of distinct values.
+
+    Keeps the ``k`` smallest distinct 64-bit hashes; the count is exact while fewer than
+    ``k`` distinct values have been seen, and has a relative error of about 1/sqrt(k) after.
+    """
+
+    def __init__(self, k: int = 4096):
+        self.k = k
+        self._mins = np.empty(0, dtype=np.uint64)
+
+    def update(self, values: ArrayLike):
+        """Add a chunk of values (NaNs should be removed by the caller)."""
+        self.update_hashes(hash_values(values))
+
+    def update_hashes(self, hashes: np.ndarray):
+        """Add precomputed hashes from ``hash_values``."""
+        if len(self._mins) == self.k:
+            # Only hashes below the current k-th minimum can change the sketch.
+            hashes = hashes[hashes < self._mins[-1]]
+        if len(hashes) > self.k:
+            # Avoid sorting the whole chunk: the k smallest distinct hashes are at most
+            # the k-th smallest hash unless duplicates pushed some of them past it.
+            candidates = hashes[hashes <= np.partition(hashes, self.k - 1)[self.k - 1]]
+            if len(_sorted_unique(candidates)) >= self.k:
+                hashes = candidates
+        self._mins = _sorted_unique(np.concatenate([self._mins, hashes]))[:self.k]
+
+    def merge(self, other: 'DistinctSketch') -> 'DistinctSketch':
+        """Fold another sketch into this one."""
+        self.update_hashes(other._mins)
+        return self
+
+    @property
+    def is_exact(self) -> bool:
+        return len(self._mins) < self.k
+
+    @property
+    def relative_error(self) -> float:
+        """Standard error of ``estimate()`` relative to the true count."""
+        return 0.0 if self.is_exact else 1 / np.sqrt(self.k - 2)
+
+    def estimate(self) -> float:
+        """Estimated number of distinct values."""
+        if self.is_exact:
+            return float(len(self._mins))
+        return (self.k - 1) / (float(self._mins[-1]) / 2.0 ** 64)
+
+
+class QuantileSketch:
+    """
+    KLL-style quantile sketch with a rank error of roughly 1/k.
+
+    Level ``h`` holds items that each stand for ``2**h`` input values. A level that grows
+    beyond ``k`` items is sorted and every other item (from a random offset) is promoted to
+    the next level. A large chunk is sorted once and enters directly at the level where it
+    fits, which is the same as compacting it level by level.
+    """
+
+    def __init__(self, k: int = 2048, seed: int = 0):
+        self.k = k
+        self.count = 0
+        self.min = np.nan
+        self.max = np.nan
+        self._levels = [np.empty(0, dtype=np.float64)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: ArrayLike):
+        """Add a chunk of values; NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.min = np.nanmin([self.min, values.min()])
+        self.max = np.nanmax([self.max, values.max()])
+
+        level = 0
+        if len(values) > self.k:
+            level = int(np.ceil(np.log2(len(values) / self.k)))
+            stride = 2 ** level
+            values = np.sort(values)[self._rng.integers(stride)::stride]
+        self._add(level, values)
+        self._compact()
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """Fold another sketch into this one."""
+        if other.count == 0:
+            return self
+        self.count += other.count
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+        for level, items in enumerate(other._levels):
+            self._add(level, items)
+        self._compact()
+        return self
+
+    def _add(self, level: int, items: np.ndarray):
+        while len(self._levels) <= level:
+            self._levels.append(np.empty(0, dtype=np.float64))
+        self._levels[level] = np.concatenate([self._levels[level], items])
+
+    def _compact(self):
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                # An odd item out stays at this level so total weight is preserved.
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                paired = items[:len(items) - len(keep)]
+                self._levels[level] = keep
+                self._add(level + 1, paired[self._rng.integers(2)::2])
+            level += 1
+
+    def retained_values(self) -> np.ndarray:
+        """
+        Distinct values the sketch holds, with the exact min and max.
+
+        While no more than ``k`` values were added this is every distinct value; after that,
+        values too rare to survive compaction (fewer than about ``count / k`` occurrences)
+        may be missing.
+        """
+        if self.count == 0:
+            return np.empty(0, dtype=np.float64)
+        return np.unique(np.concatenate(self._levels + [np.array([self.min, self.max])]))
+
+    def quantile(self, q: Union[float, Sequence[float]]) -> Union[float, np.ndarray]:
+        """
+        Approximate quantile(s); ``q=0`` and ``q=1`` return the exact min and max.
+
+        Args:
+            q (float or sequence of float): Quantile(s) in [0, 1]
+
+        Returns:
+            float or np.ndarray: Value(s) at the requested quantile(s); NaN if empty
+        """
+        scalar = np.ndim(q) == 0
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.count == 0:
+            result = np.full(len(q), np.nan)
+            return float(result[0]) if scalar else result
+
+        items = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(items_h), 2.0 ** h) for h, items_h in enumerate(self._levels)])
+        order = np.argsort(items, kind='stable')
+        items, cum_weights = items[order], np.cumsum(weights[order])
+        pos = np.searchsorted(cum_weights, q * cum_weights[-1], side='left')
+        result = items[np.minimum(pos, len(items) - 1)]
+        result = np.where(q <= 0, self.min, np.where(q >= 1, self.max, result))
+        return float(result[0]) if scalar else result
+
+
+class MetricSketch:
+    """
+    Moments and quantiles of one metric, updated in a single pass.
+
+    NaNs are removed once per chunk and the same values feed both sketches, so e.g. the
+    mean, variance and a P99.9 cap of an out-of-core column come from one scan.
+    """
+
+    def __init__(self, k: int = 2048, seed: int = 0):
+        self.moments = MomentSketch()
+        self.quantiles = QuantileSketch(k, seed)
+
+    @property
+    def count(self) -> int:
+        return self.moments.count
+
+    def update(self, values: ArrayLike):
+        """Add a chunk of values; NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.moments.update(values)
+        self.quantiles.update(values)
+
+    def merge(self, other: 'MetricSketch') -> 'MetricSketch':
+        """Fold another sketch into this one."""
+        self.moments.merge(other.moments)
+        self.quantiles.merge(other.quantiles)
+        return self
@@ -0,0 +1,94 @@
+import pandas as pd
+import numpy as np
+from scipy import stats
+from typing import Dict, List, Optional, Sequence, Union
+
+# SRM checks are conventionally run at a much stricter level than the metric tests,
+# since a mismatch invalidates every downstream result.
+SRM_ALPHA = 0.001
+
+
+def srm_test(observed: Union[np.ndarray, pd.DataFrame],
+             expected_proportions: Union[Sequence[float], np.ndarray],
+             alpha: float = SRM_ALPHA) -> pd.DataFrame:
+    """
+    Chi-square goodness-of-fit test for sample ratio mismatch, vectorized over rows.
+
+    Each row of ``observed`` is one independent check (an experiment, a segment, a day,
+    a candidate salt, ...) and each column is a group. All rows are tested in a single
+    pass, so thousands of checks cost a handful of array operations.
+
+    Args:
+        observed (np.ndarray or pd.DataFrame): Group counts with shape (n_checks, n_groups)
+        expected_proportions (sequence or np.ndarray): Target proportions, either one row of
+            shape (n_groups,) shared by all checks or a matrix of shape (n_checks, n_groups).
+            Proportions are normalized, so percentages and fractions both work.
+        alpha (float): Significance level below which a check is flagged as SRM
+
+    Returns:
+        pd.DataFrame: One row per check with 'Total', 'Chi2', 'DoF', 'P_Value' and 'SRM'
+    """
+    index = observed.index if isinstance(observed, pd.DataFrame) else None
+    counts = np.atleast_2d(np.asarray(observed, dtype=np.float64))
+    expected_p = np.atleast_2d(np.asarray(expected_proportions, dtype=np.float64))
+    if expected_p.shape[-1] != counts.shape[1]:
+        raise ValueError("expected_proportions must have one entry per group column")
+    expected_p = expected_p / expected_p.sum(axis=1, keepdims=True)
+
+    totals = counts.sum(axis=1)
+    expected = totals[:, None] * expected_p
+    active = expected_p > 0
+
+    # Groups with zero target share drop out of the statistic; any unit landing in
+    # one of them is an outright mismatch.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cells = np.where(active, (counts - expected) ** 2 / expected, 0.0)
+    chi2 = cells.sum(axis=1)
+    dof = np.broadcast_to(active.sum(axis=1) - 1, chi2.shape)
+    p_value = stats.chi2.sf(chi2, np.maximum(dof, 1))
+    unexpected = np.where(active, 0.0, counts).sum(axis=1) > 0
+    p_value = np.where(unexpected, 0.0, p_value)
+    p_value = np.where(totals > 0, p_value, np.nan)
+
+    return pd.DataFrame({
+        'Total': totals.astype(np.int64),
+        'Chi2': chi2,
+        'DoF': dof,
+        'P_Value': p_value,
+        'SRM': p_value < alpha
+    }, index=index)
+
+
+def srm_check(data: pd.DataFrame, groupname: str,
+              group_proportions: Dict[str, float],
+              by: Optional[Union[str, List[str]]] = None,
+              alpha: float = SRM_ALPHA) -> pd.DataFrame:
+    """
+    Aggregate unit counts per group (and optional segments) and run ``srm_test`` on them.
+
+    Args:
+        data (pd.DataFrame): Unit-level data
+        groupname (str): Column name containing group labels
+        group_proportions (dict): Group name to target proportion (any positive scale)
+        by (str or List[str], optional): Segment column(s) such as day, platform or salt;
+            one check is run per segment combination
+        alpha (float): Significance level below which a check is flagged as SRM
+
+    Returns:
+        pd.DataFrame: Observed counts per group followed by the ``srm_test`` columns
+    """
+    groups = list(group_proportions.keys())
+    if by is None:
+        counts = data[groupname].value_counts().to_frame().T
+        counts.index = ['all']
+    else:
+        keys = [by] if isinstance(by, str) else list(by)
+        counts = data.groupby(keys + [groupname], observed=True).size().unstack(groupname, fill_value=0)
+
+    # Labels outside the configured allocation are kept so that they count as mismatch.
+    extra = [g for g in counts.columns if g not in group_proportions]
+    counts = counts.reindex(columns=groups + extra, fill_value=0)
+    expected = [group_proportions[g] for g in groups] + [0.0] * len(extra)
+
+    result = srm_test(counts, expected, alpha)
+    return pd.concat([counts, result], axis=1)
@@ -0,0 +1,304 @@
+"""
+Unit-ID normalization and duplicate-unit handling.
+
+IDs are formatted the way ``ExperimentAnalysis.apollo_bucket`` formats a single ID before
+hashing (numbers as ``'{:.0f}'``, anything else with ``str``), but a whole column at a
+time: integer and integral float columns are turned into fixed-width byte strings with
+array arithmetic, so no Python object is created per row. Duplicate units are found by
+hashing those byte strings and sorting the hashes, and then flagged, dropped or aggregated.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+ArrayLike = Union[pd.Series, np.ndarray, Sequence]
+
+DUPLICATE_POLICIES = ('flag', 'drop', 'aggregate')
+DUPLICATE_FLAG_COLUMN = 'is_duplicate_unit'
+
+# ASCII of 0000-9999 packed into one uint32 each, so four digits are written per lookup
+_DIGITS4 = np.array([list(b'%04d' % i) for i in range(10000)], dtype=np.uint8).view(np.uint32).ravel()
+_POW10 = np.array([10 ** k for k in range(20)], dtype=np.uint64)
+_INT64_LIMIT = 2.0 ** 63
+_FLOAT_EXACT_LIMIT = 2 ** 53
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _format_integers(values: np.ndarray) -> np.ndarray:
+    """Decimal representation of int64 values as a fixed-width bytes array."""
+    values = np.ascontiguousarray(values, dtype=np.int64)
+    n = len(values)
+    negative = values < 0
+    if negative.any():
+        # -(v + 1) cannot overflow, even for the smallest int64
+        magnitude = np.where(negative, -(values + 1), values).astype(np.uint64) + negative
+    else:
+        magnitude = values.view(np.uint64)
+    n_digits = np.maximum(np.searchsorted(_POW10, magnitude, side='right'), 1)
+
+    # Right-aligned digits in 4-digit words: magnitude = top * 1e16 + high * 1e8 + low
+    n_words = -(-int(n_digits.max()) // 4) if n else 1
+    words = np.empty((n, n_words), dtype=np.uint32)
+    rest = magnitude
+    if n_words > 4:
+        top = rest // np.uint64(10 ** 16)
+        rest = rest - top * np.uint64(10 ** 16)
+        words[:, -5] = _DIGITS4[top]
+    high = (rest // np.uint64(10 ** 8)).astype(np.uint32)
+    low = (rest - high.astype(np.uint64) * np.uint64(10 ** 8)).astype(np.uint32)
+    for column, part in ((-1, low), (-3, high)):
+        if n_words >= -column:
+            upper = part // np.uint32(10000)
+            words[:, column] = _DIGITS4[part - upper * np.uint32(10000)]
+            if n_words >= 1 - column:
+                words[:, column - 1] = _DIGITS4[upper]
+    digits = words.view(np.uint8)
+
+    # Left-align each distinct (sign, length) combination; real ID columns have very few.
+    width = 4 * n_words
+    max_length = int((n_digits + negative).max()) if n else 1
+    out = np.zeros((n, max_length), dtype=np.uint8)
+    combos = n_digits * 2 + negative
+    present = np.flatnonzero(np.bincount(combos))
+    for combo in present:
+        sign, length = int(combo % 2), int(combo // 2)
+        rows = np.flatnonzero(combos == combo) if len(present) > 1 else slice(None)
+        if sign:
+            out[rows, 0] = ord('-')
+        out[rows, sign:sign + length] = digits[rows, width - length:]
+    return out.view(f'S{max_length}').ravel()
+
+
+def _format_floats(values: np.ndarray, na_rep: str) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    rounded = np.rint(values)  # round half to even, like '{:.0f}'.format
+    in_range = np.abs(rounded) < _INT64_LIMIT  # False for NaN and inf
+    keys = _format_integers(np.where(in_range, rounded, 0).astype(np.int64))
+    special = ~in_range | ((rounded == 0) & np.signbit(values))
+    if special.any():
+        keys = keys.astype(object)
+        keys[special] = [na_rep.encode('utf-8') if np.isnan(x) else '{:.0f}'.format(x).encode('utf-8')
+                         for x in values[special]]
+        keys = np.array(keys.tolist(), dtype=bytes)
+    return keys
+
+
+def _format_missing(value) -> bytes:
+    return ('{:.0f}'.format(value) if isinstance(value, (int, float)) else str(value)).encode('utf-8')
+
+
+def _encode_objects(values: pd.Series, na_rep: Optional[str]) -> np.ndarray:
+    values = values.astype(object)
+    null = values.isna().to_numpy()
+    number = np.fromiter((isinstance(x, (int, float)) for x in values), dtype=bool, count=len(values)) & ~null
+    keys = np.empty(len(values), dtype=object)
+    if null.any():
+        if na_rep is None:
+            keys[null] = [_format_missing(x) for x in values[null]]
+        else:
+            keys[null] = na_rep.encode('utf-8')
+    if number.any():
+        numbers = values[number]
+        try:
+            keys[number] = _format_floats(numbers.to_numpy(dtype=np.float64), '').tolist()
+        except OverflowError:
+            keys[number] = ['{:.0f}'.format(x).encode('utf-8') for x in numbers]
+    other = ~(null | number)
+    if other.any():
+        keys[other] = values[other].astype(str).str.encode('utf-8').tolist()
+    return np.array(keys.tolist(), dtype=bytes)
+
+
+def encode_ids(ids: ArrayLike, na_rep: Optional[str] = '') -> np.ndarray:
+    """
+    Format IDs like ``apollo_bucket`` does and encode them as UTF-8 byte strings.
+
+    Args:
+        ids (pd.Series, np.ndarray or list): Unit identifiers (numeric, string or mixed)
+        na_rep (str, optional): Representation of missing IDs. None formats each missing
+            value as ``apollo_bucket`` would: 'nan' for NaN, 'None' for None, '<NA>' for pd.NA
+
+    Returns:
+        np.ndarray: Fixed-width bytes array (``dtype='S<n>'``) in input order
+    """
+    if not isinstance(ids, pd.Series):
+        # Inferring a dtype would turn None into NaN, which apollo_bucket formats differently
+        keep_missing = na_rep is None and (isinstance(ids, (list, tuple)) or getattr(ids, 'dtype', None) == object)
+        ids = pd.Series(ids, dtype=object if keep_missing else None)
+    dtype = ids.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return _format_integers(ids.to_numpy(dtype=np.int64))
+    if pd.api.types.is_integer_dtype(dtype) and not ids.hasnans:
+        # '{:.0f}' formats integers through float, which only changes values beyond 2**53.
+        values = ids.to_numpy()
+        if len(values) == 0 or (values.min() >= -_FLOAT_EXACT_LIMIT and values.max() <= _FLOAT_EXACT_LIMIT):
+            return _format_integers(values.astype(np.int64))
+    if pd.api.types.is_numeric_dtype(dtype):
+        if na_rep is None:
+            # Nullable extension dtypes hold pd.NA where numpy dtypes hold NaN
+            na_rep = 'nan' if isinstance(dtype, np.dtype) else str(pd.NA)
+        return _format_floats(ids.to_numpy(dtype=np.float64, na_value=np.nan), na_rep)
+    if len(ids) == 0:
+        return np.empty(0, dtype='S1')
+    return _encode_objects(ids, na_rep)
+
+
+def normalize_ids(ids: ArrayLike, na_rep: str = '') -> pd.Series:
+    """
+    Formatted IDs as strings, e.g. for the ``apollo_key`` column.
+
+    Args:
+        ids (pd.Series, np.ndarray or list): Unit identifiers (numeric, string or mixed)
+        na_rep (str): Representation of missing IDs
+
+    Returns:
+        pd.Series: String IDs, with the index of ``ids`` if it is a Series
+    """
+    keys = encode_ids(ids, na_rep)
+    index = ids.index if isinstance(ids, pd.Series) else None
+    width = keys.dtype.itemsize
+    if len(keys) and (keys.view(np.uint8) < 0x80).all():
+        # ASCII only (always true for numeric IDs): widen bytes to UCS-4 without decoding
+        text = keys.view(np.uint8).reshape(len(keys), width).astype(np.uint32).view(f'U{width}').ravel()
+        return pd.Series(text.astype(object), index=index, name=getattr(ids, 'name', None), dtype=object)
+    return pd.Series([key.decode('utf-8') for key in keys.tolist()], index=index,
+                     name=getattr(ids, 'name', None), dtype=object)
+
+
+def _hash_keys(keys: np.ndarray) -> np.ndarray:
+    """64-bit hashes of fixed-width byte strings, mixing 8 bytes at a time."""
+    width = -(-max(keys.dtype.itemsize, 1) // 8) * 8
+    words = np.ascontiguousarray(keys.astype(f'S{width}')).view(np.uint64).reshape(len(keys), width // 8)
+    hashes = np.full(len(keys), width, dtype=np.uint64)
+    for i in range(words.shape[1]):
+        hashes ^= words[:, i]
+        hashes *= _MIX
+        hashes ^= hashes >> np.uint64(31)
+    return hashes
+
+
+def duplicate_mask(keys: np.ndarray, keep: Union[str, bool] = False) -> np.ndarray:
+    """
+    Rows whose key occurs more than once.
+
+    Hashes are sorted instead of the keys themselves; only the (usually few) rows whose hash
+    repeats are compared exactly, so hash collisions never produce false duplicates.
+
+    Args:
+        keys (np.ndarray): Keys from ``encode_ids``
+        keep ('first' or False): With 'first', the first occurrence of each key is not marked
+
+    Returns:
+        np.ndarray: Boolean mask in input order
+    """
+    if keep not in ('first', False):
+        raise ValueError("keep must be 'first' or False")
+    mask = np.zeros(len(keys), dtype=bool)
+    if len(keys) < 2:
+        return mask
+    hashes = _hash_keys(keys)
+    sorted_hashes = np.sort(hashes)
+    repeated = np.unique(sorted_hashes[1:][sorted_hashes[1:] == sorted_hashes[:-1]])
+    if len(repeated) == 0:
+        return mask
+
+    # A bitmap on the low hash bits narrows the rows down before the exact membership test.
+    bits = min(max(int(np.ceil(np.log2(len(repeated)))) + 8, 16), 26)
+    low_bits = np.uint64((1 << bits) - 1)
+    bitmap = np.zeros(1 << bits, dtype=bool)
+    bitmap[(repeated & low_bits).astype(np.int64)] = True
+    maybe = np.flatnonzero(bitmap[(hashes & low_bits).astype(np.int64)])
+    pos = np.minimum(np.searchsorted(repeated, hashes[maybe]), len(repeated) - 1)
+    candidates = maybe[repeated[pos] == hashes[maybe]]
+    candidate_keys = pd.Series(keys[candidates])
+    mask[candidates] = candidate_keys.duplicated(keep=keep).to_numpy()
+    return mask
+
+
+def count_duplicate_ids(ids: ArrayLike) -> int:
+    """
+    Exact number of rows whose (non-missing) ID already occurred in an earlier row.
+
+    Args:
+        ids (pd.Series, np.ndarray or list): Unit identifiers
+
+    Returns:
+        int: Rows that repeat an earlier row's ID; missing IDs are not counted
+    """
+    ids = ids if isinstance(ids, pd.Series) else pd.Series(ids)
+    return int(duplicate_mask(encode_ids(ids[ids.notna()]), keep='first').sum())
+
+
+def handle_duplicate_units(data: pd.DataFrame, unit_col: str, policy: str = 'flag',
+                           sum_columns: Optional[Sequence[str]] = None) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Detect units that occur in more than one row and resolve them.
+
+    Args:
+        data (pd.DataFrame): Dataset with one row per unit expected
+        unit_col (str): Column with (normalized) unit IDs
+        policy (str): 'flag' adds a boolean ``is_duplicate_unit`` column and keeps all rows;
+            'drop' keeps only the first row of each unit; 'aggregate' keeps one row per unit
+            with ``sum_columns`` summed over its rows and the first value of other columns
+        sum_columns (Sequence[str], optional): Numeric columns to sum under 'aggregate'.
+            Defaults to the numeric columns other than ``unit_col`` that are not 0/1
+            indicators, whose sums would no longer be proportions. Pass the list explicitly
+            to leave out numeric labels such as a pre-existing group column
+
+    Returns:
+        Tuple[pd.DataFrame, dict]: Resolved dataset and counts of 'rows', 'units',
+            'duplicate_units' and 'duplicate_rows' (rows belonging to duplicated units)
+    """
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unsupported duplicate policy: {policy}. "
+                         f"Available policies: {', '.join(DUPLICATE_POLICIES)}")
+    if sum_columns is not None:
+        invalid = [col for col in sum_columns if col == unit_col or col not in data.columns
+                   or not _is_summable(data[col])]
+        if invalid:
+            raise ValueError(f"Cannot sum column(s) over duplicate units: {', '.join(map(str, invalid))}")
+    keys = encode_ids(data[unit_col])
+    repeats = duplicate_mask(keys, keep='first')
+    n_repeats = int(repeats.sum())
+    any_duplicate = duplicate_mask(keys, keep=False) if n_repeats else np.zeros(len(keys), dtype=bool)
+    summary = {
+        'rows': len(data),
+        'units': len(data) - n_repeats,
+        'duplicate_units': int(any_duplicate.sum()) - n_repeats,
+        'duplicate_rows': int(any_duplicate.sum()),
+    }
+
+    if policy == 'flag':
+        result = data.copy(deep=False)
+        result[DUPLICATE_FLAG_COLUMN] = any_duplicate
+        return result, summary
+    if n_repeats == 0:
+        return data, summary
+
+    result = data[~repeats]
+    if policy == 'aggregate':
+        numeric_cols = (list(sum_columns) if sum_columns is not None
+                        else _default_sum_columns(data, exclude=[unit_col]))
+        if numeric_cols:
+            # Only rows of duplicated units are grouped; all other rows are already final.
+            duplicated_rows = data.loc[any_duplicate, numeric_cols]
+            totals = duplicated_rows.groupby(keys[any_duplicate], sort=False).sum()
+            firsts = any_duplicate & ~repeats
+            result = result.copy()
+            result.loc[firsts[~repeats], numeric_cols] = totals.loc[keys[firsts]].to_numpy()
+    return result, summary
+
+
+def _is_summable(column: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column)
+
+
+def _is_indicator(column: pd.Series) -> bool:
+    values = column.dropna()
+    return bool(((values == 0) | (values == 1)).all())
+
+
+def _default_sum_columns(data: pd.DataFrame, exclude: List[str]) -> List[str]:
+    return [col for col in data.columns
+            if col not in exclude and _is_summable(data[col]) and not _is_indicator(data[col])]